@@ -0,0 +1,299 @@
+"""
+This script crops every case of an nnU-Net dataset to the tight bounding box of its foreground,
+removing the empty padding around the retina that the data loaders would otherwise decode every epoch.
+
+Functionality:
+- Computes the foreground bounding box of each case from its label map (or, for images without
+  labels, from an intensity threshold) with one projection per axis, and pads it with a margin
+- Crops all image channels and the label map of a case with the same box, reading only the
+  TIFF pages inside the box
+- Records the box and original shape under "crop" in the per-case .json files, so predictions
+  can be pasted back into full-size volumes with --restore
+- Reports the voxels and disk space saved across the dataset
+
+Usage:
+    python autocrop_dataset.py --path /path/to/nnUNet_raw/Dataset001_OCTAVE --margin 8
+    python autocrop_dataset.py --path /path/to/Dataset001_OCTAVE --ignore_labels 10 11 --axes y
+    python autocrop_dataset.py --path /path/to/Dataset001_OCTAVE/autocropped --restore /path/to/predictions
+
+Output:
+    <path>/<output_dir>/ with the same imagesTr/labelsTr/imagesTs/labelsTs layout and dataset.json
+    With --restore: <restore>/<output_dir>/ with the full-size predictions
+
+Notes:
+- Label values passed to --ignore_labels (e.g. vitreous) do not count as foreground
+- Images without a label map are only cropped if --threshold is set, otherwise they are copied unchanged
+"""
+
+import os
+import glob
+import json
+import shutil
+import argparse
+import numpy as np
+import tifffile as tif
+from octvision3d.utils import get_filenames, create_directory, run_parallel, print_failures, save_json
+from octvision3d.tiff_io import add_tiff_writer_args, tiff_writer_options, write_tiff
+from octvision3d.crop_cases import crop_volume
+
+DATASET_FOLDERS = [("imagesTr", "labelsTr"), ("imagesTs", "labelsTs")]
+AXES = ["z", "y", "x"]
+
+def foreground_bbox(mask, margin=0, axes=AXES):
+    """
+    Compute the bounding box of the foreground of a (Z, Y, X) volume, padded with a margin.
+
+    Parameters:
+    - mask: np.ndarray of dtype bool and shape (Z, Y, X), True for foreground voxels
+    - margin: int or list of 3 int, voxels added on each side of the box, per axis (Z, Y, X)
+    - axes: list of str, axes to crop ("z", "y", "x"); other axes keep their full range
+
+    Returns:
+    - bbox: list of 3 [start, end) pairs of int, one per axis (Z, Y, X). The full volume if
+      there is no foreground
+    """
+    margins = [margin] * 3 if np.isscalar(margin) else list(margin)
+    bbox = []
+    for axis, name in enumerate(AXES):
+        size = mask.shape[axis]
+        # Projection of the mask on this axis: one reduction over the two other axes
+        projection = np.flatnonzero(mask.any(axis=tuple(a for a in range(3) if a != axis)))
+        if name not in axes or len(projection) == 0:
+            bbox.append([0, size])
+            continue
+        bbox.append([max(int(projection[0]) - margins[axis], 0), min(int(projection[-1]) + 1 + margins[axis], size)])
+    return bbox
+
+def bbox_spec(bbox, shape):
+    """Convert a (Z, Y, X) bounding box into a `crop_cases` crop spec for a volume of shape (Z, Y, X)."""
+    (z0, z1), (y0, y1), (x0, x1) = bbox
+    return {
+        "left": x0, "right": shape[2] - x1,
+        "up": y0, "down": shape[1] - y1,
+        "remove_slices": list(range(0, z0)) + list(range(z1, shape[0])),
+    }
+
+def uncrop(array, crop, fill=0):
+    """
+    Paste a cropped (Z, Y, X) array back into a full-size volume.
+
+    Parameters:
+    - array: np.ndarray, cropped volume, e.g. a predicted label map
+    - crop: dict, the "crop" entry of a case .json file, with keys "bbox" and "original_shape"
+    - fill: value of the voxels outside the box (default: 0, background)
+
+    Returns:
+    - restored: np.ndarray of shape crop["original_shape"] and the dtype of `array`
+    """
+    restored = np.full(crop["original_shape"], fill, dtype=array.dtype)
+    restored[tuple(slice(start, end) for start, end in crop["bbox"])] = array
+    return restored
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def autocrop_case(case_name, image_paths, label_path, json_paths, images_dir, labels_dir,
+                  margin=0, axes=AXES, ignore_labels=(), threshold=None, tiff_options=None):
+    """
+    Crop the image channels and label map of one case to their foreground bounding box.
+
+    Parameters:
+    - case_name: str, case identifier
+    - image_paths: list of str, image channel TIFFs (<case>_0000.tif, ...)
+    - label_path: str or None, label map TIFF (<case>.tif)
+    - json_paths: list of str, the case .json files next to the images and labels
+    - images_dir, labels_dir: str, output folders
+    - margin, axes: see `foreground_bbox`
+    - ignore_labels: list of int, label values that are not foreground
+    - threshold: float, optional intensity above which image voxels are foreground, used when
+      there is no label map
+    - tiff_options: dict, optional TIFF writer options
+
+    Returns:
+    - stats: dict with the voxels and bytes of the case before and after cropping
+    """
+    with tif.TiffFile(image_paths[0]) as tif_file:
+        shape = tuple(tif_file.series[0].shape)
+    if label_path is not None:
+        labels = tif.imread(label_path)
+        mask = labels > 0
+        if len(ignore_labels):
+            mask &= ~np.isin(labels, ignore_labels)
+    elif threshold is not None:
+        mask = tif.imread(image_paths[0]) > threshold
+    else:
+        mask = np.ones(shape, dtype=bool)
+    bbox = foreground_bbox(mask, margin, axes)
+    spec = bbox_spec(bbox, shape)
+
+    inputs = image_paths + ([label_path] if label_path else [])
+    outputs = [os.path.join(images_dir, os.path.basename(p)) for p in image_paths]
+    if label_path:
+        outputs.append(os.path.join(labels_dir, os.path.basename(label_path)))
+    for src, dst in zip(inputs, outputs):
+        write_tiff(dst, crop_volume(src, spec), tiff_options)
+
+    crop = {"bbox": bbox, "original_shape": list(shape)}
+    for json_path in json_paths:
+        properties = _read_json(json_path)
+        properties["crop"] = crop
+        out_dir = images_dir if os.path.dirname(json_path) == os.path.dirname(image_paths[0]) else labels_dir
+        save_json(properties, os.path.join(out_dir, os.path.basename(json_path)))
+
+    cropped_shape = [end - start for start, end in bbox]
+    return {
+        "voxels_before": int(np.prod(shape)) * len(inputs),
+        "voxels_after": int(np.prod(cropped_shape)) * len(inputs),
+        "bytes_before": sum(os.path.getsize(p) for p in inputs),
+        "bytes_after": sum(os.path.getsize(p) for p in outputs),
+    }
+
+def restore_case(pred_path, json_path, output_path, tiff_options=None):
+    """
+    Paste a prediction of a cropped case back into its full-size volume.
+
+    Parameters:
+    - pred_path: str, predicted label map TIFF of the cropped case
+    - json_path: str, .json file of the cropped case with its "crop" entry
+    - output_path: str, path of the full-size label map to write
+    - tiff_options: dict, optional TIFF writer options
+
+    Returns:
+    - output_path: str
+    """
+    crop = _read_json(json_path).get("crop")
+    if crop is None:
+        shutil.copyfile(pred_path, output_path)
+    else:
+        write_tiff(output_path, uncrop(tif.imread(pred_path), crop), tiff_options)
+    return output_path
+
+def dataset_tasks(path, output_path):
+    """List the autocrop tasks of all cases of an nnU-Net dataset folder."""
+    tasks = []
+    for images, labels in DATASET_FOLDERS:
+        images_dir, labels_dir = os.path.join(path, images), os.path.join(path, labels)
+        if not os.path.isdir(images_dir):
+            continue
+        out_images, out_labels = os.path.join(output_path, images), os.path.join(output_path, labels)
+        create_directory(out_images)
+        case_names = sorted({os.path.basename(p).rsplit("_", 1)[0] for p in get_filenames(images_dir, "tif")})
+        for name in case_names:
+            image_paths = sorted(glob.glob(os.path.join(images_dir, f"{name}_[0-9][0-9][0-9][0-9].tif")))
+            label_path = os.path.join(labels_dir, f"{name}.tif")
+            if not os.path.exists(label_path):
+                label_path = None
+            else:
+                create_directory(out_labels)
+            json_paths = [p for p in (os.path.join(images_dir, f"{name}.json"), os.path.join(labels_dir, f"{name}.json"))
+                          if os.path.exists(p)]
+            tasks.append((name, image_paths, label_path, json_paths, out_images, out_labels))
+    return tasks
+
+def print_report(results):
+    """Print the voxels and disk space saved by cropping."""
+    results = [r for r in results if r is not None]
+    totals = {key: sum(r[key] for r in results) for key in ["voxels_before", "voxels_after", "bytes_before", "bytes_after"]}
+    if not results or not totals["voxels_before"]:
+        return
+    voxels_saved = totals["voxels_before"] - totals["voxels_after"]
+    bytes_saved = totals["bytes_before"] - totals["bytes_after"]
+    print(f"{len(results)} cases cropped")
+    print(f"Voxels: {totals['voxels_before']:,} -> {totals['voxels_after']:,} "
+          f"({voxels_saved / totals['voxels_before']:.1%} saved)")
+    print(f"Disk: {totals['bytes_before'] / 2**20:.1f} MiB -> {totals['bytes_after'] / 2**20:.1f} MiB "
+          f"({bytes_saved / max(totals['bytes_before'], 1):.1%} saved)")
+
+def main():
+    tiff_options = tiff_writer_options(FLAGS)
+
+    if FLAGS.restore:
+        output_dir = os.path.join(FLAGS.restore, FLAGS.output_dir)
+        create_directory(output_dir)
+        tasks = []
+        for pred_path in get_filenames(FLAGS.restore, "tif"):
+            name = os.path.basename(pred_path)[:-len(".tif")]
+            json_path = next((p for p in (os.path.join(FLAGS.path, folder, f"{name}.json")
+                                          for pair in DATASET_FOLDERS for folder in pair) if os.path.exists(p)), None)
+            if json_path is None:
+                raise ValueError(f"No .json file with the crop of {name} found in {FLAGS.path}")
+            tasks.append((pred_path, json_path, os.path.join(output_dir, os.path.basename(pred_path)), tiff_options))
+        _, failures = run_parallel(restore_case, tasks, workers=FLAGS.workers, desc="Restoring predictions")
+        print_failures(failures, len(tasks))
+        print(f"Full-size predictions saved to {output_dir}")
+        return
+
+    output_path = os.path.join(FLAGS.path, FLAGS.output_dir)
+    tasks = [task + (FLAGS.margin, FLAGS.axes, FLAGS.ignore_labels, FLAGS.threshold, tiff_options)
+             for task in dataset_tasks(FLAGS.path, output_path)]
+    if len(tasks) == 0:
+        raise ValueError(f"No nnU-Net images found in {FLAGS.path}")
+    results, failures = run_parallel(autocrop_case, tasks, workers=FLAGS.workers, desc="Cropping cases")
+    print_failures(failures, len(tasks))
+
+    if os.path.exists(os.path.join(FLAGS.path, "dataset.json")):
+        shutil.copy(os.path.join(FLAGS.path, "dataset.json"), os.path.join(output_path, "dataset.json"))
+    print_report(results)
+    print(f"Cropped dataset saved to {output_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--path",
+        type=str,
+        required=True,
+        help="nnU-Net dataset folder (containing imagesTr, labelsTr, ...)"
+    )
+    parser.add_argument(
+        "--margin",
+        type=int,
+        nargs="+",
+        default=[8],
+        help="Voxels kept around the foreground, one value or one per axis (Z Y X)"
+    )
+    parser.add_argument(
+        "--axes",
+        type=str,
+        nargs="+",
+        default=AXES,
+        choices=AXES,
+        help="Axes to crop"
+    )
+    parser.add_argument(
+        "--ignore_labels",
+        type=int,
+        nargs="*",
+        default=[],
+        help="Label values that do not count as foreground (e.g. vitreous)"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=None,
+        help="Intensity above which voxels of images without labels are foreground"
+    )
+    parser.add_argument(
+        "--restore",
+        type=str,
+        default=None,
+        help="Folder of predictions on the cropped dataset at --path to paste back into full-size volumes"
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="autocropped",
+        help="name of output folder"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes"
+    )
+    add_tiff_writer_args(parser)
+    FLAGS, _ = parser.parse_known_args()
+    if len(FLAGS.margin) not in (1, 3):
+        parser.error("--margin takes one value or one per axis (Z Y X)")
+    FLAGS.margin = FLAGS.margin[0] if len(FLAGS.margin) == 1 else FLAGS.margin
+    main()
@@ -0,0 +1,116 @@
+"""
+This script benchmarks the multithreaded .nrrd writer of `nrrd_io` against `nrrd.write` on real
+segmentation volumes, to choose the `--gzip_level` / `--gzip_threads` options of the label-edit scripts.
+
+Functionality:
+- Reads every .seg.nrrd file in the folder once and rewrites it with `nrrd.write` and with
+  `nrrd_io.write_nrrd` for each compression level and thread count
+- Reports the total file size, write time and speedup over `nrrd.write` at the same level
+- Checks that every written file decodes (with `nrrd.read`) to the original array
+
+Usage:
+    python benchmark_nrrd_writer.py --path /path/to/nrrd/files
+    python benchmark_nrrd_writer.py --path /path/to/nrrd/files --levels 1 6 9 --threads 1 4 8 --max_files 5
+
+Notes:
+- Files are written to a temporary folder that is removed afterwards
+"""
+
+import os
+import time
+import nrrd
+import shutil
+import tempfile
+import argparse
+import numpy as np
+from octvision3d.utils import get_filenames
+from octvision3d.nrrd_io import write_nrrd
+
+def benchmark_writer(volumes, tmp_dir, level, threads=None):
+    """
+    Write a list of volumes with one writer configuration and check that they read back unchanged.
+
+    Parameters:
+    - volumes: list of (data, header) tuples as returned by `nrrd.read`
+    - tmp_dir: str, folder to write the files to
+    - level: int, gzip compression level
+    - threads: int, number of `write_nrrd` threads, or None to use `nrrd.write`
+
+    Returns:
+    - result: dict with keys "size" (bytes) and "write" (s), summed over all volumes
+    """
+    paths = [os.path.join(tmp_dir, f"{i}.seg.nrrd") for i in range(len(volumes))]
+
+    start = time.perf_counter()
+    for path, (data, header) in zip(paths, volumes):
+        if threads is None:
+            nrrd.write(path, data, header, compression_level=level)
+        else:
+            write_nrrd(path, data, header, {"compression_level": level, "threads": threads})
+    write_time = time.perf_counter() - start
+
+    for path, (data, _) in zip(paths, volumes):
+        if not np.array_equal(nrrd.read(path)[0], data):
+            raise ValueError(f"Round trip mismatch for level {level}, threads {threads} ({path})")
+
+    size = sum(os.path.getsize(path) for path in paths)
+    for path in paths:
+        os.remove(path)
+    return {"size": size, "write": write_time}
+
+def main():
+    files = get_filenames(FLAGS.path, "seg.nrrd")[:FLAGS.max_files]
+    if len(files) == 0:
+        raise ValueError(f"No .seg.nrrd files found at {FLAGS.path}")
+
+    volumes = [nrrd.read(f) for f in files]
+    raw_size = sum(data.nbytes for data, _ in volumes)
+    print(f"{len(volumes)} files, {raw_size / 2**20:.1f} MiB decoded, {os.cpu_count()} CPUs")
+    print(f"{'writer':<12}{'level':>6}{'threads':>9}{'size (MiB)':>12}{'ratio':>8}{'write (s)':>11}{'speedup':>9}")
+
+    tmp_dir = tempfile.mkdtemp(prefix="nrrd_bench_")
+    try:
+        for level in FLAGS.levels:
+            baseline = benchmark_writer(volumes, tmp_dir, level)
+            rows = [("nrrd.write", 1, baseline)]
+            for threads in FLAGS.threads:
+                rows.append(("write_nrrd", threads, benchmark_writer(volumes, tmp_dir, level, threads)))
+            for writer, threads, result in rows:
+                print(f"{writer:<12}{level:>6}{threads:>9}"
+                      f"{result['size'] / 2**20:>12.1f}"
+                      f"{raw_size / result['size']:>8.1f}"
+                      f"{result['write']:>11.2f}"
+                      f"{baseline['write'] / result['write']:>9.2f}")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--path",
+        type=str,
+        required=True,
+        help="Folder of .seg.nrrd files"
+    )
+    parser.add_argument(
+        "--max_files",
+        type=int,
+        default=5,
+        help="Maximum number of files to benchmark"
+    )
+    parser.add_argument(
+        "--levels",
+        type=int,
+        nargs="+",
+        default=[1, 6, 9],
+        help="gzip compression levels to benchmark"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        nargs="+",
+        default=[2, 4, 8],
+        help="Thread counts of the multithreaded writer to benchmark"
+    )
+    FLAGS, _ = parser.parse_known_args()
+    main()
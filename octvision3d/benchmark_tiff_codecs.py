@@ -0,0 +1,159 @@
+"""
+This script benchmarks the TIFF codecs available to the dataset conversion scripts on real OCT
+volumes and label maps, to choose the `--compression` / `--predictor` options of `tiff_io`.
+
+Functionality:
+- Re-encodes every image and label TIFF in the given folders with each codec, with and without predictor
+- Reports the total file size, compression ratio, encode time and decode time (`tifffile.imread`,
+  as used by nnU-Net) of each configuration, separately for images and labels
+- Checks that every re-encoded file decodes to the original array
+
+Usage:
+    python benchmark_tiff_codecs.py --images /path/to/imagesTr --labels /path/to/labelsTr
+    python benchmark_tiff_codecs.py --images /path/to/imagesTr --tile 256 --encoder_threads 4 --max_files 10
+
+Notes:
+- Files are written to a temporary folder that is removed afterwards
+- zstd and LZW require the `imagecodecs` package
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import argparse
+import numpy as np
+import tifffile as tif
+from octvision3d.utils import get_filenames
+from octvision3d.tiff_io import TIFF_COMPRESSIONS, write_tiff
+
+def benchmark_codec(arrays, options, tmp_dir, repeats=1):
+    """
+    Encode and decode a list of arrays with one set of TIFF writer options.
+
+    Parameters:
+    - arrays: list of np.ndarray, decoded volumes or label maps
+    - options: dict, TIFF writer options (see `tiff_io.tiff_writer_options`)
+    - tmp_dir: str, folder to write the encoded files to
+    - repeats: int, number of decode passes; the fastest one is reported
+
+    Returns:
+    - result: dict with keys "size" (bytes), "encode" (s) and "decode" (s), summed over all arrays
+    """
+    paths = [os.path.join(tmp_dir, f"{i}.tif") for i in range(len(arrays))]
+
+    start = time.perf_counter()
+    for path, arr in zip(paths, arrays):
+        write_tiff(path, arr, options)
+    encode_time = time.perf_counter() - start
+
+    decode_time = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        decoded = [tif.imread(path) for path in paths]
+        decode_time = min(decode_time, time.perf_counter() - start)
+
+    for path, arr, dec in zip(paths, arrays, decoded):
+        if not np.array_equal(arr, dec):
+            raise ValueError(f"Round trip mismatch for {options} ({path})")
+
+    size = sum(os.path.getsize(path) for path in paths)
+    for path in paths:
+        os.remove(path)
+    return {"size": size, "encode": encode_time, "decode": decode_time}
+
+def run_benchmark(files, name):
+    """
+    Benchmark every codec and predictor combination on a set of TIFF files and print a table.
+
+    Parameters:
+    - files: list of str, TIFF files to benchmark
+    - name: str, label for the printed table (e.g. "images")
+    """
+    arrays = [tif.imread(f) for f in files]
+    raw_size = sum(arr.nbytes for arr in arrays)
+    print(f"\n{name}: {len(arrays)} files, {raw_size / 2**20:.1f} MiB decoded")
+    print(f"{'codec':<8}{'predictor':>10}{'size (MiB)':>12}{'ratio':>8}{'encode (s)':>12}{'decode (s)':>12}{'decode MiB/s':>14}")
+
+    tmp_dir = tempfile.mkdtemp(prefix="tiff_bench_")
+    try:
+        for compression in TIFF_COMPRESSIONS:
+            for predictor in ([False] if compression == "none" else [False, True]):
+                options = {
+                    "compression": compression,
+                    "compression_level": FLAGS.compression_level,
+                    "predictor": predictor,
+                    "tile": FLAGS.tile,
+                    "encoder_threads": FLAGS.encoder_threads,
+                }
+                try:
+                    result = benchmark_codec(arrays, options, tmp_dir, repeats=FLAGS.repeats)
+                except Exception as e:
+                    print(f"{compression:<8}{str(predictor):>10}  skipped ({type(e).__name__}: {e})")
+                    continue
+                print(f"{compression:<8}{str(predictor):>10}"
+                      f"{result['size'] / 2**20:>12.1f}"
+                      f"{raw_size / result['size']:>8.2f}"
+                      f"{result['encode']:>12.2f}"
+                      f"{result['decode']:>12.2f}"
+                      f"{raw_size / 2**20 / result['decode']:>14.0f}")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def main():
+    if not FLAGS.images and not FLAGS.labels:
+        raise ValueError("Need to specify --images and/or --labels")
+    for name, path in [("images", FLAGS.images), ("labels", FLAGS.labels)]:
+        if not path:
+            continue
+        files = get_filenames(path, ext="tif")[:FLAGS.max_files]
+        if len(files) == 0:
+            raise ValueError(f"No TIFF files found at {path}")
+        run_benchmark(files, name)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--images",
+        type=str,
+        default=None,
+        help="Folder of OCT volume TIFFs (e.g. imagesTr)"
+    )
+    parser.add_argument(
+        "--labels",
+        type=str,
+        default=None,
+        help="Folder of label map TIFFs (e.g. labelsTr)"
+    )
+    parser.add_argument(
+        "--max_files",
+        type=int,
+        default=20,
+        help="Maximum number of files per folder to benchmark"
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="Number of decode passes, the fastest is reported"
+    )
+    parser.add_argument(
+        "--compression_level",
+        type=int,
+        default=None,
+        help="Compression level of the codecs (codec default if not set)"
+    )
+    parser.add_argument(
+        "--tile",
+        type=int,
+        default=0,
+        help="Write square tiles of this size (multiple of 16) instead of strips"
+    )
+    parser.add_argument(
+        "--encoder_threads",
+        type=int,
+        default=1,
+        help="Number of threads used to compress the strips/tiles of each TIFF file"
+    )
+    FLAGS, _ = parser.parse_known_args()
+    main()
@@ -1,85 +1,170 @@
 """
-This script verifies that all pixels in segmentation overlays have been labeled (i.e., not black)
-for each slice in a set of .seg.nrrd segmentation files.
+This script verifies that all pixels of a set of .seg.nrrd segmentation files have been labeled
+exactly once: it reports voxels without any segment (unlabeled) and voxels in several segments (overlapping).
 
 Functionality:
-- Loads .seg.nrrd segmentation masks and corresponding TIFF images
-- Applies color overlays to the segmentation using label metadata
-- Checks for and reports any unlabeled (black) pixels in each slice of the overlay
+- Loads .seg.nrrd segmentation masks and checks them against the corresponding TIFF images
+- Streams each segmentation one Z-slab at a time, so memory use does not grow with volume size
+- Reads both one-hot and layered labelmap (Slicer 5) .seg.nrrd files
+- Counts the segments covering each voxel with one reduction over the segment axis of the bitmap
+- Reports, per slice, the number of unlabeled and overlapping pixels, their bounding box and their
+  runs along X
+- Checks the files of a folder in parallel with --workers
 
 Usage:
-    python script.py --path /path/to/seg/files [--ext seg.nrrd]
+    python script.py --path /path/to/seg/files [--ext seg.nrrd] [--workers 8] [--report qa.json]
 
 Notes:
 - TIFF images must exist alongside .seg.nrrd files with matching filenames
-- Expects segmentations to contain exactly 14 labels
-- Prints location and count of unlabeled pixels per slice, if any are found
+- With --num_segments, checks that each segmentation has that many segments
+- Bounding boxes are inclusive: "x x_min-x_max, y y_min-y_max"
+- With --report, the full report including every run (y, x_start, length) is saved as JSON
 """
 
 from argparse import ArgumentParser
 import numpy as np
 import os
-import nrrd
-from octvision3d.utils import overlay_segments, sorted_rgb_colors,\
-                              get_filenames
+import json
+from octvision3d.utils import get_filenames, run_parallel, print_failures, SegmentTable, segment_layout, segment_masks
+from octvision3d.nrrd_io import read_nrrd_header, iter_nrrd_slabs
 import tifffile as tiff
 
-def check_unlabeled_pixels(overlay, seg_path):
+QA_CHECKS = ["unlabeled", "overlap"]
+
+def segment_coverage(slab, layers, label_values, layered=False):
     """
-    Reports the number of unlabeled (black) pixels in each image slice of an overlay.
+    Count the segments covering each voxel of a chunk of a segmentation.
 
     Parameters:
-    - overlay (list of numpy.ndarray): List of RGB image slices.
-    - seg_path (str): Path to the segmentation overlay for reporting.
+    - slab: np.ndarray, one-hot (num_segments, X, Y, Z) or layered (num_layers, X, Y, Z) / (X, Y, Z) chunk
+    - layers, label_values, layered: as returned by `segment_layout`
 
     Returns:
-    - None
+    - coverage: np.ndarray of dtype uint8 and shape (Z, Y, X)
     """
-    unlabeled = []
-    for i, image in enumerate(overlay):
-        # Sum the RGB values of each pixel. Black pixels will sum to 0.
-        pixel_sums = np.sum(image, axis=-1)
-
-        # Identify black pixels (sum == 0) and count them
-        n_unlabeled_pixels = np.count_nonzero(pixel_sums == 0)
-        x, y = np.where(pixel_sums == 0)
-        locations = list(zip(x.tolist(), y.tolist()))
-
-        if n_unlabeled_pixels > 0:
-            unlabeled.append(f"{os.path.basename(seg_path)}, Slice {i}: {n_unlabeled_pixels} pixels unlabeled")
-            unlabeled.append(f"shape: {pixel_sums.shape}, locations {locations}")
-
-    if unlabeled:
-        for s in unlabeled:
-            print(s)
-    else:
-        print(f"No unlabeled pixels found in {os.path.basename(seg_path)}")
+    masks = segment_masks(slab, layers, label_values, layered)
+    return masks.sum(axis=0, dtype=np.uint8).T
 
-def main():
-    filenames = get_filenames(FLAGS.path, ext=FLAGS.ext)
-    tif_filenames = get_filenames(FLAGS.path, ext="tif")
+def mask_runs(mask):
+    """
+    Run-length encode a 2D mask along X.
 
-    if len(filenames) == 0:
-        raise AssertionError(f"No files with found at {FLAGS.path} ending with {FLAGS.ext}")
+    Parameters:
+    - mask: np.ndarray of dtype bool and shape (Y, X)
 
-    for filename, tif_filename in zip(filenames, tif_filenames):
-        # load from .seg.nrrd file
-        bitmap, header = nrrd.read(filename)
-        tif_img = tiff.imread(tif_filename)
+    Returns:
+    - runs: np.ndarray of shape (num_runs, 3), one (y, x_start, length) row per run of True pixels
+    """
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    y_start, x_start = np.nonzero(edges == 1)
+    _, x_end = np.nonzero(edges == -1)
+    return np.stack([y_start, x_start, x_end - x_start], axis=1)
+
+def mask_report(mask, first_slice=0):
+    """
+    Summarise the flagged pixels of each slice of a chunk.
 
-        if tif_img.shape != bitmap.shape[1:][::-1]:
-            raise AssertionError(f"TIF and seg.nrrd bitmap do not have the same shape: {filename}, tif shape: {tif_img.shape}, label: {bitmap.shape[1:][::-1]}")
+    Parameters:
+    - mask: np.ndarray of dtype bool and shape (Z, Y, X)
+    - first_slice: int, index of the first slice of `mask` within the whole volume
 
-        if bitmap.shape[0] != 14:
-            raise AssertionError(f"segmentation shape should have 14 labels. {filename} has {bitmap.shape[0]}")
+    Returns:
+    - report: dict, slice index -> {"count", "bbox": [x_min, x_max, y_min, y_max], "runs": [[y, x_start, length], ...]}
+      for the slices with flagged pixels
+    """
+    report = {}
+    counts = np.count_nonzero(mask, axis=(1, 2))
+    for i in np.flatnonzero(counts):
+        ys = np.flatnonzero(mask[i].any(axis=1))
+        xs = np.flatnonzero(mask[i].any(axis=0))
+        report[first_slice + int(i)] = {
+            "count": int(counts[i]),
+            "bbox": [int(xs[0]), int(xs[-1]), int(ys[0]), int(ys[-1])],
+            "runs": mask_runs(mask[i]).tolist(),
+        }
+    return report
+
+def check_file(seg_path, tif_path=None, num_segments=None, slab_depth=1):
+    """
+    Find the unlabeled and overlapping pixels of a segmentation.
 
-        # get decimal rgb colors (0-1) from header file sorted (segment0, segment1,...)
-        rgb_colors = sorted_rgb_colors(header)
+    Parameters:
+    - seg_path: str, path to the .seg.nrrd file
+    - tif_path: str, optional TIFF image the segmentation must match in shape
+    - num_segments: int, optional expected number of segments
+    - slab_depth: int, number of Z-slices decoded at once
 
-        # overlay segmentations in different channels into one rgb image per 2d slice
-        overlay = overlay_segments(bitmap, rgb_colors)
+    Returns:
+    - report: dict with keys "unlabeled" and "overlap", each mapping slice indices to `mask_report` entries
 
-        check_unlabeled_pixels(overlay, filename)
+    Raises:
+    - AssertionError: if the shape or number of segments doesn't match
+    """
+    # read only the .seg.nrrd header, the bitmap is streamed slab by slab below
+    header, _ = read_nrrd_header(seg_path)
+    volume_shape = tuple(int(i) for i in header["sizes"][-3:][::-1])
+    if tif_path is not None:
+        with tiff.TiffFile(tif_path) as tif_file:
+            tif_shape = tuple(tif_file.series[0].shape)
+        if tif_shape != volume_shape:
+            raise AssertionError(f"TIF and seg.nrrd bitmap do not have the same shape: {seg_path}, tif shape: {tif_shape}, label: {volume_shape}")
+
+    segments = len(SegmentTable.from_header(header))
+    if num_segments is not None and segments != num_segments:
+        raise AssertionError(f"segmentation should have {num_segments} labels. {seg_path} has {segments}")
+
+    layered, layers, label_values = segment_layout(header)
+    report = {check: {} for check in QA_CHECKS}
+    for z, slab in iter_nrrd_slabs(seg_path, slab_depth=slab_depth):
+        coverage = segment_coverage(slab, layers, label_values, layered)
+        report["unlabeled"].update(mask_report(coverage == 0, first_slice=z))
+        report["overlap"].update(mask_report(coverage > 1, first_slice=z))
+    return report
+
+def format_report(seg_path, report):
+    """Format a `check_file` report as compact lines, one per flagged slice."""
+    name = os.path.basename(seg_path)
+    lines = []
+    for check, description in zip(QA_CHECKS, ["unlabeled", "in several segments"]):
+        for z, entry in sorted(report[check].items()):
+            x_min, x_max, y_min, y_max = entry["bbox"]
+            longest = max(length for _, _, length in entry["runs"])
+            lines.append(f"{name}, Slice {z}: {entry['count']} pixels {description}, "
+                         f"x {x_min}-{x_max}, y {y_min}-{y_max}, {len(entry['runs'])} runs (longest {longest})")
+    if not lines:
+        lines.append(f"No unlabeled or overlapping pixels found in {name}")
+    return lines
+
+def main():
+    filenames = get_filenames(FLAGS.path, ext=FLAGS.ext)
+
+    if len(filenames) == 0:
+        raise AssertionError(f"No files with found at {FLAGS.path} ending with {FLAGS.ext}")
+
+    tasks = []
+    for filename in filenames:
+        tif_filename = filename[:-len(FLAGS.ext)] + "tif"
+        if not os.path.exists(tif_filename):
+            raise AssertionError(f"No TIF image found for {filename}")
+        tasks.append((filename, tif_filename, FLAGS.num_segments, FLAGS.slab_depth))
+
+    results, failures = run_parallel(check_file, tasks, workers=FLAGS.workers, desc="Checking segmentations")
+    for (filename, *_), report in zip(tasks, results):
+        if report is not None:
+            for line in format_report(filename, report):
+                print(line)
+
+    checked = [r for r in results if r is not None]
+    for check in QA_CHECKS:
+        print(f"{sum(bool(r[check]) for r in checked)} of {len(checked)} files have {check} pixels")
+    print_failures(failures, len(tasks))
+
+    if FLAGS.report:
+        with open(FLAGS.report, "w") as f:
+            json.dump({os.path.basename(t[0]): r for t, r in zip(tasks, results) if r is not None}, f)
+        print(f"Saved report to {FLAGS.report}")
 
 if __name__ == "__main__":
     parser = ArgumentParser()
@@ -95,5 +180,29 @@ if __name__ == "__main__":
         default="seg.nrrd",
         help="file extension"
     )
+    parser.add_argument(
+        "--slab_depth",
+        type=int,
+        default=1,
+        help="Number of z-slices decoded at once"
+    )
+    parser.add_argument(
+        "--num_segments",
+        type=int,
+        default=None,
+        help="Expected number of segments in each file (not checked if not set)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes"
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default=None,
+        help="Path of a JSON file to save the full report to, including all runs"
+    )
     FLAGS, _ = parser.parse_known_args()
     main()
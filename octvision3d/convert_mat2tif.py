@@ -6,63 +6,118 @@ Functionality:
 - Extracts the image volume using a specified dictionary key (default: "images")
 - Transposes and rotates the volume for correct orientation
 - Saves the result as a .tif file with the same base filename
+- Reads MATLAB v7.3 (HDF5) files with h5py, streaming a few B-scans at a time into the TIFF
+- Converts the files of the directory in parallel with --workers
 
 Usage:
-    python script.py --path /path/to/mat/files [--key images]
+    python script.py --path /path/to/mat/files [--key images] [--workers 8]
 
 Notes:
 - The image data must be stored as a NumPy array under the given key
 - Output TIFFs are saved to the same directory as the input .mat files
+- v7.3 files need h5py, which is only imported when such a file is found
 """
 
 import os
-import tifffile as tif
 import numpy as np
 import scipy.io
 import argparse
-from utils import get_filenames, create_directory
-from tqdm import tqdm
+from utils import get_filenames, create_directory, run_parallel, print_failures
+from tiff_io import add_tiff_writer_args, tiff_writer_options, write_tiff_pages
 
-def convert_mat2tif(path, key="images"):
+# v7.3 .mat files are HDF5 files with a 512-byte MATLAB header (the HDF5 user block)
+MAT_V73_HEADER = b"MATLAB 7.3 MAT-file"
+HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
+
+def is_mat_v73(path):
+    """Check whether a .mat file is a MATLAB v7.3 (HDF5) file."""
+    with open(path, "rb") as f:
+        header = f.read(512 + len(HDF5_SIGNATURE))
+    return header.startswith(MAT_V73_HEADER) or header[512:] == HDF5_SIGNATURE
+
+def _iter_v73_pages(dataset):
     """
-    Convert MATLAB (.mat) files to TIFF (.tif) format.
+    Yield the rotated B-scans of a v7.3 image dataset, reading one HDF5 chunk of B-scans at a time.
+
+    HDF5 stores MATLAB arrays in reverse dimension order, so the dataset already holds the
+    transposed volume and page n of the output is `rot90(dataset[n], k=3)`.
+    """
+    step = dataset.chunks[0] if dataset.chunks else 1
+    for start in range(0, dataset.shape[0], step):
+        for page in dataset[start:start + step]:
+            yield np.rot90(page, k=3)
+
+def convert_file(mat_path, output_path, key="images", tiff_options=None):
+    """
+    Convert a single MATLAB (.mat) file to a TIFF (.tif) file.
 
     Args:
-        path (str): Path to the directory containing .mat files.
+        mat_path (str): Path to the .mat file.
+        output_path (str): Path of the .tif file to write.
         key (str, optional): Key to access the image data in the .mat file. Defaults to "images".
+        tiff_options (dict, optional): TIFF writer options.
 
     Raises:
-        AssertionError: Raised if the loaded data is not a NumPy array.
+        KeyError: Raised if the key is not in the .mat file.
+        AssertionError: Raised if the loaded data is not a 3D array.
+
+    Returns:
+        tuple: Shape of the written (Z, Y, X) volume.
+    """
+    if is_mat_v73(mat_path):
+        import h5py
+        with h5py.File(mat_path, "r") as mat_file:
+            if key not in mat_file:
+                raise KeyError(f"KeyError: {key}. mat_data has keys: {list(mat_file.keys())}")
+            dataset = mat_file[key]
+            assert isinstance(dataset, h5py.Dataset) and dataset.ndim == 3
+            shape = (dataset.shape[0], dataset.shape[2], dataset.shape[1])
+            write_tiff_pages(output_path, _iter_v73_pages(dataset), shape, dataset.dtype, tiff_options)
+        return shape
+
+    # Load only the image variable of the .mat file
+    mat_data = scipy.io.loadmat(mat_path, variable_names=[key])
+
+    # Ensure the loaded data is a NumPy array
+    try:
+        assert isinstance(mat_data[key], np.ndarray) and mat_data[key].ndim == 3
+    except KeyError:
+        raise KeyError(f"KeyError: {key}. mat_data has keys: {list(scipy.io.whosmat(mat_path))}")
+
+    # Transpose numpy and rotate 90 degrees clockwise, written page by page from views
+    volume = mat_data[key].T
+    shape = (volume.shape[0], volume.shape[2], volume.shape[1])
+    write_tiff_pages(output_path, (np.rot90(page, k=3) for page in volume), shape, volume.dtype, tiff_options)
+    return shape
+
+def convert_mat2tif(path, key="images", output_dir="converted", tiff_options=None, workers=1):
+    """
+    Convert MATLAB (.mat) files to TIFF (.tif) format.
+
+    Args:
+        path (str): Path to the directory containing .mat files.
+        key (str, optional): Key to access the image data in the .mat file. Defaults to "images".
+        output_dir (str, optional): Name of the output folder in `path`. Defaults to "converted".
+        tiff_options (dict, optional): TIFF writer options.
+        workers (int, optional): Number of worker processes. Defaults to 1.
 
     Returns:
         None
     """
     # Get a list of .mat file paths
     mat_paths = get_filenames(path, ext="mat")
+    if len(mat_paths) == 0:
+        raise ValueError(f"No .mat files found at {path}")
 
     # Create output directory
-    output_path = os.path.join(path, FLAGS.output_dir)
+    output_path = os.path.join(path, output_dir)
     create_directory(output_path)
-    
-    # Loop through each .mat file
-    for mat_path in tqdm(mat_paths):
-        # Generate output filename by removing extension and appending .tif
-        output_filename = os.path.splitext(os.path.basename(mat_path))[0] + ".tif"
-        
-        # Load .mat file data
-        mat_data = scipy.io.loadmat(mat_path)
-
-        # Ensure the loaded data is a NumPy array
-        try:
-            assert isinstance(mat_data[key], np.ndarray)
-        except KeyError:
-            raise KeyError(f"KeyError: {key}. mat_data has keys: {mat_data.keys()}")
-        
-        # Transpose numpy and rotate 90 degrees clockwise
-        oct_volume = np.rot90(mat_data[key].T, k=3, axes=(1,2))
-        
-        # Write the transposed data to a TIFF file
-        tif.imwrite(os.path.join(output_path, output_filename), oct_volume)
+
+    # Generate output filenames by removing extension and appending .tif
+    tasks = [(mat_path, os.path.join(output_path, os.path.splitext(os.path.basename(mat_path))[0] + ".tif"),
+              key, tiff_options) for mat_path in mat_paths]
+    _, failures = run_parallel(convert_file, tasks, workers=workers, desc="Converting .mat files")
+    print_failures(failures, len(tasks))
 
 if __name__ == "__main__":
     # Parse command line arguments
@@ -85,7 +140,15 @@ if __name__ == "__main__":
         default="converted",
         help="Path to output directory"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes"
+    )
+    add_tiff_writer_args(parser)
     FLAGS, _ = parser.parse_known_args()
-    
+
     # Convert .mat files to .tif format
-    convert_mat2tif(FLAGS.path, key=FLAGS.key)
+    convert_mat2tif(FLAGS.path, key=FLAGS.key, output_dir=FLAGS.output_dir,
+                    tiff_options=tiff_writer_options(FLAGS), workers=FLAGS.workers)
@@ -0,0 +1,113 @@
+"""
+This script converts .seg.nrrd segmentations between the one-hot format, with one full uint8
+channel per segment, and Slicer 5's layered labelmap format, where segments share labelmap
+layers (`Segment<N>_Layer`) and are told apart by their value in the layer (`Segment<N>_LabelValue`).
+
+Functionality:
+- `--format layered` packs the segments into as few layers as possible. Mutually exclusive
+  segments end up in a single (X, Y, Z) labelmap, 1/num_segments of the one-hot size
+- `--format onehot` expands layered files back to one channel per segment
+- Files already in the requested format are left unchanged (copied as-is with --output_dir)
+- Segment names, colors and other header fields are kept
+
+Usage:
+    python convert_segnrrd_format.py --path /path/to/nrrd/files --format layered
+    python convert_segnrrd_format.py --path /path/to/file.seg.nrrd --format onehot --output_dir onehot
+
+Notes:
+- Without --output_dir, files are converted in place
+"""
+
+import os
+import nrrd
+import shutil
+import argparse
+from octvision3d.utils import (get_filenames,
+                               create_directory,
+                               run_parallel,
+                               print_failures,
+                               segment_layout,
+                               onehot_to_layered,
+                               layered_to_onehot)
+from octvision3d.nrrd_io import (read_nrrd_header,
+                                 add_nrrd_writer_args,
+                                 nrrd_writer_options,
+                                 write_nrrd)
+
+SEGMENTATION_FORMATS = ["layered", "onehot"]
+
+def convert_file(path, output_path, target_format, nrrd_options=None):
+    """
+    Convert a single .seg.nrrd file to the one-hot or layered labelmap format.
+
+    Parameters:
+    - path: str, path to the .seg.nrrd file
+    - output_path: str, path to write the converted file to (may be `path`)
+    - target_format: str, "layered" or "onehot"
+    - nrrd_options: dict, optional writer options (see `nrrd_io.nrrd_writer_options`)
+
+    Returns:
+    - converted: bool, False if the file was already in the target format
+    """
+    header, _ = read_nrrd_header(path)
+    layered, _, _ = segment_layout(header)
+    if layered == (target_format == "layered"):
+        if os.path.abspath(output_path) != os.path.abspath(path):
+            shutil.copyfile(path, output_path)
+        return False
+
+    data, header = nrrd.read(path)
+    convert = onehot_to_layered if target_format == "layered" else layered_to_onehot
+    data, header = convert(data, header)
+    write_nrrd(output_path, data, header, nrrd_options)
+    return True
+
+def main():
+    files = get_filenames(FLAGS.path, "seg.nrrd") if os.path.isdir(FLAGS.path) else [FLAGS.path]
+    if len(files) == 0:
+        raise ValueError(f"No .seg.nrrd files found at {FLAGS.path}")
+
+    if FLAGS.output_dir:
+        output_dir = os.path.join(os.path.dirname(files[0]), FLAGS.output_dir)
+        create_directory(output_dir)
+        output_paths = [os.path.join(output_dir, os.path.basename(f)) for f in files]
+    else:
+        output_paths = files
+
+    nrrd_options = nrrd_writer_options(FLAGS)
+    tasks = [(f, o, FLAGS.format, nrrd_options) for f, o in zip(files, output_paths)]
+    results, failures = run_parallel(convert_file, tasks, workers=FLAGS.workers, desc=f"Converting to {FLAGS.format}")
+    print(f"Converted {sum(bool(r) for r in results)} of {len(files)} files to {FLAGS.format}")
+    print_failures(failures, len(tasks))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--path",
+        type=str,
+        required=True,
+        help="Path to a .seg.nrrd file or a folder of .seg.nrrd files"
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        required=True,
+        choices=SEGMENTATION_FORMATS,
+        help="Segmentation format to convert to"
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default=None,
+        help="Name of output folder next to the input files (default: convert in place)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes"
+    )
+    add_nrrd_writer_args(parser)
+    FLAGS, _ = parser.parse_known_args()
+    main()
@@ -1,25 +1,87 @@
 """
-This script converts a TIFF volume into PNG slices and optionally overlays the corresponding 
+This script converts a TIFF volume into PNG slices and optionally overlays the corresponding
 segmentation stored in a .seg.nrrd file.
 
 Functionality:
 - If --save_label is not set: saves each TIFF slice as an individual PNG in a PNG_output folder.
 - If --save_label is set: loads the .seg.nrrd file with the same base name, generates color-coded
   overlays using label metadata, and saves overlay images to overlay_output.
+- With --alpha, segment colors are alpha-blended onto the OCT slices instead of drawn on black.
+- --path can also be a folder or a glob pattern, to export every TIFF volume it matches.
+- Exports every --stride-th slice or only the --slices given, decoding only those TIFF pages and .seg.nrrd slices.
+- Slices are composed and encoded on a pool of --threads threads, one slice at a time.
+- With --montage, writes one contact sheet per volume instead: a grid of downscaled slices, each
+  shown next to its overlay with --save_label or --label_dir. Volumes are processed in parallel with --workers.
 
 Usage:
-    python script.py --path /path/to/image.tif [--save_label]
+    python script.py --path /path/to/image.tif [--save_label] [--alpha 0.5]
+    python script.py --path "/path/to/volumes/*.tif" --save_label --stride 4 --threads 8 --png_compression 1
+    python script.py --path /path/to/volumes --save_label --montage --thumb_width 256 --grid_cols 5 --workers 8
+    python script.py --path nnUNet_Dataset/imagesTr --label_dir nnUNet_Dataset/labelsTr --montage
+
+Notes:
+- PNG files are named <filename>-<z>.png (or <filename>-overlay-<z>.png) after the original slice index z.
+- Montages are saved to montage_output/<filename>-montage.png. Overlays use the segment colors of the
+  .seg.nrrd header, or `get_OCT_colors` for nnU-Net label maps from --label_dir.
 """
 
 import os
-import nrrd
+import glob
 import numpy as np
 import tifffile as tif
 from argparse import ArgumentParser
-from utils import create_directory, overlay_segments, sorted_rgb_colors
+from concurrent.futures import ThreadPoolExecutor
+from utils import (create_directory,
+                   render_labels,
+                   label_palette,
+                   sorted_rgb_colors,
+                   get_OCT_colors,
+                   run_parallel,
+                   print_failures)
+from nrrd_io import read_nrrd_header, read_label_slices
 import cv2
 
-def save_png(vol, output_dir, filename, seg=False):
+def select_slices(depth, stride=1, slices=None):
+    """
+    Choose the slices to export.
+
+    Parameters:
+    - depth: int, number of slices of the volume
+    - stride: int, export every stride-th slice (default: 1, all slices)
+    - slices: list of int, optional slice indices to export instead (negative indices allowed)
+
+    Returns:
+    - indices: list of int, sorted slice indices
+    """
+    if slices:
+        for z in slices:
+            if not -depth <= z < depth:
+                raise ValueError(f"Slice {z} out of range for {depth} slices")
+        return sorted({z % depth for z in slices})
+    return list(range(0, depth, stride))
+
+def read_slices(path, indices):
+    """Read some slices of a (Z, Y, X) TIFF volume, decoding only their pages when it is stored one slice per page."""
+    with tif.TiffFile(path) as tif_file:
+        shape = tif_file.series[0].shape
+        paged = len(shape) == 3 and len(tif_file.pages) == shape[0]
+    if not paged:
+        return tif.imread(path)[indices]
+    return tif.imread(path, key=indices).reshape((len(indices),) + tuple(shape[1:]))
+
+def _map_slices(func, indices, threads=1):
+    """Call `func(i, z)` for each position i and slice index z, on a thread pool (cv2 releases the GIL)."""
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(func, range(len(indices)), indices))
+    else:
+        for i, z in enumerate(indices):
+            func(i, z)
+
+def _png_params(compression=None):
+    return [] if compression is None else [cv2.IMWRITE_PNG_COMPRESSION, compression]
+
+def save_png(vol, output_dir, filename, seg=False, indices=None, threads=1, compression=None):
     """
     Save a 3D volume as individual PNG slices.
 
@@ -28,59 +90,186 @@ def save_png(vol, output_dir, filename, seg=False):
     - output_dir: str, directory where the PNG files will be saved
     - filename: str, base name used to generate the output PNG filenames
     - seg: bool, optional flag (currently unused) indicating if the volume is a segmentation
+    - indices: list of int, optional original slice index of each slice of `vol`, used in the file names
+    - threads: int, number of threads encoding slices
+    - compression: int, optional PNG compression level (0-9)
 
     Returns:
     - None. Writes PNG images to disk as <filename>-<z>.png for each slice z.
     """
-    for z in range(vol.shape[0]):
-        cv2.imwrite(os.path.join(output_dir, f"{filename}-{z}.png"), vol[z])
+    indices = list(range(vol.shape[0])) if indices is None else indices
+    params = _png_params(compression)
+
+    def write(i, z):
+        cv2.imwrite(os.path.join(output_dir, f"{filename}-{z}.png"), vol[i], params)
 
-def save_overlay(vol, overlay, output_dir, filename):
+    _map_slices(write, indices, threads)
+
+def _compose_overlay(image, labels, bgr_palette, alpha=None):
+    """Place a grayscale slice and its color overlay side by side, as a BGR image."""
+    overlay = render_labels(labels, bgr_palette, image=None if alpha is None else image, alpha=alpha or 1.0)
+    return np.concatenate((cv2.cvtColor(image, cv2.COLOR_GRAY2BGR), overlay), axis=1) # change axis to 0 for top-bottom config
+
+def save_overlay(vol, labels, palette, output_dir, filename, alpha=None, indices=None, threads=1, compression=None):
     """
     Save overlay images by concatenating grayscale volume slices with color segmentation overlays.
 
+    Each overlay slice is composed just before it is encoded, so no RGB copy of the volume is made.
+
     Parameters:
     - vol: np.ndarray, 3D grayscale volume of shape [depth, height, width]
-    - overlay: np.ndarray, 4D RGB segmentation overlays of shape [depth, height, width, 3]
+    - labels: np.ndarray, label map of the same shape as `vol`
+    - palette: np.ndarray of shape (L, 3), RGB color of each label value (see `label_palette`)
     - output_dir: str, directory to save the overlay images
     - filename: str, base name for output files
+    - alpha: float, optional opacity of the segment colors blended onto the slice. If None, colors are drawn on black
+    - indices: list of int, optional original slice index of each slice of `vol`, used in the file names
+    - threads: int, number of threads composing and encoding slices
+    - compression: int, optional PNG compression level (0-9)
 
     Returns:
     - None. Writes side-by-side overlay PNGs as <filename>-overlay-<z>.png for each slice z.
     """
-    vol = np.stack((vol,)*3, axis=-1)
-    print(vol.shape, overlay.shape)
-    combined_vol = np.concatenate((vol, overlay[:,:,:,::-1]), axis=2) # change axis to 1 for top-bottom config
-    for z in range(combined_vol.shape[0]):
-        cv2.imwrite(os.path.join(output_dir, f"{filename}-overlay-{z}.png"), combined_vol[z]) 
+    indices = list(range(vol.shape[0])) if indices is None else indices
+    params = _png_params(compression)
+    # cv2 writes BGR
+    bgr_palette = np.ascontiguousarray(np.asarray(palette, dtype=np.uint8)[:, ::-1])
 
-def main():
-    if os.path.isdir(FLAGS.path) or not FLAGS.path.endswith((".tif", ".tiff")):
-        raise ValueError("--path should point to a .tif file")
+    def write(i, z):
+        combined = _compose_overlay(vol[i], labels[i], bgr_palette, alpha)
+        cv2.imwrite(os.path.join(output_dir, f"{filename}-overlay-{z}.png"), combined, params)
+
+    _map_slices(write, indices, threads)
+
+def save_montage(vol, output_path, labels=None, palette=None, alpha=None, indices=None,
+                 thumb_width=256, grid_cols=0, threads=1, compression=None):
+    """
+    Save a volume as a single contact sheet: a grid of downscaled slices, with their overlays if labels are given.
+
+    Parameters:
+    - vol: np.ndarray, 3D grayscale volume of shape [depth, height, width]
+    - output_path: str, path of the PNG file to write
+    - labels: np.ndarray, optional label map of the same shape as `vol`
+    - palette: np.ndarray of shape (L, 3), RGB color of each label value, required with `labels`
+    - alpha: float, optional opacity of the segment colors blended onto the slice
+    - indices: list of int, optional original slice index of each slice of `vol`, printed on its tile
+    - thumb_width: int, width of each downscaled slice (and of its overlay) in pixels
+    - grid_cols: int, number of tiles per row (default: 0, a square-ish grid)
+    - threads: int, number of threads composing tiles
+    - compression: int, optional PNG compression level (0-9)
+
+    Returns:
+    - None. Writes one PNG image with ceil(depth / grid_cols) rows of tiles.
+    """
+    indices = list(range(vol.shape[0])) if indices is None else indices
+    depth, height, width = vol.shape
+    thumb_height = max(1, round(height * thumb_width / width))
+    tile_width = thumb_width * (1 if labels is None else 2)
+    cols = grid_cols or int(np.ceil(np.sqrt(depth)))
+    rows = -(-depth // cols)
+    sheet = np.zeros((rows * thumb_height, cols * tile_width, 3), dtype=np.uint8)
+    bgr_palette = None if labels is None else np.ascontiguousarray(np.asarray(palette, dtype=np.uint8)[:, ::-1])
+
+    def place(i, z):
+        if labels is None:
+            tile = cv2.cvtColor(vol[i], cv2.COLOR_GRAY2BGR)
+        else:
+            tile = _compose_overlay(vol[i], labels[i], bgr_palette, alpha)
+        # Area interpolation averages the full-resolution tile, so thin layers stay visible
+        tile = cv2.resize(tile, (tile_width, thumb_height), interpolation=cv2.INTER_AREA)
+        cv2.putText(tile, str(z), (4, 14), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1, cv2.LINE_AA)
+        row, col = divmod(i, cols)
+        sheet[row * thumb_height:(row + 1) * thumb_height, col * tile_width:(col + 1) * tile_width] = tile
+
+    _map_slices(place, indices, threads)
+    cv2.imwrite(output_path, sheet, _png_params(compression))
+
+def tiff_paths(path):
+    """List the TIFF volumes at a path: a .tif file, a folder or a glob pattern."""
+    if os.path.isdir(path):
+        paths = glob.glob(os.path.join(path, "*.tif")) + glob.glob(os.path.join(path, "*.tiff"))
+    else:
+        paths = glob.glob(path)
+    return sorted(p for p in paths if p.endswith((".tif", ".tiff")))
+
+def load_labels(path, indices, label_dir=None):
+    """
+    Load the label map slices and palette of a TIFF volume.
+
+    Parameters:
+    - path: str, path to the TIFF volume
+    - indices: list of int, slices to load
+    - label_dir: str, optional nnU-Net labels folder. If set, the labels of <case>_0000.tif are read
+      from <label_dir>/<case>.tif and colored with `get_OCT_colors`, otherwise they are read from the
+      .seg.nrrd file of the same name and colored with its segment colors
 
-    seg_path = f"{os.path.splitext(FLAGS.path)[0]}.seg.nrrd"
+    Returns:
+    - labels: np.ndarray of shape (len(indices), height, width)
+    - palette: np.ndarray of shape (L, 3), RGB color of each label value
+    """
+    if label_dir:
+        case_name = os.path.splitext(os.path.basename(path))[0].rsplit("_", 1)[0]
+        label_path = os.path.join(label_dir, f"{case_name}.tif")
+        if not os.path.exists(label_path):
+            raise ValueError(f"Could not find label file {label_path}")
+        return read_slices(label_path, indices), get_OCT_colors()
 
-    if FLAGS.save_label and not os.path.exists(seg_path):
+    seg_path = f"{os.path.splitext(path)[0]}.seg.nrrd"
+    if not os.path.exists(seg_path):
         raise ValueError(f"Could not find segmentation file {seg_path}")
+    header, _ = read_nrrd_header(seg_path)
+    return read_label_slices(seg_path, indices), label_palette(sorted_rgb_colors(header))
 
-    vol = tif.imread(FLAGS.path)
-    png_dir = os.path.join(os.path.dirname(FLAGS.path), "PNG_output/")
-    overlay_dir = os.path.join(os.path.dirname(FLAGS.path), "overlay_output/")
-    filename_base = os.path.splitext(os.path.basename(FLAGS.path))[0]
-    
-    if not FLAGS.save_label:
-        create_directory(png_dir)
-        save_png(vol, png_dir, filename_base)
-        print(f"Conversion completed: TIF output in {png_dir}")
+def convert_file(path, options):
+    """
+    Export the PNG slices, overlays or montage of one TIFF volume.
+
+    Parameters:
+    - path: str, path to the TIFF volume
+    - options: dict, parsed command line options (see the argument parser)
 
+    Returns:
+    - output_dir: str, folder the PNG files were written to
+    """
+    with_labels = options["save_label"] or options["label_dir"]
+    with tif.TiffFile(path) as tif_file:
+        depth = tif_file.series[0].shape[0]
+    indices = select_slices(depth, options["stride"], options["slices"])
+    labels, palette = load_labels(path, indices, options["label_dir"]) if with_labels else (None, None)
+    vol = read_slices(path, indices)
+    filename_base = os.path.splitext(os.path.basename(path))[0]
+    threads, compression = options["threads"], options["png_compression"]
+
+    if options["montage"]:
+        output_dir = os.path.join(os.path.dirname(path), "montage_output/")
+        create_directory(output_dir)
+        save_montage(vol, os.path.join(output_dir, f"{filename_base}-montage.png"), labels, palette,
+                     alpha=options["alpha"], indices=indices, thumb_width=options["thumb_width"],
+                     grid_cols=options["grid_cols"], threads=threads, compression=compression)
+    elif not with_labels:
+        output_dir = os.path.join(os.path.dirname(path), "PNG_output/")
+        create_directory(output_dir)
+        save_png(vol, output_dir, filename_base, indices=indices, threads=threads, compression=compression)
     else:
-        create_directory(overlay_dir)
-        bitmap, header = nrrd.read(seg_path)
-        rgb_colors = sorted_rgb_colors(header)
-        print(bitmap.shape)
-        overlay = overlay_segments(bitmap, rgb_colors)
-        save_overlay(vol, overlay, overlay_dir, filename_base)
-        print(f"Conversion completed: overlay output in {overlay_dir}")
+        output_dir = os.path.join(os.path.dirname(path), "overlay_output/")
+        create_directory(output_dir)
+        save_overlay(vol, labels, palette, output_dir, filename_base, alpha=options["alpha"], indices=indices,
+                     threads=threads, compression=compression)
+    return output_dir
+
+def main():
+    paths = tiff_paths(FLAGS.path)
+    if len(paths) == 0:
+        raise ValueError("--path should point to a .tif file, a folder of .tif files or a glob pattern")
+    if FLAGS.stride < 1:
+        raise ValueError(f"--stride must be at least 1, got {FLAGS.stride}")
+
+    options = vars(FLAGS)
+    results, failures = run_parallel(convert_file, [(path, options) for path in paths], workers=FLAGS.workers)
+    print_failures(failures, len(paths))
+    output_dirs = sorted({r for r in results if r is not None})
+    output_type = "montage" if FLAGS.montage else "overlay" if FLAGS.save_label or FLAGS.label_dir else "TIF"
+    print(f"Conversion completed: {output_type} output of {len(paths) - len(failures)} volumes in {', '.join(output_dirs)}")
 
 if __name__ == "__main__":
     parser = ArgumentParser()
@@ -88,7 +277,7 @@ if __name__ == "__main__":
         "--path",
         type=str,
         required=True,
-        help="Path to TIFF image"
+        help="Path to TIFF image, folder of TIFF images or glob pattern"
     )
     parser.add_argument(
         '--save_label',
@@ -96,8 +285,67 @@ if __name__ == "__main__":
         action='store_true',
         help="If enabled, will also save segmentations from .seg.nrrd file of the same name"
     )
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=None,
+        help="If set, blends the segment colors onto the OCT image with this opacity (0-1)"
+    )
+    parser.add_argument(
+        "--stride",
+        type=int,
+        default=1,
+        help="Export every stride-th slice"
+    )
+    parser.add_argument(
+        "--slices",
+        type=int,
+        nargs="*",
+        default=None,
+        help="Slices to export (overrides --stride)"
+    )
+    parser.add_argument(
+        "--png_compression",
+        type=int,
+        default=None,
+        choices=range(10),
+        help="PNG compression level (0-9, OpenCV default if not set)"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of threads encoding PNG slices"
+    )
+    parser.add_argument(
+        "--label_dir",
+        type=str,
+        default=None,
+        help="nnU-Net labels folder to overlay the label maps of <case>.tif from, instead of .seg.nrrd files"
+    )
+    parser.add_argument(
+        "--montage",
+        action="store_true",
+        help="Save one contact sheet of all selected slices per volume instead of one PNG per slice"
+    )
+    parser.add_argument(
+        "--thumb_width",
+        type=int,
+        default=256,
+        help="Width of each slice in the montage, in pixels"
+    )
+    parser.add_argument(
+        "--grid_cols",
+        type=int,
+        default=0,
+        help="Number of slices per montage row (default: square-ish grid)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes, one volume each"
+    )
 
     FLAGS, _ = parser.parse_known_args()
     main()
-
-
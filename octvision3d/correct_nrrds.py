@@ -1,9 +1,9 @@
 """
 This script appends a predefined set of new segment labels with associated RGB colors
 to each .seg.nrrd file in a specified directory. It updates both the header and data
-accordingly using the `add_segmentation_to_header` function.
+accordingly using the `add_segments` function, reading and writing each file once.
 
-After processing, it verifies that all expected labels (original + new) are present
+Before writing, it verifies in memory that all expected labels (original + new) are present
 in the header. If any are missing, it raises an error.
 
 Usage:
@@ -21,10 +21,9 @@ from glob import glob
 from collections import OrderedDict
 from pprint import pprint
 from octvision3d.utils import (get_filenames,
-                               generate_new_segment_data,
-                               find_last_segment_position,
-                               segment_name_already_exists,
-                               add_segmentation_to_header)
+                               add_segments,
+                               verify_segments)
+from octvision3d.nrrd_io import add_nrrd_writer_args, nrrd_writer_options, write_nrrd
 
 def main():
     cmap = OrderedDict([
@@ -38,25 +37,20 @@ def main():
         ("SES", "0.392 0.196 0.0"),
     ])
 
+    labels = ["CNV", "DRU", "EX", "FLU", "GA", "HEM", "RPE", "RET",\
+              "CHO", "VIT", "HYA", "SHS", "ART", "ERM", "SES"]
+
+    nrrd_options = nrrd_writer_options(FLAGS)
+
     # Load the NRRD file
     for f in tqdm(get_filenames(FLAGS.path, "seg.nrrd")):
-        startedAddingSegments = False
-        for k, v in cmap.items():
-            data, header = nrrd.read(f)
-            success = add_segmentation_to_header(data, header, f, k, v, startedAddingSegments)
-            if success and not startedAddingSegments:
-                startedAddingSegments = True
-
         data, header = nrrd.read(f)
-        header_vals = set([i for i in header.values() if type(i)==str])
-        labels = ["CNV", "DRU", "EX", "FLU", "GA", "HEM", "RPE", "RET",\
-                  "CHO", "VIT", "HYA", "SHS", "ART", "ERM", "SES"]
-        err_s = ""
-        for label in labels:
-            if label not in header_vals:
-                err_s += f", {label}" if len(err_s) != 0 else f"{label}"
-        if len(err_s) > 0:
-            raise ValueError(f"ERROR: Labels {err_s} not in final header")
+
+        # Add all new labels at once and verify the result before writing the file
+        data, header, added = add_segments(data, header, cmap, f)
+        verify_segments(data, header, expected_names=labels)
+        if added:
+            write_nrrd(f, data, header, nrrd_options)
 
 
 if __name__ == "__main__":
@@ -73,6 +67,7 @@ if __name__ == "__main__":
         default=False,
         help="Ignore duplicate and just skip over it"
     )
+    add_nrrd_writer_args(parser)
     FLAGS, _ = parser.parse_known_args()
     main()
 
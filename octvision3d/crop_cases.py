@@ -0,0 +1,273 @@
+"""
+This script crops OCT volumes and their .seg.nrrd segmentations and removes Z-slices from them,
+for a whole folder of cases at once, keeping each TIFF and its segmentation in sync.
+
+Functionality:
+- Applies one crop/slice-removal spec to every case, or per-case specs from a JSON file
+- Crops the TIFF volume and the segmentation (one-hot or layered labelmap) with the same spec
+- Updates `sizes`, `space origin` and the `Segment*_Extent` fields of the segmentation header
+- Reads only the kept pages of each TIFF and crops them with views instead of copies
+- Processes cases in parallel with --workers
+
+Usage:
+    python crop_cases.py --path /path/to/data --left 20 --right 20 --up 10 --down 10
+    python crop_cases.py --path /path/to/data --remove_slices 0 48 --workers 8
+    python crop_cases.py --path /path/to/data --spec crops.json
+
+    crops.json maps case names to specs; cases that are not listed use the command line spec:
+    {"case-AMD-000": {"left": 12, "right": 4, "remove_slices": [0]}}
+
+Output:
+    <path>/<output_dir>/<case>.tif and <case>.seg.nrrd
+
+Notes:
+- TIFF volumes are (Z, Y, X) and segmentations (X, Y, Z): left/right crop X, up/down crop Y
+- By default the origin of cropped segmentations is reset to 0, like the cropped TIFF volumes they
+  are loaded with. With --shift_origin it is moved by the cropped offset instead, so the
+  segmentation keeps its position in physical space
+"""
+
+import os
+import json
+import nrrd
+import argparse
+from collections import OrderedDict
+import numpy as np
+import tifffile as tif
+from octvision3d.utils import get_filenames, create_directory, run_parallel, print_failures, SegmentTable, segment_extents
+from octvision3d.nrrd_io import read_nrrd_header, add_nrrd_writer_args, nrrd_writer_options, write_nrrd
+from octvision3d.tiff_io import add_tiff_writer_args, tiff_writer_options, write_tiff
+
+CROP_KEYS = ["left", "right", "up", "down", "remove_slices"]
+
+def crop_index(shape, spec):
+    """
+    Turn a crop spec into indices along X, Y and Z.
+
+    Parameters:
+    - shape: tuple of int, (X, Y, Z) shape of the volume
+    - spec: dict, with optional keys "left", "right" (X), "up", "down" (Y): number of voxels to
+      crop from each side, and "remove_slices": list of Z-slices to remove (negative indices allowed)
+
+    Returns:
+    - x, y: slice, kept X and Y ranges
+    - z: slice, or list of int if the kept Z-slices are not consecutive
+    """
+    unknown = set(spec) - set(CROP_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown crop spec keys {sorted(unknown)}. Valid keys: {CROP_KEYS}")
+    x_dim, y_dim, z_dim = shape
+    x = slice(spec.get("left", 0), x_dim - spec.get("right", 0))
+    y = slice(spec.get("up", 0), y_dim - spec.get("down", 0))
+
+    removed = set()
+    for i in spec.get("remove_slices", []):
+        if not -z_dim <= i < z_dim:
+            raise ValueError(f"Slice {i} out of range for {z_dim} slices")
+        removed.add(i % z_dim)
+    keep = [i for i in range(z_dim) if i not in removed]
+
+    if x.start < 0 or y.start < 0 or x.stop <= x.start or y.stop <= y.start or not keep:
+        raise ValueError(f"Crop spec {spec} leaves no voxels of a volume of shape {shape}")
+    # Consecutive slices are kept as a slice, so the crop is a view
+    z = slice(keep[0], keep[-1] + 1) if keep[-1] - keep[0] + 1 == len(keep) else keep
+    return x, y, z
+
+def crop_volume(path, spec):
+    """
+    Read a cropped TIFF volume, decoding only the pages of the kept slices.
+
+    Parameters:
+    - path: str, path to the (Z, Y, X) TIFF volume
+    - spec: dict, crop spec (see `crop_index`)
+
+    Returns:
+    - volume: np.ndarray of shape (Z', Y', X'), a view into the decoded pages
+    """
+    with tif.TiffFile(path) as tif_file:
+        shape = tif_file.series[0].shape
+        paged = len(shape) == 3 and len(tif_file.pages) == shape[0]
+    x, y, z = crop_index(shape[::-1], spec)
+
+    keep = range(z.start, z.stop) if isinstance(z, slice) else z
+    if paged:
+        volume = tif.imread(path, key=keep).reshape((len(keep),) + tuple(shape[1:]))
+    else:
+        volume = tif.imread(path)[z]
+    return volume[:, y, x]
+
+def crop_segmentation(data, header, spec, shift_origin=False):
+    """
+    Crop a segmentation and update its header.
+
+    Parameters:
+    - data: np.ndarray, one-hot (num_segments, X, Y, Z) or layered labelmap segmentation as read by `nrrd.read`
+    - header: collections.OrderedDict, its .seg.nrrd header (not modified)
+    - spec: dict, crop spec (see `crop_index`)
+    - shift_origin: bool, if True move `space origin` by the cropped offset, otherwise reset it to 0
+
+    Returns:
+    - cropped: np.ndarray, the cropped segmentation (a view when no slices are removed between kept slices)
+    - new_header: OrderedDict with updated `sizes`, `space origin` and `Segment*_Extent` fields
+    """
+    x, y, z = crop_index(data.shape[-3:], spec)
+    cropped = data[..., x, y, z]
+
+    new_header = OrderedDict(header)
+    new_header["sizes"] = np.array(cropped.shape)
+    if "space origin" in header:
+        origin = np.asarray(header["space origin"], dtype=float)
+        if shift_origin:
+            directions = np.asarray(header["space directions"], dtype=float)[-3:]
+            first_slice = z.start if isinstance(z, slice) else z[0]
+            new_header["space origin"] = origin + np.array([x.start, y.start, first_slice]) @ directions
+        else:
+            new_header["space origin"] = np.zeros_like(origin)
+
+    table = SegmentTable.from_header(new_header)
+    for segment, extent in zip(table, segment_extents([(0, cropped)], new_header)):
+        segment.fields["Extent"] = extent
+    return cropped, table.to_header(new_header)
+
+def case_paths(path):
+    """
+    Pair the TIFF volumes and .seg.nrrd segmentations of a folder by case name.
+
+    Returns:
+    - cases: dict, case name -> (tif path or None, seg path or None)
+    """
+    cases = {}
+    for tif_path in get_filenames(path, "tif"):
+        cases.setdefault(os.path.basename(tif_path).split(".")[0], [None, None])[0] = tif_path
+    for seg_path in get_filenames(path, "seg.nrrd"):
+        cases.setdefault(os.path.basename(seg_path).split(".")[0], [None, None])[1] = seg_path
+    return {name: tuple(paths) for name, paths in cases.items()}
+
+def crop_case(case_name, tif_path, seg_path, output_dir, spec, shift_origin=False,
+              tiff_options=None, nrrd_options=None):
+    """
+    Crop the TIFF volume and segmentation of one case with the same spec.
+
+    Parameters:
+    - case_name: str, case identifier, used for the output file names
+    - tif_path, seg_path: str or None, paths to the TIFF volume and .seg.nrrd segmentation
+    - output_dir: str, folder to write the cropped files to
+    - spec: dict, crop spec (see `crop_index`)
+    - shift_origin: bool, see `crop_segmentation`
+    - tiff_options, nrrd_options: dict, optional TIFF / .nrrd writer options
+
+    Returns:
+    - outputs: list of str, paths of the files written for this case
+    """
+    if tif_path and seg_path:
+        with tif.TiffFile(tif_path) as tif_file:
+            tif_shape = tuple(tif_file.series[0].shape)
+        seg_shape = tuple(int(i) for i in read_nrrd_header(seg_path)[0]["sizes"][-3:][::-1])
+        if tif_shape != seg_shape:
+            raise ValueError(f"TIF and seg.nrrd shapes differ for {case_name}: {tif_shape} and {seg_shape}")
+
+    outputs = []
+    if tif_path:
+        output_path = os.path.join(output_dir, f"{case_name}.tif")
+        write_tiff(output_path, crop_volume(tif_path, spec), tiff_options)
+        outputs.append(output_path)
+    if seg_path:
+        data, header = nrrd.read(seg_path)
+        cropped, new_header = crop_segmentation(data, header, spec, shift_origin)
+        output_path = os.path.join(output_dir, f"{case_name}.seg.nrrd")
+        write_nrrd(output_path, cropped, new_header, nrrd_options)
+        outputs.append(output_path)
+    return outputs
+
+def main():
+    global_spec = {key: getattr(FLAGS, key) for key in CROP_KEYS if getattr(FLAGS, key)}
+    case_specs = {}
+    if FLAGS.spec:
+        with open(FLAGS.spec) as f:
+            case_specs = json.load(f)
+
+    cases = case_paths(FLAGS.path)
+    if len(cases) == 0:
+        raise ValueError(f"No .tif or .seg.nrrd files found at {FLAGS.path}")
+    unknown = set(case_specs) - set(cases)
+    if unknown:
+        raise ValueError(f"Cases {sorted(unknown)} in {FLAGS.spec} not found at {FLAGS.path}")
+
+    output_dir = os.path.join(FLAGS.path, FLAGS.output_dir)
+    create_directory(output_dir)
+
+    tiff_options = tiff_writer_options(FLAGS)
+    nrrd_options = nrrd_writer_options(FLAGS)
+    tasks = [(name, tif_path, seg_path, output_dir, case_specs.get(name, global_spec), FLAGS.shift_origin,
+              tiff_options, nrrd_options)
+             for name, (tif_path, seg_path) in sorted(cases.items())]
+    _, failures = run_parallel(crop_case, tasks, workers=FLAGS.workers, desc="Cropping cases")
+    print_failures(failures, len(tasks))
+    print(f"Cropped cases saved to {output_dir}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--path",
+        type=str,
+        required=True,
+        help="Folder of TIFF volumes and .seg.nrrd segmentations"
+    )
+    parser.add_argument(
+        "--spec",
+        type=str,
+        default=None,
+        help="JSON file mapping case names to crop specs, for cases that need their own crop"
+    )
+    parser.add_argument(
+        "--left",
+        type=int,
+        default=0,
+        help="index to skip on the left (x-axis)"
+    )
+    parser.add_argument(
+        "--right",
+        type=int,
+        default=0,
+        help="index to skip on the right (x-axis)"
+    )
+    parser.add_argument(
+        "--up",
+        type=int,
+        default=0,
+        help="index to skip at the top (y-axis)"
+    )
+    parser.add_argument(
+        "--down",
+        type=int,
+        default=0,
+        help="index to skip at the bottom (y-axis)"
+    )
+    parser.add_argument(
+        "--remove_slices",
+        type=int,
+        nargs="*",
+        default=[],
+        help="Z-slices to remove"
+    )
+    parser.add_argument(
+        "--shift_origin",
+        action="store_true",
+        help="Move the segmentation origin by the cropped offset instead of resetting it to 0"
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="cropped",
+        help="name of output folder"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes"
+    )
+    add_tiff_writer_args(parser)
+    add_nrrd_writer_args(parser)
+    FLAGS, _ = parser.parse_known_args()
+    main()
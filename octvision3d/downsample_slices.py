@@ -6,7 +6,9 @@ Functionality:
 - Supports loading either a single multi-slice TIFF file or a directory of 2D image slices
 - Selects evenly spaced slices based on the target depth
 - Ensures exactly `target` unique slices, even with rounding edge cases
+- Works out the selected slices first and decodes only those TIFF pages or 2D files
 - Saves the downsampled volume as a new TIFF file
+- With --batch, downsamples every volume of a folder in parallel (--workers)
 
 Usage:
     For a single multi-page TIFF:
@@ -15,9 +17,13 @@ Usage:
     For a directory of 2D slices:
         python script.py --path ./folder --multifile --ext tif --output_dir ./out --output_name output.tif
 
+    For a folder of multi-page TIFFs (or, with --multifile, a folder of slice folders):
+        python script.py --path ./volumes --batch --target 25 --output_dir ./out --workers 8
+
 Notes:
 - Supports grayscale images; uses OpenCV for reading 2D slices and tifffile for TIFF stacks
 - Will raise an error if output path and filename are not provided
+- In batch mode the outputs are named after the input files (or folders, as <folder>.tif)
 """
 
 import os
@@ -25,25 +31,29 @@ import cv2
 import numpy as np
 import tifffile as tif
 from argparse import ArgumentParser
-from utils import get_filenames, create_directory
+from utils import get_filenames, create_directory, run_parallel, print_failures
+from tiff_io import add_tiff_writer_args, tiff_writer_options, write_tiff
 
-def downsample(data, target=19):
+def downsample_indices(depth, target=19):
     """
-    Downsample a 3D volume to a fixed number of evenly spaced slices along the first axis.
+    Select evenly spaced slice indices to downsample a volume to a fixed number of slices.
 
     Parameters:
-    - data: np.ndarray, 3D volume of shape [depth, height, width]
+    - depth: int, number of slices of the volume
     - target: int, desired number of output slices (default: 19)
 
     Returns:
-    - downsampled_data: np.ndarray, volume with shape [target, height, width]
+    - selected_indices: list of int, sorted slice indices. All slices if `depth` <= `target`
 
     Notes:
     - Ensures unique slice indices (avoiding duplicates from rounding)
     - If necessary, over-generates indices and trims back to exactly `target` slices
     """
+    if depth <= target:
+        return list(range(depth))
+
     # Calculate the exact step size
-    step_size = data.shape[0] / target
+    step_size = depth / target
 
     # Generate indices using the step size
     selected_indices = np.array([int(round(i * step_size)) for i in range(target)])
@@ -58,35 +68,116 @@ def downsample(data, target=19):
         unique_indices = np.unique(np.concatenate((unique_indices, additional_indices)))
 
     # Trim to exact number of target slices
-    selected_indices = list(unique_indices[:target])
-    downsampled_data = data[selected_indices, :, :]
-    return downsampled_data
+    return [int(i) for i in unique_indices[:target]]
 
-def main():
-    if FLAGS.multifile:
-        filenames = get_filenames(FLAGS.path, ext=f"{FLAGS.ext}*")
+def downsample(data, target=19):
+    """
+    Downsample a 3D volume to a fixed number of evenly spaced slices along the first axis.
+
+    Parameters:
+    - data: np.ndarray, 3D volume of shape [depth, height, width]
+    - target: int, desired number of output slices (default: 19)
+
+    Returns:
+    - downsampled_data: np.ndarray, volume with shape [target, height, width]
+    """
+    return data[downsample_indices(data.shape[0], target), :, :]
+
+def slice_filenames(path, ext="tif"):
+    """
+    List the 2D slice files of a folder, falling back to PNG files if there are none with `ext`.
+
+    Returns:
+    - filenames: list of str, sorted file paths
+    - ext: str, extension of the files found
+    """
+    filenames = get_filenames(path, ext=f"{ext}*")
+    if len(filenames) == 0:
+        print(f"No files with ext {ext} found in {os.path.abspath(path)}")
+        print(f"Trying files with ext PNG")
+        ext = "PNG"
+        filenames = get_filenames(path, ext=f"{ext}*")
         if len(filenames) == 0:
-            print(f"No files with ext {FLAGS.ext} found in {os.path.abspath(FLAGS.path)}")
-            print(f"Trying files with ext PNG")
-            FLAGS.ext = "PNG"
-            filenames = get_filenames(FLAGS.path, ext=f"{FLAGS.ext}*")
-            if len(filenames) == 0:
-                raise ValueError(f"No TIFF or PNG images found at {FLAGS.path}")
-
-        if FLAGS.ext == "tif":
-            vol = np.array([tif.imread(f) for f in filenames])
+            raise ValueError(f"No TIFF or PNG images found at {path}")
+    return filenames, ext
+
+def load_downsampled(path, target=19, multifile=False, ext="tif"):
+    """
+    Read only the slices of a volume that are kept by `downsample`.
+
+    Parameters:
+    - path: str, multi-page TIFF file, or folder of 2D slices if `multifile`
+    - target: int, desired number of output slices
+    - multifile: bool, whether `path` is a folder of 2D slices
+    - ext: str, extension of the 2D slices
+
+    Returns:
+    - vol: np.ndarray, downsampled volume of shape [min(depth, target), height, width]
+    - depth: int, number of slices of the full volume
+    """
+    if multifile:
+        filenames, ext = slice_filenames(path, ext)
+        selected = [filenames[i] for i in downsample_indices(len(filenames), target)]
+        if ext == "tif":
+            vol = np.array([tif.imread(f) for f in selected])
         else:
-            vol = np.array([cv2.imread(f, cv2.IMREAD_GRAYSCALE) for f in filenames])
-    else:
-        vol = tif.imread(FLAGS.path)
+            vol = np.array([cv2.imread(f, cv2.IMREAD_GRAYSCALE) for f in selected])
+        return vol, len(filenames)
+
+    with tif.TiffFile(path) as tif_file:
+        shape = tif_file.series[0].shape
+        paged = len(shape) == 3 and len(tif_file.pages) == shape[0]
+    if len(shape) == 2:
+        return tif.imread(path)[None], 1
+    indices = downsample_indices(shape[0], target)
+    if not paged:
+        # Single-page or tiled volumes can't be read page by page
+        return tif.imread(path)[indices], shape[0]
+    # key= decodes only the selected pages; a single page comes back squeezed
+    vol = tif.imread(path, key=indices).reshape((len(indices),) + tuple(shape[1:]))
+    return vol, shape[0]
+
+def downsample_volume(path, output_path, target=19, multifile=False, ext="tif", tiff_options=None):
+    """
+    Downsample one volume and save it as a TIFF file.
+
+    Returns:
+    - (depth, kept): tuple of int, number of slices of the input and output volumes
+    """
+    vol, depth = load_downsampled(path, target, multifile, ext)
+    write_tiff(output_path, vol, tiff_options)
+    return depth, vol.shape[0]
+
+def batch_inputs(path, multifile=False):
+    """List the volumes of a folder: multi-page TIFF files, or slice folders if `multifile`."""
+    if multifile:
+        return sorted(os.path.join(path, d) for d in os.listdir(path) if os.path.isdir(os.path.join(path, d)))
+    return get_filenames(path, ext="tif")
 
-    if vol.shape[0] > 19:
-        vol = downsample(vol)
+def main():
+    tiff_options = tiff_writer_options(FLAGS)
+    if FLAGS.batch:
+        if not FLAGS.output_dir:
+            raise ValueError("Need to specify --output_dir in order to save new TIFF files")
+        inputs = batch_inputs(FLAGS.path, FLAGS.multifile)
+        if len(inputs) == 0:
+            raise ValueError(f"No volumes found at {FLAGS.path}")
+        create_directory(FLAGS.output_dir)
+        tasks = [(p, os.path.join(FLAGS.output_dir, f"{os.path.basename(p).split('.')[0]}.tif"),
+                  FLAGS.target, FLAGS.multifile, FLAGS.ext, tiff_options) for p in inputs]
+        results, failures = run_parallel(downsample_volume, tasks, workers=FLAGS.workers, desc="Downsampling")
+        results = [r for r in results if r is not None]
+        print(f"Read {sum(k for _, k in results)} of {sum(d for d, _ in results)} slices")
+        print_failures(failures, len(tasks))
+        print(f"Saved downsampled volumes to {FLAGS.output_dir}")
+        return
 
     if FLAGS.output_dir and FLAGS.output_name:
         create_directory(FLAGS.output_dir)
-        tif.imwrite(f"{FLAGS.output_dir}/{FLAGS.output_name}", vol)
-        print(f"Saved {FLAGS.path} to {FLAGS.output_dir}/{FLAGS.output_name} with shape: {vol.shape}")
+        output_path = f"{FLAGS.output_dir}/{FLAGS.output_name}"
+        vol, _ = load_downsampled(FLAGS.path, FLAGS.target, FLAGS.multifile, FLAGS.ext)
+        write_tiff(output_path, vol, tiff_options)
+        print(f"Saved {FLAGS.path} to {output_path} with shape: {vol.shape}")
     else:
         raise ValueError("Need to specify --output_dir and --output_name in order to save new TIFF file")
 
@@ -127,6 +218,18 @@ if __name__ == "__main__":
         default="tif",
         help="Choose file extension of image files"
     )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Downsample every volume in the folder at --path"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes in batch mode"
+    )
+    add_tiff_writer_args(parser)
     FLAGS, _ = parser.parse_known_args()
 
     main()
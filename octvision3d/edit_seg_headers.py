@@ -0,0 +1,147 @@
+"""
+This script applies header-only edits to .seg.nrrd files: segment renames, color changes,
+`Segment*_Extent` updates and extra metadata fields.
+
+Functionality:
+- Renames segments (--rename OLD=NEW) and sets segment colors (--color NAME="r g b")
+- Recomputes the `Segment<N>_Extent` fields from the segmentation data (--update_extents)
+- Sets or overwrites arbitrary header fields (--set KEY=VALUE)
+- Rewrites only the text header of each file with `nrrd_io.write_nrrd_header`; the encoded
+  payload bytes are copied through unchanged, so no file is decompressed or recompressed
+  (except for reading the data when --update_extents is given)
+
+Usage:
+    python edit_seg_headers.py --path /path/to/nrrd/files --rename HEM=SRM --color SRM="0.9 0.1 0.1"
+    python edit_seg_headers.py --path /path/to/nrrd/files --update_extents --workers 8
+    python edit_seg_headers.py --path /path/to/nrrd/files --set Annotator=DK
+
+Notes:
+- Files where no segment matches an edit are left untouched
+- Fields that are not standard NRRD fields are written as `KEY:=VALUE` key/value pairs, like Slicer's
+  segment fields
+"""
+
+import os
+import argparse
+import numpy as np
+from nrrd.reader import _get_field_type, _parse_field_value
+from octvision3d.utils import get_filenames, run_parallel, print_failures, SegmentTable
+from octvision3d.nrrd_io import read_nrrd_header, write_nrrd_header, compute_segment_extents
+
+def parse_field(key, value):
+    """
+    Parse a --set value the way pynrrd parses the field when reading a header, so it can be compared
+    with (and is written like) the existing value, e.g. `space directions` as a matrix.
+    """
+    return _parse_field_value(value, _get_field_type(key, {}))
+
+def same_value(a, b):
+    """Compare two header values, which may be numpy arrays."""
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        try:
+            return np.array_equal(a, b, equal_nan=True)
+        except TypeError:
+            return np.array_equal(a, b)
+    return a == b
+
+def edit_header(path, renames, colors, fields, update_extents=False):
+    """
+    Apply header-only edits to a single .seg.nrrd file and rewrite its header in place.
+
+    Parameters:
+    - path: str, path to the .seg.nrrd file
+    - renames: dict, old segment name -> new segment name
+    - colors: dict, segment name (after renaming) -> "r g b" color string
+    - fields: dict, header key -> value to set, as a string (parsed with `parse_field`) or already parsed
+    - update_extents: bool, whether to recompute the segment extents from the data
+
+    Returns:
+    - changed: bool, whether the header was rewritten
+    """
+    header, _ = read_nrrd_header(path)
+    table = SegmentTable.from_header(header)
+
+    # Header values include numpy arrays, so edits are tracked instead of comparing headers
+    changed = False
+    # Renames apply in order, so later renames and colors see the new names
+    for old, new in renames.items():
+        if old in table and old != new:
+            table.rename(old, new)
+            changed = True
+    for name, color in colors.items():
+        if name in table and table.by_name(name).color != color:
+            table.by_name(name).color = color
+            changed = True
+    if update_extents:
+        for segment, extent in zip(table, compute_segment_extents(path)):
+            changed |= segment.extent != extent
+            segment.fields["Extent"] = extent
+
+    new_header = table.to_header(header)
+    for key, value in fields.items():
+        if isinstance(value, str):
+            value = parse_field(key, value)
+        changed |= key not in header or not same_value(header[key], value)
+        new_header[key] = value
+
+    if changed:
+        write_nrrd_header(path, new_header)
+    return changed
+
+def main():
+    renames = dict(r.split("=", 1) for r in FLAGS.rename)
+    colors = dict(c.split("=", 1) for c in FLAGS.color)
+    fields = dict(f.split("=", 1) for f in FLAGS.set)
+
+    files = get_filenames(FLAGS.path, "seg.nrrd") if os.path.isdir(FLAGS.path) else [FLAGS.path]
+    if len(files) == 0:
+        raise ValueError(f"No .seg.nrrd files found at {FLAGS.path}")
+
+    tasks = [(f, renames, colors, fields, FLAGS.update_extents) for f in files]
+    results, failures = run_parallel(edit_header, tasks, workers=FLAGS.workers, desc="Editing headers")
+    print(f"Rewrote the header of {sum(bool(r) for r in results)} of {len(files)} files")
+    print_failures(failures, len(tasks))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--path",
+        type=str,
+        required=True,
+        help="Path to a .seg.nrrd file or a folder of .seg.nrrd files"
+    )
+    parser.add_argument(
+        "--rename",
+        type=str,
+        action="append",
+        default=[],
+        help="Segment rename OLD=NEW, e.g. HEM=SRM. Can be repeated"
+    )
+    parser.add_argument(
+        "--color",
+        type=str,
+        action="append",
+        default=[],
+        help="Segment color NAME=\"r g b\" with components between 0 and 1. Can be repeated"
+    )
+    parser.add_argument(
+        "--set",
+        type=str,
+        action="append",
+        default=[],
+        help="Header field KEY=VALUE to set, e.g. Annotator=DK. Can be repeated"
+    )
+    parser.add_argument(
+        "--update_extents",
+        action="store_true",
+        help="Recompute the Segment<N>_Extent fields from the segmentation data"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes"
+    )
+    FLAGS, _ = parser.parse_known_args()
+    main()
@@ -1,45 +1,141 @@
+"""
+This script empties one or more segments of .seg.nrrd files. The segments are kept in the header,
+only the voxels labelled with them are cleared.
+
+Functionality:
+- Erases all given labels in a single pass per file, optionally restricted to a Z-range and/or an
+  X/Y bounding box
+- Handles one-hot and layered labelmap (Slicer 5) files
+- Raw-encoded files are modified in place through a memory map, without rewriting the file
+- Compressed files are read once and written once, and only if a voxel was erased
+- Processes the files of a folder in parallel with --workers
+
+Usage:
+    python erase_label_segments.py --path /path/to/nrrd/files --label HEM
+    python erase_label_segments.py --path /path/to/file.seg.nrrd --label VIT HYA SHS --z_range 0 10
+    python erase_label_segments.py --path /path/to/nrrd/files --label ART --bbox 0 100 0 496 --workers 8
+
+Notes:
+- Ranges are voxel indices, start inclusive and end exclusive
+"""
+
 import nrrd
 import os
-import re
 import argparse
 import numpy as np
-import tifffile as tif
-from tqdm import tqdm
-from glob import glob
-from collections import OrderedDict
-from pprint import pprint
-from octvision3d.utils import get_filenames, get_idx_of_label
+from octvision3d.utils import (get_filenames,
+                               run_parallel,
+                               print_failures,
+                               SegmentTable,
+                               segment_layout)
+from octvision3d.nrrd_io import (read_nrrd_header,
+                                 memmap_nrrd,
+                                 add_nrrd_writer_args,
+                                 nrrd_writer_options,
+                                 write_nrrd)
+
+def erase_region(z_range=None, bbox=None):
+    """
+    Build the (X, Y, Z) index of the region to erase.
+
+    Parameters:
+    - z_range: tuple of int, optional (start, end) Z-slices
+    - bbox: tuple of int, optional (x_start, x_end, y_start, y_end) bounding box
+
+    Returns:
+    - region: tuple of 3 slices
+    """
+    x, y = (slice(bbox[0], bbox[1]), slice(bbox[2], bbox[3])) if bbox else (slice(None), slice(None))
+    z = slice(z_range[0], z_range[1]) if z_range else slice(None)
+    return x, y, z
+
+def erase_segments(data, header, labels, region=None):
+    """
+    Erase the voxels of several segments in place.
+
+    Parameters:
+    - data: np.ndarray or np.memmap, segmentation as read by `nrrd.read`: one-hot (num_segments, X, Y, Z)
+      or a layered labelmap (num_layers, X, Y, Z) / (X, Y, Z)
+    - header: collections.OrderedDict, its .seg.nrrd header
+    - labels: list of str, names of the segments to erase
+    - region: tuple of 3 slices, optional (X, Y, Z) region to erase in (see `erase_region`)
+
+    Returns:
+    - changed: bool, whether any voxel was erased
+
+    Raises:
+    - ValueError: if a label is not a segment of the header
+    """
+    region = region or erase_region()
+    positions = {}
+    for k, segment in enumerate(SegmentTable.from_header(header)):
+        positions.setdefault(segment.name, k)
+    missing = [label for label in labels if label not in positions]
+    if missing:
+        raise ValueError(f"Labels {missing} not found in header")
+
+    layered, layers, label_values = segment_layout(header)
+    changed = False
+    for label in labels:
+        k = positions[label]
+        if not layered:
+            channel = data[(k,) + region]
+            if channel.any():
+                channel[...] = 0
+                changed = True
+            continue
+        layer = data[(layers[k],) + region] if data.ndim == 4 else data[region]
+        mask = layer == label_values[k]
+        if mask.any():
+            layer[mask] = 0
+            changed = True
+    return changed
 
 def remove_data_from_label(data, header, label):
-    label_idx = get_idx_of_label(header, label)
-    data[label_idx] = np.zeros(data[label_idx].shape)
+    """
+    Erase all voxels of a single segment in place. Kept for existing callers, see `erase_segments`.
+    """
+    erase_segments(data, header, [label])
     return data
 
+def erase_file(path, labels, region=None, nrrd_options=None):
+    """
+    Erase several segments of a .seg.nrrd file, in place for raw payloads.
+
+    Parameters:
+    - path: str, path to the .seg.nrrd file
+    - labels: list of str, names of the segments to erase
+    - region: tuple of 3 slices, optional (X, Y, Z) region to erase in
+    - nrrd_options: dict, optional writer options for compressed files (see `nrrd_io.nrrd_writer_options`)
+
+    Returns:
+    - changed: bool, whether any voxel was erased
+    """
+    header, _ = read_nrrd_header(path)
+    if header["encoding"] == "raw" and not header.get("lineskip", header.get("line skip", 0)):
+        data, header = memmap_nrrd(path, mode="r+")
+        changed = erase_segments(data, header, labels, region)
+        data.flush()
+        del data
+        return changed
+
+    data, header = nrrd.read(path)
+    changed = erase_segments(data, header, labels, region)
+    if changed:
+        write_nrrd(path, data, header, nrrd_options)
+    return changed
+
 def main():
-    original_labels = ["CNV", "DRU", "EX", "FLU", "GA", "HEM", "RPE"]
-    cmap = OrderedDict([
-        ("RET", "0.635 0.0 1.0"),
-        ("CHO", "0.56 0.56 0.44"),
-        ("VIT", "0.88 0.94 0.99"),
-        ("HYA", "0.46 0.98 0.99"),
-        ("SHS", "0.69 0.99 0.82"),
-        ("ART", "0.99 0.99 0.33"),
-        ("ERM", "0.22 0.49 0.97"),
-        ("SES", "0.392 0.196 0.0"),
-    ])
-
-    # Load the NRRD file
-    if os.path.isdir(FLAGS.path):
-        for f in tqdm(get_filenames(FLAGS.path, "seg.nrrd")):
-            data, header = nrrd.read(f)
-            new_data = remove_data_from_label(data, header, FLAGS.label)
-
-            nrrd.write(f, new_data, header)
-    else:
-        data, header = nrrd.read(FLAGS.path)
-        new_data = remove_data_from_label(data, header, FLAGS.label)
-
-        nrrd.write(FLAGS.path, new_data, header)
+    files = get_filenames(FLAGS.path, "seg.nrrd") if os.path.isdir(FLAGS.path) else [FLAGS.path]
+    if len(files) == 0:
+        raise ValueError(f"No .seg.nrrd files found at {FLAGS.path}")
+
+    region = erase_region(FLAGS.z_range, FLAGS.bbox)
+    nrrd_options = nrrd_writer_options(FLAGS)
+    tasks = [(f, FLAGS.label, region, nrrd_options) for f in files]
+    results, failures = run_parallel(erase_file, tasks, workers=FLAGS.workers, desc="Erasing labels")
+    print(f"Erased {FLAGS.label} in {sum(bool(r) for r in results)} of {len(files)} files")
+    print_failures(failures, len(tasks))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -47,13 +143,37 @@ if __name__ == "__main__":
         "--path",
         type=str,
         required=True,
-        help="Path to .seg.nrrd files to add new segments to"
+        help="Path to a .seg.nrrd file or a folder of .seg.nrrd files"
     )
     parser.add_argument(
         "--label",
         type=str,
+        nargs="+",
         required=True,
-        help="Name of label to empty. Does not remove the label but deletes the labels within"
+        help="Names of labels to empty. Does not remove the labels but deletes the labels within"
+    )
+    parser.add_argument(
+        "--z_range",
+        type=int,
+        nargs=2,
+        default=None,
+        metavar=("START", "END"),
+        help="Only erase within these Z-slices (end exclusive)"
+    )
+    parser.add_argument(
+        "--bbox",
+        type=int,
+        nargs=4,
+        default=None,
+        metavar=("X_START", "X_END", "Y_START", "Y_END"),
+        help="Only erase within this X/Y bounding box (ends exclusive)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes"
     )
+    add_nrrd_writer_args(parser)
     FLAGS, _ = parser.parse_known_args()
     main()
@@ -17,10 +17,11 @@ from glob import glob
 from collections import OrderedDict
 from pprint import pprint
 from octvision3d.utils import (get_filenames,
-                               segment_name_already_exists,
-                               add_segmentation_to_header,
-                               check_duplicate_labels,
+                               SegmentTable,
+                               add_segments,
+                               verify_segments,
                                delete_by_name)
+from octvision3d.nrrd_io import add_nrrd_writer_args, nrrd_writer_options, write_nrrd
 
             
 def check_order_and_remove_extra_labels(data, header, original_labels):
@@ -41,27 +42,22 @@ def check_order_and_remove_extra_labels(data, header, original_labels):
     - ValueError: if extra labels are present and --force is not set,
                   or if original labels are out of order.
     """
-    name_tracker = list(map(list, zip(original_labels, [-1]*len(original_labels))))
-    idx = len(original_labels) - 1
+    table = SegmentTable.from_header(header)
     new_header = header.copy()
-    new_data = data.copy()
-    for key, val in reversed(header.items()):
-        match = re.match(r"Segment(\d+)_", key)
-        if match:
-            if key.endswith("_Name"):
-                segment_number = int(match.group(1))
-                if val not in original_labels:
-                    if FLAGS.force:
-                        print(f"{val} is not in original labels. Force deleting...")
-                        new_data, new_header = delete_by_name(new_data, new_header, val, original_labels)
-                    else:
-                        raise ValueError(f"{val} not one of the original labels. Use --force to delete")
-                else:
-                    name_tracker[idx][1] = segment_number
-                    idx -= 1
-    for i, name in enumerate(name_tracker):
-        if i != name[1]:
-            raise ValueError("Original labels not in proper order")
+    new_data = data
+    # Walk the segments from last to first so that deleting one does not renumber those still to visit
+    for segment in reversed(list(table)):
+        if segment.name not in original_labels:
+            if FLAGS.force:
+                print(f"{segment.name} is not in original labels. Force deleting...")
+                new_data, new_header = delete_by_name(new_data, new_header, segment.name, original_labels)
+            else:
+                raise ValueError(f"{segment.name} not one of the original labels. Use --force to delete")
+
+    # The original labels must be the first segments
+    original_indices = [segment.index for segment in table if segment.name in original_labels]
+    if original_indices != list(range(len(original_labels))):
+        raise ValueError("Original labels not in proper order")
     return new_data, new_header
 
 def get_corrected_header(data, header, original_labels):
@@ -83,10 +79,9 @@ def get_corrected_header(data, header, original_labels):
     - ValueError: if labels are out of order or extras exist and --force is not set
     """
     # These labels should be present in every segmentation
+    table = SegmentTable.from_header(header)
     for i in original_labels:
-        try:
-            assert segment_name_already_exists(header, i)
-        except AssertionError as e:
+        if i not in table:
             raise AssertionError(f"{i} label not found in header")
     # Check that the labels are in the correct order
     new_data, new_header = check_order_and_remove_extra_labels(data, header, original_labels)
@@ -105,37 +100,25 @@ def main():
         ("SES", "0.392 0.196 0.0"),
     ])
 
+    labels = ["CNV", "DRU", "EX", "FLU", "GA", "HEM", "RPE", "RET",\
+              "CHO", "VIT", "HYA", "SHS", "ART", "ERM", "SES"]
+
+    nrrd_options = nrrd_writer_options(FLAGS)
+
     # Load the NRRD file
     for f in tqdm(get_filenames(FLAGS.path, "seg.nrrd")):
-        startedAddingSegments = False
-
         data, header = nrrd.read(f)
+        num_segments = data.shape[0]
 
         # run tests to ensure seg.nrrd header is correct
         # deletes labels not in the original_labels
-        corrected_data, corrected_header = get_corrected_header(data, header, original_labels)
-        nrrd.write(f, corrected_data, corrected_header)
+        data, header = get_corrected_header(data, header, original_labels)
 
-        # Add new labels
-        for k, v in cmap.items():
-            data, header = nrrd.read(f)
-            success = add_segmentation_to_header(data, header, f, k, v, startedAddingSegments)
-            if success and not startedAddingSegments:
-                startedAddingSegments = True
-
-        data, header = nrrd.read(f)
-        header_vals = set([i for i in header.values() if type(i)==str])
-        labels = ["CNV", "DRU", "EX", "FLU", "GA", "HEM", "RPE", "RET",\
-                  "CHO", "VIT", "HYA", "SHS", "ART", "ERM", "SES"]
-        err_s = ""
-        for label in labels:
-            if label not in header_vals:
-                err_s += f", {label}" if len(err_s) != 0 else f"{label}"
-        if len(err_s) > 0:
-            raise ValueError(f"ERROR: Labels {err_s} not in final header")
-
-        # check for duplicates at the end as well
-        check_duplicate_labels(header)
+        # Add all new labels at once, then check for missing and duplicate labels before writing the file
+        data, header, added = add_segments(data, header, cmap, f)
+        verify_segments(data, header, expected_names=labels)
+        if added or data.shape[0] != num_segments:
+            write_nrrd(f, data, header, nrrd_options)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -151,5 +134,6 @@ if __name__ == "__main__":
         action="store_true",
         help="Delete labels not in original labels"
     )
+    add_nrrd_writer_args(parser)
     FLAGS, _ = parser.parse_known_args()
     main()
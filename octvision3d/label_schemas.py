@@ -0,0 +1,171 @@
+"""
+This module defines the named label schemas used by the OCTAVE datasets and a lookup-table (LUT)
+based engine to remap label maps from one schema to another.
+
+Each schema maps label names to the integer values stored in nnU-Net label maps. A remapping
+between two schemas is compiled once into a 256-entry uint8 LUT and applied in a single pass,
+in place for uint8 label maps.
+
+Labels are matched by name. Where a label of the target schema merges labels of the source schema
+under a different name (e.g. CNV and DRU into PED), the merge is listed in `LABEL_ALIASES`.
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+LABEL_SCHEMAS = {
+    # 15 classes, as annotated in the OCTAVE .seg.nrrd files
+    "octave": OrderedDict([
+        ("background", 0),
+        ("CNV", 1),  # Choroidal Neovascularization
+        ("DRU", 2),  # Drusen
+        ("EX", 3),   # Exudates
+        ("FLU", 4),  # Fluid
+        ("GA", 5),   # Geographic Atrophy
+        ("HEM", 6),  # Hemorrhage
+        ("RPE", 7),  # Retinal Pigment Epithelium
+        ("RET", 8),  # Retina
+        ("CHO", 9),  # Choroid
+        ("VIT", 10), # Vitreous
+        ("HYA", 11), # Hyaloid
+        ("SHS", 12), # Sub-Hyaloid Space
+        ("ART", 13), # Artifacts
+        ("ERM", 14), # Epiretinal Membrane
+        ("SES", 15), # Sub-ERM Space
+    ]),
+    # CNV and DRU combined into PED (segnrrd2nnUNet --combine_PED)
+    "octave_ped": OrderedDict([
+        ("background", 0),
+        ("PED", 1),  # Pigement Epithelial Detachment
+        ("EX", 2),   # Exudates
+        ("FLU", 3),  # Fluid
+        ("GA", 4),   # Geographic Atrophy
+        ("HEM", 5),  # Hemorrhage
+        ("RPE", 6),  # Retinal Pigment Epithelium
+        ("RET", 7),  # Retina
+        ("CHO", 8),  # Choroid
+        ("VIT", 9),  # Vitreous
+        ("HYA", 10), # Hyaloid
+        ("SHS", 11), # Sub-Hyaloid Space
+        ("ART", 12), # Artifacts
+        ("ERM", 13), # Epiretinal Membrane
+        ("SES", 14), # Sub-ERM Space
+    ]),
+    # 13 classes used for the external test sets (tif2nnUNet)
+    "octave_srm": OrderedDict([
+        ("background", 0),
+        ("SRM", 1),  # Subretinal Material
+        ("HRM", 2),  # Hyperreflective Material
+        ("FLU", 3),  # Fluid
+        ("HTD", 4),  # Hypertransmission defect
+        ("RPE", 5),  # Retinal Pigment Epithelium
+        ("RET", 6),  # Retina
+        ("CHO", 7),  # Choroid
+        ("VIT", 8),  # Vitreous
+        ("HYA", 9),  # Hyaloid
+        ("SHS", 10), # Sub-Hyaloid Space
+        ("ART", 11), # Artifacts
+        ("ERM", 12), # Epiretinal Membrane
+        ("SES", 13), # Sub-ERM Space
+    ]),
+}
+
+# Target label name -> source label names that are merged into it
+LABEL_ALIASES = {
+    "PED": ("CNV", "DRU"),
+    "SRM": ("PED", "CNV", "DRU"),
+    "HRM": ("EX",),
+    "HTD": ("GA",),
+}
+
+def get_label_schema(name):
+    """
+    Look up a registered label schema by name.
+
+    Parameters:
+    - name: str, schema name (e.g. "octave", "octave_ped", "octave_srm")
+
+    Returns:
+    - labels: OrderedDict, label name -> label value (a copy, safe to modify)
+
+    Raises:
+    - KeyError: if no schema with this name is registered
+    """
+    if name not in LABEL_SCHEMAS:
+        raise KeyError(f"Unknown label schema {name}. Available schemas: {list(LABEL_SCHEMAS.keys())}")
+    return OrderedDict(LABEL_SCHEMAS[name])
+
+def register_label_schema(name, labels):
+    """
+    Register a new named label schema.
+
+    Parameters:
+    - name: str, schema name
+    - labels: dict, label name -> label value. Values must fit in a uint8 and be unique.
+    """
+    values = list(labels.values())
+    if len(values) != len(set(values)):
+        raise ValueError(f"Label values of schema {name} are not unique: {values}")
+    if not all(isinstance(v, int) and 0 <= v <= 255 for v in values):
+        raise ValueError(f"Label values of schema {name} must be integers between 0 and 255")
+    LABEL_SCHEMAS[name] = OrderedDict(labels)
+
+def compile_lut(source, target, overrides=None):
+    """
+    Compile the remapping between two label schemas into a 256-entry uint8 lookup table.
+
+    Parameters:
+    - source: str or dict, name of the source schema or a label name -> value dict
+    - target: str or dict, name of the target schema or a label name -> value dict
+    - overrides: dict, optional source label name -> target label name, for labels that cannot be
+      matched by name or alias (e.g. {"HEM": "SRM"} or {"HEM": "background"})
+
+    Returns:
+    - lut: np.ndarray of shape (256,) and dtype uint8, where lut[source value] = target value.
+      Values not used by the source schema map to 0.
+
+    Raises:
+    - ValueError: if a source label has no counterpart in the target schema
+    """
+    source = get_label_schema(source) if isinstance(source, str) else source
+    target = get_label_schema(target) if isinstance(target, str) else target
+    overrides = overrides or {}
+
+    # Reverse lookup of the aliases restricted to the labels of the target schema
+    merged_into = {}
+    for target_name in target:
+        for source_name in LABEL_ALIASES.get(target_name, ()):
+            merged_into.setdefault(source_name, target_name)
+
+    lut = np.zeros(256, dtype=np.uint8)
+    unmapped = []
+    for name, value in source.items():
+        target_name = overrides.get(name, name if name in target else merged_into.get(name))
+        if target_name not in target:
+            unmapped.append(name)
+            continue
+        lut[value] = target[target_name]
+
+    if unmapped:
+        raise ValueError(f"Labels {unmapped} have no counterpart in the target schema. "
+                         f"Map them explicitly with overrides")
+    return lut
+
+def remap_labels(labels, lut, out=None):
+    """
+    Remap a label map through a lookup table in a single pass.
+
+    Parameters:
+    - labels: np.ndarray, integer label map with values between 0 and 255
+    - lut: np.ndarray of shape (256,) and dtype uint8, as returned by `compile_lut`
+    - out: np.ndarray, optional uint8 output array. Pass `out=labels` to remap a uint8 label map in place.
+
+    Returns:
+    - remapped: np.ndarray of dtype uint8 with the same shape as `labels`
+    """
+    if labels.dtype != np.uint8:
+        if labels.size and (labels.min() < 0 or labels.max() > 255):
+            raise ValueError("Label values must be between 0 and 255 to be remapped")
+        labels = labels.astype(np.uint8)
+    # uint8 indices can never be out of range, so mode="clip" skips the bounds check and buffering
+    return np.take(lut, labels, out=out, mode="clip")
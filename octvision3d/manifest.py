@@ -0,0 +1,183 @@
+"""
+This module tracks which cases of an nnU-Net dataset are up to date with their inputs, so that
+`segnrrd2nnUNet` and `tif2nnUNet` only convert new or changed cases on a rebuild.
+
+A `manifest.json` file in the dataset output folder records, for each case, the size, mtime and
+SHA-256 hash of its input files, the output files it produced, and the conversion options used
+for the whole build. Input hashes are only recomputed when a file's size or mtime changed.
+
+The manifest is rewritten atomically after every converted case, and a case's entry and outputs
+are dropped before it is reconverted, so an interrupted build can simply be restarted and the
+dataset folder only ever holds the cases listed in the manifest.
+"""
+
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+def file_fingerprint(path, previous=None):
+    """
+    Compute the size, mtime and SHA-256 hash of a file.
+
+    Parameters:
+    - path: str, path to the file
+    - previous: dict, optional fingerprint from an earlier build. If its size and mtime match,
+      its hash is reused instead of re-reading the file.
+
+    Returns:
+    - fingerprint: dict with keys "path", "size", "mtime" (ns) and "sha256"
+    """
+    stat = os.stat(path)
+    fingerprint = {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime") == stat.st_mtime_ns:
+        fingerprint["sha256"] = previous["sha256"]
+        return fingerprint
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    fingerprint["sha256"] = sha256.hexdigest()
+    return fingerprint
+
+def _same_content(fingerprints, previous):
+    """Check that two sets of input fingerprints refer to identical file contents."""
+    if fingerprints.keys() != previous.keys():
+        return False
+    return all(fingerprints[role]["size"] == previous[role].get("size") and
+               fingerprints[role]["sha256"] == previous[role].get("sha256")
+               for role in fingerprints)
+
+def load_manifest(output_folder, options):
+    """
+    Load the build manifest from a dataset folder.
+
+    Parameters:
+    - output_folder: str, dataset folder containing (or that will contain) `manifest.json`
+    - options: dict, JSON-serialisable conversion options for the current build
+
+    Returns:
+    - manifest: dict with keys "manifest_version", "options" and "cases". If the stored options
+      differ from `options`, every case is marked stale but kept so its outputs can be pruned.
+    """
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {"manifest_version": MANIFEST_VERSION, "options": options, "cases": {}}
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    if manifest.get("manifest_version") != MANIFEST_VERSION or manifest.get("options") != options:
+        print("Conversion options changed since the last build, reconverting all cases")
+        for entry in manifest.get("cases", {}).values():
+            entry["inputs"] = {}
+        manifest["manifest_version"] = MANIFEST_VERSION
+        manifest["options"] = options
+    return manifest
+
+def save_manifest(manifest, output_folder):
+    """
+    Atomically write the build manifest to `<output_folder>/manifest.json`.
+
+    Parameters:
+    - manifest: dict, the manifest as returned by `load_manifest`
+    - output_folder: str, dataset folder
+    """
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, sort_keys=True, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, manifest_path)
+
+def remove_outputs(entry, output_folder):
+    """
+    Delete the output files recorded in a manifest entry.
+
+    Parameters:
+    - entry: dict, manifest entry of a case
+    - output_folder: str, dataset folder the recorded outputs are relative to
+    """
+    for output in entry.get("outputs", []):
+        output_file = os.path.join(output_folder, output)
+        if os.path.lexists(output_file):
+            os.remove(output_file)
+
+def prune_manifest(manifest, case_names, output_folder):
+    """
+    Remove the outputs and manifest entries of cases whose inputs no longer exist.
+
+    Parameters:
+    - manifest: dict, the build manifest
+    - case_names: iterable of str, names of the cases present in the current inputs
+    - output_folder: str, dataset folder the recorded outputs are relative to
+
+    Returns:
+    - removed: list of str, names of the cases that were removed
+    """
+    case_names = set(case_names)
+    removed = []
+    for name in sorted(manifest["cases"]):
+        if name in case_names:
+            continue
+        remove_outputs(manifest["cases"].pop(name), output_folder)
+        removed.append(name)
+    return removed
+
+def plan_build(manifest, cases, output_folder, rebuild=False):
+    """
+    Determine which cases need to be (re)converted.
+
+    A case is up to date when the contents of all its inputs match the manifest and all of its
+    recorded outputs still exist. Up-to-date cases whose inputs were only touched get their
+    fingerprints refreshed in place. Entries of stale cases are dropped from the manifest and their
+    recorded outputs deleted, so that an interrupted conversion is never mistaken for a finished one
+    and a case that fails to reconvert leaves no outdated files behind.
+
+    Parameters:
+    - manifest: dict, the build manifest
+    - cases: dict, case name -> dict of input role -> input path (e.g. {"image": ..., "segmentation": ...})
+    - output_folder: str, dataset folder the recorded outputs are relative to
+    - rebuild: bool, if True, every case is treated as stale
+
+    Returns:
+    - stale: list of str, names of the cases to convert, in the order of `cases`
+    - fingerprints: dict, case name -> input fingerprints to record once the case is converted
+    """
+    stale = []
+    fingerprints = {}
+    for name, inputs in cases.items():
+        entry = manifest["cases"].get(name, {})
+        previous = entry.get("inputs", {})
+        fingerprints[name] = {role: file_fingerprint(path, previous.get(role))
+                              for role, path in inputs.items()}
+
+        outputs = entry.get("outputs", [])
+        up_to_date = (not rebuild and outputs and _same_content(fingerprints[name], previous) and
+                      all(os.path.exists(os.path.join(output_folder, o)) for o in outputs))
+        if up_to_date:
+            entry["inputs"] = fingerprints[name]
+        else:
+            remove_outputs(manifest["cases"].pop(name, {}), output_folder)
+            stale.append(name)
+    return stale, fingerprints
+
+def record_case(manifest, name, inputs, outputs, output_folder):
+    """
+    Record a successfully converted case in the manifest.
+
+    Parameters:
+    - manifest: dict, the build manifest
+    - name: str, case name
+    - inputs: dict, input fingerprints as returned by `plan_build`
+    - outputs: list of str, paths of the files written for this case
+    - output_folder: str, dataset folder the outputs are stored relative to
+    """
+    manifest["cases"][name] = {
+        "inputs": inputs,
+        "outputs": sorted(os.path.relpath(o, output_folder) for o in outputs),
+    }
@@ -0,0 +1,134 @@
+"""
+This module writes cases straight into nnU-Net's preprocessed dataset layout, so a dataset can be
+converted and preprocessed in one pass instead of writing TIFFs to `imagesTr`/`labelsTr` and having
+`nnUNetv2_preprocess` read them back.
+
+Layout written for each case, next to the plans file in `nnUNet_preprocessed/<dataset>`:
+- `<data_identifier>/<case>.b2nd`: preprocessed image (blosc2)
+- `<data_identifier>/<case>_seg.b2nd`: preprocessed segmentation (blosc2)
+- `<data_identifier>/<case>.pkl`: properties (spacing, shapes before/after cropping, crop bbox,
+  sampled class locations)
+- `gt_segmentations/<case>.tif` and `<case>.json`: label map used by nnU-Net for validation
+
+Cases go through the preprocessor class, plans and configuration nnU-Net itself uses, on the same
+float32 arrays its `Tiff3DIO` reader returns for the TIFF files, and are saved with nnU-Net's own
+blosc2 writer. The output is therefore identical to the TIFF route followed by `nnUNetv2_preprocess`.
+Transposition, cropping, normalization and resampling all stay in nnU-Net.
+
+nnunetv2 is only imported when this backend is used.
+"""
+
+import os
+import json
+import numpy as np
+from octvision3d.utils import save_json
+from octvision3d.tiff_io import write_tiff
+
+def load_preprocessing_plans(plans_file, configuration="3d_fullres"):
+    """
+    Load an nnU-Net plans file (e.g. `nnUNet_preprocessed/Dataset001_OCTAVE/nnUNetPlans.json`).
+
+    Parameters:
+    - plans_file: str, path to the plans JSON written by `nnUNetv2_plan_experiment`
+    - configuration: str, configuration to preprocess for (e.g. "3d_fullres", "2d")
+
+    Returns:
+    - plans_manager: nnunetv2 PlansManager
+    - configuration_manager: nnunetv2 ConfigurationManager of `configuration`
+    """
+    try:
+        from nnunetv2.utilities.plans_handling.plans_handler import PlansManager
+    except ImportError as e:
+        raise ImportError("The blosc2 output format requires nnunetv2 (pip install -e ./nnUNet)") from e
+
+    with open(plans_file) as f:
+        plans_manager = PlansManager(json.load(f))
+    if configuration not in plans_manager.available_configurations:
+        raise ValueError(f"Configuration {configuration} not found in {plans_file}. "
+                         f"Available configurations: {plans_manager.available_configurations}")
+    return plans_manager, plans_manager.get_configuration(configuration)
+
+def preprocessed_dirs(preprocessed_folder, configuration_manager):
+    """
+    Create the case and ground truth folders of a preprocessed dataset.
+
+    Parameters:
+    - preprocessed_folder: str, preprocessed dataset folder (the folder containing the plans file)
+    - configuration_manager: nnunetv2 ConfigurationManager
+
+    Returns:
+    - data_folder: str, folder for the .b2nd/.pkl files of each case
+    - gt_folder: str, folder for the ground truth label maps
+    """
+    data_folder = os.path.join(preprocessed_folder, configuration_manager.data_identifier)
+    gt_folder = os.path.join(preprocessed_folder, "gt_segmentations")
+    os.makedirs(data_folder, exist_ok=True)
+    os.makedirs(gt_folder, exist_ok=True)
+    return data_folder, gt_folder
+
+def save_blosc2_case(data, seg, properties, output_truncated, configuration_manager):
+    """
+    Save a preprocessed case with nnU-Net's blosc2 writer, chunked for the configuration's patch size.
+
+    Parameters:
+    - data: np.ndarray of dtype float32, (C, Z, Y, X) preprocessed image
+    - seg: np.ndarray of dtype int16, (1, Z, Y, X) preprocessed segmentation
+    - properties: dict, case properties returned by the preprocessor
+    - output_truncated: str, output path without extension
+    - configuration_manager: nnunetv2 ConfigurationManager
+    """
+    from nnunetv2.training.dataloading.nnunet_dataset import nnUNetDatasetBlosc2
+    try:
+        from nnunetv2.training.dataloading.nnunet_dataset import comp_blosc2_params
+    except ImportError:
+        # Older nnU-Net versions only have it as a staticmethod of the dataset class
+        comp_blosc2_params = nnUNetDatasetBlosc2.comp_blosc2_params
+
+    patch_size = tuple(configuration_manager.patch_size)
+    blocks_data, chunks_data = comp_blosc2_params(data.shape, patch_size, data.itemsize)
+    blocks_seg, chunks_seg = comp_blosc2_params(seg.shape, patch_size, seg.itemsize)
+    nnUNetDatasetBlosc2.save_case(data, seg, properties, output_truncated,
+                                  chunks=chunks_data, blocks=blocks_data,
+                                  chunks_seg=chunks_seg, blocks_seg=blocks_seg)
+
+def save_preprocessed_case(image, labels, spacing, case_name, data_folder, gt_folder,
+                           plans_manager, configuration_manager, dataset_json, tiff_options=None):
+    """
+    Preprocess one case with nnU-Net and save it in the preprocessed dataset layout.
+
+    Parameters:
+    - image: np.ndarray, (Z, Y, X) OCT volume as read from its TIFF file
+    - labels: np.ndarray, (Z, Y, X) label map
+    - spacing: list of float, spacing as stored in the case's .json file
+    - case_name: str, case identifier
+    - data_folder, gt_folder: str, folders returned by `preprocessed_dirs`
+    - plans_manager, configuration_manager: as returned by `load_preprocessing_plans`
+    - dataset_json: dict, contents of dataset.json (only "labels" and "regions_class_order" are used)
+    - tiff_options: dict, optional TIFF writer options for the ground truth label map
+
+    Returns:
+    - outputs: list of str, paths of the files written for this case
+    """
+    if image.ndim != 3 or image.shape != labels.shape:
+        raise ValueError(f"Expected (Z, Y, X) image and labels of the same shape, got {image.shape} and {labels.shape}")
+
+    # Same arrays and properties as Tiff3DIO.read_images / read_seg return for the TIFF files
+    data = image[None].astype(np.float32)
+    seg = labels[None].astype(np.float32)
+    properties = {"spacing": list(spacing)}
+
+    # Same steps as DefaultPreprocessor.run_case_save, on the in-memory arrays instead of files read by run_case
+    preprocessor = configuration_manager.preprocessor_class(verbose=False)
+    data, seg, properties = preprocessor.run_case_npy(data, seg, properties, plans_manager,
+                                                      configuration_manager, dataset_json)
+    data = data.astype(np.float32, copy=False)
+    seg = seg.astype(np.int16, copy=False)
+    output_truncated = os.path.join(data_folder, case_name)
+    save_blosc2_case(data, seg, properties, output_truncated, configuration_manager)
+
+    gt_labels = os.path.join(gt_folder, f"{case_name}.tif")
+    gt_json = os.path.join(gt_folder, f"{case_name}.json")
+    write_tiff(gt_labels, labels, tiff_options)
+    save_json({"spacing": list(spacing)}, gt_json)
+    return [f"{output_truncated}.b2nd", f"{output_truncated}_seg.b2nd", f"{output_truncated}.pkl",
+            gt_labels, gt_json]
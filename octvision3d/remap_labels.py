@@ -0,0 +1,113 @@
+"""
+This script converts an existing nnU-Net label folder (e.g. labelsTr) from one label schema to
+another, without going back to the .seg.nrrd sources.
+
+Functionality:
+- Compiles the mapping between two named label schemas into a 256-entry uint8 lookup table
+- Remaps every label TIFF in the folder in a single pass and writes it to an output folder
+- Copies the spacing .json files alongside the remapped labels
+- Prints the `labels` entry to use in the new dataset.json
+
+Usage:
+    python remap_labels.py --path /path/to/labelsTr --source octave --target octave_ped
+    python remap_labels.py --path /path/to/labelsTr --source octave --target octave_srm --map HEM=SRM
+
+Notes:
+- Labels are matched by name or by the merges listed in `label_schemas.LABEL_ALIASES`. Source labels
+  without a counterpart in the target schema must be mapped explicitly with --map
+"""
+
+import os
+import json
+import shutil
+import argparse
+import tifffile as tif
+from octvision3d.utils import get_filenames, create_directory, run_parallel, print_failures
+from octvision3d.tiff_io import add_tiff_writer_args, tiff_writer_options, write_tiff
+from octvision3d.label_schemas import LABEL_SCHEMAS, get_label_schema, compile_lut, remap_labels
+
+def remap_file(label_path, output_dir, lut, tiff_options=None):
+    """
+    Remap a single label TIFF through a lookup table and write it to the output folder.
+
+    Parameters:
+    - label_path: str, path to the label TIFF
+    - output_dir: str, folder to write the remapped label TIFF to
+    - lut: np.ndarray of shape (256,) and dtype uint8, as returned by `compile_lut`
+    - tiff_options: dict, optional TIFF writer options (see `tiff_io.tiff_writer_options`)
+
+    Returns:
+    - output_path: str, path of the remapped label TIFF
+    """
+    labels = tif.imread(label_path)
+    remapped = remap_labels(labels, lut, out=labels if labels.dtype.name == "uint8" else None)
+    output_path = os.path.join(output_dir, os.path.basename(label_path))
+    write_tiff(output_path, remapped, tiff_options)
+    return output_path
+
+def main():
+    overrides = dict(m.split("=", 1) for m in FLAGS.map)
+    lut = compile_lut(FLAGS.source, FLAGS.target, overrides=overrides)
+
+    output_dir = os.path.join(FLAGS.path, FLAGS.output_dir)
+    create_directory(output_dir)
+
+    label_files = get_filenames(FLAGS.path, ext="tif")
+    if len(label_files) == 0:
+        raise ValueError(f"No label TIFF files found at {FLAGS.path}")
+
+    tiff_options = tiff_writer_options(FLAGS)
+    tasks = [(label_file, output_dir, lut, tiff_options) for label_file in label_files]
+    _, failures = run_parallel(remap_file, tasks, workers=FLAGS.workers)
+    print_failures(failures, len(tasks))
+
+    for json_file in get_filenames(FLAGS.path, ext="json"):
+        shutil.copy(json_file, os.path.join(output_dir, os.path.basename(json_file)))
+
+    print(f"Remapped labels saved to {output_dir}. Labels for dataset.json:")
+    print(json.dumps(get_label_schema(FLAGS.target), indent=4))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--path",
+        type=str,
+        required=True,
+        help="Path to the label TIFF folder (e.g. labelsTr)"
+    )
+    parser.add_argument(
+        "--source",
+        type=str,
+        required=True,
+        choices=list(LABEL_SCHEMAS.keys()),
+        help="Label schema of the existing labels"
+    )
+    parser.add_argument(
+        "--target",
+        type=str,
+        required=True,
+        choices=list(LABEL_SCHEMAS.keys()),
+        help="Label schema to convert the labels to"
+    )
+    parser.add_argument(
+        "--map",
+        type=str,
+        action="append",
+        default=[],
+        help="Explicit SOURCE=TARGET label name mapping, e.g. HEM=SRM. Can be repeated"
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="remapped",
+        help="name of output folder"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes"
+    )
+    add_tiff_writer_args(parser)
+    FLAGS, _ = parser.parse_known_args()
+    main()
@@ -13,6 +13,10 @@ Arguments:
 
 Output:
     Saves the new NRRD file as <original-name>-new.seg.nrrd unless --dryrun is specified.
+
+Notes:
+- To remove slices from the TIFF volumes together with their segmentations for a whole folder,
+  use crop_cases.py
 """
 
 import nrrd
@@ -25,6 +29,8 @@ from tqdm import tqdm
 from glob import glob
 from collections import OrderedDict
 from pprint import pprint
+from octvision3d.nrrd_io import add_nrrd_writer_args, nrrd_writer_options, write_nrrd
+from octvision3d.crop_cases import crop_segmentation
 
 def remove_slice():
     """
@@ -43,20 +49,11 @@ def remove_slice():
     data, header = nrrd.read(FLAGS.path)
     print("Original shape:", data.shape)
 
-    new_bitmap_data = np.delete(data, FLAGS.slice, axis=-1)
+    new_bitmap_data, copied_odict = crop_segmentation(data, header, {"remove_slices": [FLAGS.slice]})
     print("New shape:", new_bitmap_data.shape)
 
-    copied_odict = OrderedDict()
-    for key, value in header.items():
-        if key == "sizes":
-            copied_odict[key] = new_bitmap_data.shape
-        elif key == "space origin":
-            copied_odict[key] = np.array([0,0,0])
-        else:
-            copied_odict[key] = value
-
     if not FLAGS.dryrun:
-        nrrd.write(output_path, new_bitmap_data, copied_odict)
+        write_nrrd(output_path, new_bitmap_data, copied_odict, nrrd_writer_options(FLAGS))
     else:
         print("dryrun finished")
 
@@ -82,6 +79,7 @@ if __name__ == "__main__":
         help="Enable for dry run"
 
     )
+    add_nrrd_writer_args(parser)
     FLAGS, _ = parser.parse_known_args()
     output_path = FLAGS.path.split(".")[0] + "-new.seg.nrrd"
     remove_slice()
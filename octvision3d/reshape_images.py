@@ -1,55 +1,161 @@
+"""
+This script resizes the images and labels of an nnU-Net dataset folder to a fixed slice size
+(496 x 1024 by default), so external datasets match the OCTAVE B-scan size.
+
+Functionality:
+- Resizes whole volumes into one preallocated output, in batches of slices spread over a thread
+  pool with --threads
+- Resizes labels with nearest-neighbour (exact, any dtype) or per-class interpolation, so class
+  IDs are never blended
+- Keeps the dtype of the source images and labels
+- Processes cases in parallel with --workers
+
+Usage:
+    python reshape_images.py --image Rasti_nnUNet/imagesTs --label Rasti_nnUNet/labelsTs
+    python reshape_images.py --image imagesTr --label labelsTr --label_mode per_class --workers 8 --threads 2
+
+Output:
+    <image>/<output_dir>/ and <label>/<output_dir>/ with the resized TIFFs and copied .json files
+
+Notes:
+- Per-class resampling resizes one mask per class with bilinear interpolation and keeps the class
+  with the highest weight at each voxel: smoother boundaries than nearest-neighbour, one resize per class
+"""
+
+import os
+import shutil
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
-from octvision3d.utils import get_filenames, create_directory
 import tifffile as tiff
-import cv2
-import os
-import shutil
-from tqdm import tqdm
+from octvision3d.utils import get_filenames, create_directory, run_parallel, print_failures
+from octvision3d.tiff_io import add_tiff_writer_args, tiff_writer_options, write_tiff
+
+INTERPOLATION_MODES = {
+    "nearest": cv2.INTER_NEAREST,
+    "bilinear": cv2.INTER_LINEAR,
+    "bicubic": cv2.INTER_CUBIC
+}
+LABEL_MODES = ["nearest", "per_class"]
+# dtypes `cv2.resize` interpolates natively, others are resized as float32
+CV_RESIZE_DTYPES = [np.uint8, np.uint16, np.int16, np.float32, np.float64]
 
-def reshape(image, target_height=496, target_width=1024, mode="bilinear"):
+def reshape(image, target_height=496, target_width=1024, mode="bilinear", threads=1):
     """
-    Reshape a 3D NumPy image volume by resizing height and width per slice.
+    Reshape a 3D NumPy image volume by resizing height and width of all slices.
 
     Parameters:
         image (np.ndarray): Input image array of shape (z, y, x).
         target_height (int): Desired height (y-dimension) of each slice.
         target_width (int): Desired width (x-dimension) of each slice.
         mode (str): Interpolation method: 'nearest', 'bilinear', or 'bicubic'.
+        threads (int): Number of threads resizing batches of slices.
 
     Returns:
-        np.ndarray: Resized image array of shape (z, target_height, target_width).
+        np.ndarray: Resized image array of shape (z, target_height, target_width), with the dtype
+        of `image`. Integer images are rounded and clipped to their dtype range.
     """
     if not isinstance(image, np.ndarray):
         raise TypeError("Input must be a NumPy array.")
     if image.ndim != 3:
         raise ValueError("Input image must be a 3D array of shape (z, y, x).")
+    if mode not in INTERPOLATION_MODES:
+        raise ValueError(f"Unsupported mode '{mode}'. Choose from {list(INTERPOLATION_MODES.keys())}.")
 
-    interpolation_modes = {
-        "nearest": cv2.INTER_NEAREST,
-        "bilinear": cv2.INTER_LINEAR,
-        "bicubic": cv2.INTER_CUBIC
-    }
+    native = image.dtype.type in CV_RESIZE_DTYPES
+    source = image if native else image.astype(np.float32)
+    resized = np.empty((image.shape[0], target_height, target_width), dtype=source.dtype)
 
-    if mode not in interpolation_modes:
-        raise ValueError(f"Unsupported mode '{mode}'. Choose from {list(interpolation_modes.keys())}.")
+    # One batch of consecutive slices per thread. Slices are resized straight into the output
+    # (single-channel cv2.resize is faster than packing slices into channels, which needs two transposes)
+    batch_size = max(1, -(-image.shape[0] // max(threads, 1)))
+    starts = range(0, image.shape[0], batch_size)
 
-    z_dim = image.shape[0]
-    resized_slices = []
+    def resize(start):
+        for z in range(start, min(start + batch_size, image.shape[0])):
+            cv2.resize(source[z], (target_width, target_height), dst=resized[z], interpolation=INTERPOLATION_MODES[mode])
+
+    if threads > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(resize, starts))
+    else:
+        for start in starts:
+            resize(start)
+
+    if native:
+        return resized
+    if np.issubdtype(image.dtype, np.integer):
+        info = np.iinfo(image.dtype)
+        np.clip(np.rint(resized, out=resized), info.min, info.max, out=resized)
+    return resized.astype(image.dtype)
+
+def reshape_labels(label, target_height=496, target_width=1024, mode="nearest", threads=1):
+    """
+    Reshape a 3D label map without blending class IDs.
+
+    Parameters:
+        label (np.ndarray): Label map of shape (z, y, x), any integer dtype.
+        target_height (int): Desired height (y-dimension) of each slice.
+        target_width (int): Desired width (x-dimension) of each slice.
+        mode (str): 'nearest' (same sampling as cv2.INTER_NEAREST) or 'per_class' (bilinear
+            resize of each class mask, the class with the highest weight wins).
+        threads (int): Number of threads resizing batches of slices ('per_class' only).
+
+    Returns:
+        np.ndarray: Resized label map of shape (z, target_height, target_width), with the dtype of `label`.
+    """
+    if label.ndim != 3:
+        raise ValueError("Input label must be a 3D array of shape (z, y, x).")
+    if mode not in LABEL_MODES:
+        raise ValueError(f"Unsupported label mode '{mode}'. Choose from {LABEL_MODES}.")
 
-    for z in range(z_dim):
-        slice_2d = image[z].astype(np.uint8)
-        resized = cv2.resize(
-            slice_2d,
-            (target_width, target_height),
-            interpolation=interpolation_modes[mode]
-        )
-        resized_slices.append(resized)
+    if mode == "nearest":
+        # Index gather: exact for any dtype, one pass over the output
+        rows = np.minimum((np.arange(target_height) * (label.shape[1] / target_height)).astype(np.intp), label.shape[1] - 1)
+        cols = np.minimum((np.arange(target_width) * (label.shape[2] / target_width)).astype(np.intp), label.shape[2] - 1)
+        return label[:, rows[:, None], cols]
 
-    return np.stack(resized_slices, axis=0)  # shape: (z, target_height, target_width)
+    resized = np.zeros((label.shape[0], target_height, target_width), dtype=label.dtype)
+    best = np.full(resized.shape, -1, dtype=np.float32)
+    for value in np.unique(label):
+        weight = reshape((label == value).astype(np.float32), target_height, target_width, "bilinear", threads)
+        wins = weight > best
+        resized[wins] = value
+        np.maximum(best, weight, out=best)
+    return resized
+
+def reshape_case(image_f, label_f, image_j, label_j, image_output, label_output,
+                 target_height=496, target_width=1024, image_mode="bilinear", label_mode="nearest",
+                 threads=1, tiff_options=None):
+    """
+    Resize the image and label of one case and copy their .json files.
+
+    Parameters:
+    - image_f, label_f: str, paths to the image and label TIFFs
+    - image_j, label_j: str, paths to the image and label .json files
+    - image_output, label_output: str, output folders
+    - target_height, target_width: int, slice size
+    - image_mode: str, interpolation of the image (see `reshape`)
+    - label_mode: str, resampling of the label (see `reshape_labels`)
+    - threads: int, number of threads resizing each volume
+    - tiff_options: dict, optional TIFF writer options
+
+    Returns:
+    - outputs: tuple of str, paths of the resized image and label
+    """
+    image = tiff.imread(image_f)
+    label = tiff.imread(label_f)
+    outputs = (os.path.join(image_output, os.path.basename(image_f)),
+               os.path.join(label_output, os.path.basename(label_f)))
+    write_tiff(outputs[0], reshape(image, target_height, target_width, image_mode, threads), tiff_options)
+    write_tiff(outputs[1], reshape_labels(label, target_height, target_width, label_mode, threads), tiff_options)
+    shutil.copy(image_j, os.path.join(image_output, os.path.basename(image_j)))
+    shutil.copy(label_j, os.path.join(label_output, os.path.basename(label_j)))
+    return outputs
 
 def reshape_images():
+    tiff_options = tiff_writer_options(FLAGS)
     image_output = os.path.join(FLAGS.image, FLAGS.output_dir)
     label_output = os.path.join(FLAGS.label, FLAGS.output_dir)
     create_directory(image_output)
@@ -62,15 +168,11 @@ def reshape_images():
     assert(len(image_files) > 0)
     assert(len(image_files) == len(label_files) == len(image_jsons) == len(label_jsons))
 
-    for image_f, label_f, image_j, label_j in tqdm(zip(image_files, label_files, image_jsons, label_jsons), total=len(image_files)):
-        image = tiff.imread(image_f)
-        label = tiff.imread(label_f)
-        image_reshaped = reshape(image)
-        label_reshaped = reshape(label)
-        tiff.imwrite(os.path.join(image_output, os.path.basename(image_f)), image_reshaped.astype(np.uint8))
-        tiff.imwrite(os.path.join(label_output, os.path.basename(label_f)), label_reshaped.astype(np.int64))
-        shutil.copy(image_j, os.path.join(image_output, os.path.basename(image_j)))
-        shutil.copy(label_j, os.path.join(label_output, os.path.basename(label_j)))
+    tasks = [(image_f, label_f, image_j, label_j, image_output, label_output,
+              FLAGS.height, FLAGS.width, FLAGS.image_mode, FLAGS.label_mode, FLAGS.threads, tiff_options)
+             for image_f, label_f, image_j, label_j in zip(image_files, label_files, image_jsons, label_jsons)]
+    _, failures = run_parallel(reshape_case, tasks, workers=FLAGS.workers, desc="Reshaping cases")
+    print_failures(failures, len(tasks))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -92,6 +194,45 @@ if __name__ == "__main__":
         default="reshaped",
         help="name of output folder"
     )
+    parser.add_argument(
+        "--height",
+        type=int,
+        default=496,
+        help="Slice height (y-axis) after resizing"
+    )
+    parser.add_argument(
+        "--width",
+        type=int,
+        default=1024,
+        help="Slice width (x-axis) after resizing"
+    )
+    parser.add_argument(
+        "--image_mode",
+        type=str,
+        default="bilinear",
+        choices=list(INTERPOLATION_MODES),
+        help="Interpolation of the images"
+    )
+    parser.add_argument(
+        "--label_mode",
+        type=str,
+        default="nearest",
+        choices=LABEL_MODES,
+        help="Resampling of the labels"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of threads resizing each volume"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes"
+    )
+    add_tiff_writer_args(parser)
 
     FLAGS, _ = parser.parse_known_args()
     reshape_images()
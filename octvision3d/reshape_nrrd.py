@@ -13,6 +13,9 @@ Usage:
 
 Output:
     Creates a new file named <original-name>-new.seg.nrrd in the same directory.
+
+Notes:
+- To crop the TIFF volumes together with their segmentations for a whole folder, use crop_cases.py
 """
 
 import nrrd
@@ -25,6 +28,8 @@ from tqdm import tqdm
 from glob import glob
 from collections import OrderedDict
 from pprint import pprint
+from octvision3d.nrrd_io import add_nrrd_writer_args, nrrd_writer_options, write_nrrd
+from octvision3d.crop_cases import crop_segmentation
 
 def reshape_nrrd():
     """
@@ -50,35 +55,12 @@ def reshape_nrrd():
     data, header = nrrd.read(FLAGS.path)
     print("Original shape:", data.shape)
 
-    right_shift = -1*FLAGS.right if FLAGS.right > 0 else data.shape[1]
-    down_shift = -1 * FLAGS.down if FLAGS.down > 0 else data.shape[2]
-
-    new_bitmap_data = data[:, FLAGS.left:right_shift, FLAGS.up:down_shift, :]
+    # Crop x/y and update sizes, origin and segment extents
+    spec = {"left": FLAGS.left, "right": FLAGS.right, "up": FLAGS.up, "down": FLAGS.down}
+    new_bitmap_data, copied_odict = crop_segmentation(data, header, spec)
     print("Output shape:", new_bitmap_data.shape)
 
-    # Add new segmentation information to the header
-    pattern = re.compile(r"Segment(\d+)_Extent")
-
-    copied_odict = OrderedDict()
-    for key, value in header.items():
-        if key == "sizes":
-            copied_odict[key] = new_bitmap_data.shape
-        elif key == "space origin":
-            # Update the origin to reflect cropping along x and y dimensions
-            copied_odict[key] = np.array([0,0,0])
-        elif re.match(pattern, key):
-            # Adjust segment extents for cropped dimensions in x and y
-            x_dim, y_dim = map(int, value.split()[1:3])
-            new_x_dim, new_y_dim = new_bitmap_data.shape[1:3]
-            if x_dim > new_x_dim:
-                value = value.replace(str(x_dim), str(new_x_dim), 1)
-            if y_dim > new_y_dim:
-                value = value.replace(str(y_dim), str(new_y_dim), 1)
-            copied_odict[key] = value
-        else:
-            copied_odict[key] = value
-
-    nrrd.write(output_path, new_bitmap_data, copied_odict)
+    write_nrrd(output_path, new_bitmap_data, copied_odict, nrrd_writer_options(FLAGS))
 
 
 if __name__ == "__main__":
@@ -113,7 +95,8 @@ if __name__ == "__main__":
         default=0,
         help="index to skip at the bottom (y-axis)"
     )
+    add_nrrd_writer_args(parser)
     FLAGS, _ = parser.parse_known_args()
 
     output_path = FLAGS.path.split(".")[0] + "-new.seg.nrrd"
-
+    reshape_nrrd()
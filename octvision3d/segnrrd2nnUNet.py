@@ -4,38 +4,151 @@
 # saves image spacing metadata, and writes all volumes and labels in TIFF format. It also generates the 
 # nnU-Net `dataset.json` metadata file with channel and label definitions.
 #
+# Cases can be converted in parallel with --workers. Each case is converted independently, so a
+# failing case is reported at the end instead of aborting the run, and `dataset.json` is only
+# written once every case has finished.
+#
+# Rebuilds are incremental: a `manifest.json` in the output folder records each case's inputs and
+# the conversion options, so only new or changed cases are converted, outputs of cases whose inputs
+# are gone are removed, and an interrupted build can be restarted. Use --rebuild to convert all cases.
+#
+# With --output_format blosc2, cases are instead preprocessed in-process with nnU-Net and written
+# straight into its preprocessed layout (<case>.b2nd, <case>_seg.b2nd, <case>.pkl) next to the given
+# plans file, skipping the TIFF round trip through nnUNetv2_preprocess (see nnunet_preprocessed.py).
+# The dataset.json that nnU-Net copied into the preprocessed folder is left as is.
+#
 # Usage:
 #   python segnrrd2nnUNet.py --path /path/to/data --version 5
 #   python segnrrd2nnUNet.py --path /path/to/data --version 5 --combine_PED
+#   python segnrrd2nnUNet.py --path /path/to/data --version 5 --workers 16
+#   python segnrrd2nnUNet.py --path /path/to/data --output_format blosc2 \
+#       --plans $nnUNet_preprocessed/Dataset001_OCTAVE/nnUNetPlans.json --configuration 3d_fullres
 
 import os
-import nrrd
 import argparse
-import numpy as np
 import tifffile as tif
-from tqdm import tqdm
 from octvision3d.utils import (get_filenames,
                                create_dataset_dirs,
                                save_json,
-                               generate_dataset_json)
+                               generate_dataset_json,
+                               run_parallel,
+                               print_failures)
+from octvision3d.nrrd_io import read_label_map
+from octvision3d.tiff_io import (EXPORT_MODES,
+                                 export_image,
+                                 add_tiff_writer_args,
+                                 tiff_writer_options,
+                                 write_tiff)
+from octvision3d.label_schemas import get_label_schema, compile_lut, remap_labels
+from octvision3d.manifest import (file_fingerprint,
+                                  load_manifest,
+                                  save_manifest,
+                                  prune_manifest,
+                                  plan_build,
+                                  record_case)
+from octvision3d.nnunet_preprocessed import (load_preprocessing_plans,
+                                             preprocessed_dirs,
+                                             save_preprocessed_case)
+
+OUTPUT_FORMATS = ["tif", "blosc2"]
+
+# Spacing stored in the .json file of every case
+SPACING = [81.0, 1.0, 2.9]
+
+# Lookup table combining CNV (1) and DRU (2) into PED (1) and shifting labels 3-15 down by 1
+COMBINE_PED_LUT = compile_lut("octave", "octave_ped")
 
 def replace_and_shift(arr):
     """
     Replace all values of 2 with 1, and shift down all numbers 3-15 by 1 in a numpy array.
 
     Parameters:
-        arr (numpy.ndarray): Input array with values 1-15.
+        arr (numpy.ndarray): Input array with values 0-15.
+
+    Returns:
+        numpy.ndarray: Modified uint8 array.
+    """
+    return remap_labels(arr, COMBINE_PED_LUT)
+
+def load_case_labels(vol_path, seg_path, combine_PED=False):
+    """
+    Load the label map of a case from its .seg.nrrd segmentation.
+
+    Parameters:
+    - vol_path: str, path to the TIFF OCT volume
+    - seg_path: str, path to the matching .seg.nrrd segmentation
+    - combine_PED: bool, if True, combines CNV and DRU labels into a single PED label
+
+    Returns:
+    - labels: np.ndarray of dtype uint8 and shape (Z, Y, X)
+    """
+    # Ensure corresponding volume and segmentation files match by their basename
+    if vol_path.split(".")[0] != seg_path.split(".")[0]:
+        raise ValueError(f"Volume {vol_path} does not match segmentation {seg_path}")
+
+    # Load segmentation NRRD labels. The bitmap is streamed one Z-slab at a time and converted to a
+    # uint8 label array with background at index 0, flipping axes from (X, Y, Z) to (Z, Y, X).
+    # Single-layer labelmap files go through one LUT pass, with the PED merge folded into the LUT
+    # if combine_PED is true
+    return read_label_map(seg_path, lut=COMBINE_PED_LUT if combine_PED else None)
+
+def convert_case(vol_path, seg_path, imagesTr, labelsTr, combine_PED=False, image_export="auto",
+                 tiff_options=None):
+    """
+    Convert a single TIFF volume and its .seg.nrrd segmentation into nnU-Net image and label files.
+
+    Parameters:
+    - vol_path: str, path to the TIFF OCT volume
+    - seg_path: str, path to the matching .seg.nrrd segmentation
+    - imagesTr: str, output directory for images
+    - labelsTr: str, output directory for labels
+    - combine_PED: bool, if True, combines CNV and DRU labels into a single PED label
+    - image_export: str, how the volume is placed in `imagesTr` (see `tiff_io.export_image`)
+    - tiff_options: dict, optional TIFF writer options (see `tiff_io.tiff_writer_options`)
 
     Returns:
-        numpy.ndarray: Modified array.
+    - outputs: list of str, paths of the files written for this case
     """
-    # Replace 2 with 1
-    arr = np.where(arr == 2, 1, arr)
+    vol_name = os.path.splitext(os.path.basename(vol_path))[0]
+    seg_name = os.path.basename(vol_path).split(".")[0]
+    labels = load_case_labels(vol_path, seg_path, combine_PED)
 
-    # Shift values 3-15 down by 1
-    arr = np.where(arr >= 3, arr - 1, arr)
+    # Save spacing information as JSON
+    image_json = os.path.join(imagesTr, f"{vol_name}.json")
+    label_json = os.path.join(labelsTr, f"{seg_name}.json")
+    save_json({"spacing": SPACING}, image_json)
+    save_json({"spacing": SPACING}, label_json)
 
-    return arr
+    # Save volume and label images as TIFF files. The volume is linked or copied as-is when
+    # it is already a valid nnU-Net image, and only re-encoded otherwise
+    output_tif = os.path.join(imagesTr, f"{vol_name}_0000.tif")
+    output_labels = os.path.join(labelsTr, f"{seg_name}.tif")
+    export_image(vol_path, output_tif, mode=image_export, options=tiff_options)
+    write_tiff(output_labels, labels, tiff_options)
+    return [image_json, label_json, output_tif, output_labels]
+
+def convert_case_preprocessed(vol_path, seg_path, data_folder, gt_folder, preprocessing,
+                              combine_PED=False, tiff_options=None):
+    """
+    Convert a single TIFF volume and its .seg.nrrd segmentation directly into nnU-Net preprocessed data.
+
+    Parameters:
+    - vol_path: str, path to the TIFF OCT volume
+    - seg_path: str, path to the matching .seg.nrrd segmentation
+    - data_folder, gt_folder: str, folders returned by `nnunet_preprocessed.preprocessed_dirs`
+    - preprocessing: tuple of (plans_manager, configuration_manager, dataset_json)
+    - combine_PED: bool, if True, combines CNV and DRU labels into a single PED label
+    - tiff_options: dict, optional TIFF writer options for the ground truth label map
+
+    Returns:
+    - outputs: list of str, paths of the files written for this case
+    """
+    case_name = os.path.basename(vol_path).split(".")[0]
+    labels = load_case_labels(vol_path, seg_path, combine_PED)
+    image = tif.imread(vol_path)
+    plans_manager, configuration_manager, dataset_json = preprocessing
+    return save_preprocessed_case(image, labels, SPACING, case_name, data_folder, gt_folder,
+                                  plans_manager, configuration_manager, dataset_json, tiff_options)
 
 def segnrrd2nnUNet(path):
     """
@@ -45,94 +158,76 @@ def segnrrd2nnUNet(path):
         path (str): The directory path containing the input files.
     """
 
-    output_path = os.path.join(path, f"nnUNet_Dataset_v{FLAGS.version}")
+    # Dictionary mapping segmentation labels to their corresponding numeric values
+    labels_dict = get_label_schema("octave_ped" if FLAGS.combine_PED else "octave")
+    tiff_options = tiff_writer_options(FLAGS)
+    options = {"combine_PED": FLAGS.combine_PED, "version": str(FLAGS.version), "tiff": tiff_options}
 
-    # Create the necessary directories for the nnU-Net dataset
-    create_dataset_dirs(output_path)
+    if FLAGS.output_format == "blosc2":
+        if FLAGS.plans is None:
+            raise ValueError("--plans is required for --output_format blosc2")
+        # Cases are written next to the plans file, i.e. into nnUNet_preprocessed/<dataset>
+        plans_manager, configuration_manager = load_preprocessing_plans(FLAGS.plans, FLAGS.configuration)
+        output_path = os.path.dirname(os.path.abspath(FLAGS.plans))
+        data_folder, gt_folder = preprocessed_dirs(output_path, configuration_manager)
+        # Each configuration keeps its own manifest, next to its preprocessed cases
+        manifest_folder = data_folder
+        preprocessing = (plans_manager, configuration_manager, {"labels": labels_dict})
+        options.update({"output_format": FLAGS.output_format,
+                        "plans": file_fingerprint(FLAGS.plans)["sha256"],
+                        "configuration": FLAGS.configuration})
+    else:
+        output_path = os.path.join(path, f"nnUNet_Dataset_v{FLAGS.version}")
 
-    imagesTr = os.path.join(output_path, "imagesTr")
-    labelsTr = os.path.join(output_path, "labelsTr")
+        # Create the necessary directories for the nnU-Net dataset
+        create_dataset_dirs(output_path)
+
+        imagesTr = os.path.join(output_path, "imagesTr")
+        labelsTr = os.path.join(output_path, "labelsTr")
+        manifest_folder = output_path
 
-    # Dictionary mapping segmentation labels to their corresponding numeric values
-    if not FLAGS.combine_PED:
-        labels_dict = {
-            "background": 0,
-            "CNV": 1,  # Choroidal Neovascularization
-            "DRU": 2,  # Drusen
-            "EX": 3,   # Exudates
-            "FLU": 4,  # Fluid
-            "GA": 5,   # Geographic Atrophy
-            "HEM": 6,  # Hemorrhage
-            "RPE": 7,  # Retinal Pigment Epithelium
-            "RET": 8,  # Retina
-            "CHO": 9,  # Choroid
-            "VIT": 10, # Vitreous
-            "HYA": 11, # Hyaloid
-            "SHS": 12, # Sub-Hyaloid Space
-            "ART": 13, # Artifacts
-            "ERM": 14, # Epiretinal Membrane
-            "SES": 15  # Sub-ERM Space
-        }
-    else:
-        labels_dict = {
-            "background": 0,
-            "PED": 1,  # Pigement Epithelial Detachment
-            "EX": 2,   # Exudates
-            "FLU": 3,  # Fluid
-            "GA": 4,   # Geographic Atrophy
-            "HEM": 5,  # Hemorrhage
-            "RPE": 6,  # Retinal Pigment Epithelium
-            "RET": 7,  # Retina
-            "CHO": 8,  # Choroid
-            "VIT": 9,  # Vitreous
-            "HYA": 10, # Hyaloid
-            "SHS": 11, # Sub-Hyaloid Space
-            "ART": 12, # Artifacts
-            "ERM": 13, # Epiretinal Membrane
-            "SES": 14  # Sub-ERM Space
-        }
     # Retrieve paths for TIFF volumes and segmentation NRRD files, excluding those with "slo" in their names
     vol_paths = [i for i in get_filenames(path, ext="tif") if "slo" not in i]
     seg_paths = [i for i in get_filenames(path, ext="seg.nrrd") if "slo" not in i]
 
-    for vol_path, seg_path in tqdm(zip(vol_paths, seg_paths), total=len(vol_paths)):
-        # Ensure corresponding volume and segmentation files match by their basename
-        assert vol_path.split(".")[0] == seg_path.split(".")[0]
-
-        vol_name = os.path.splitext(os.path.basename(vol_path))[0]
-        seg_name = os.path.basename(vol_path).split(".")[0]
-
-        # Load TIFF volume and segmentation NRRD labels
-        vol = tif.imread(vol_path)
-        bitmap, header = nrrd.read(seg_path)
+    # Only convert cases that are new or changed since the last build
+    cases = {os.path.basename(seg_path).split(".")[0]: {"image": vol_path, "segmentation": seg_path}
+             for vol_path, seg_path in zip(vol_paths, seg_paths)}
+    manifest = load_manifest(manifest_folder, options)
+    removed = prune_manifest(manifest, cases, manifest_folder)
+    stale, fingerprints = plan_build(manifest, cases, manifest_folder, rebuild=FLAGS.rebuild)
+    save_manifest(manifest, manifest_folder)
+    print(f"{len(stale)} of {len(cases)} cases to convert, {len(removed)} removed cases pruned")
 
-        # Add an empty 0th layer to account for the expected background label at index 0
-        bitmap = np.insert(bitmap, 0, np.zeros((1, *bitmap.shape[1:])), axis=0)
+    def record(i, outputs, error):
+        # Record each finished case right away so that an interrupted build can be resumed
+        if error is None:
+            record_case(manifest, stale[i], fingerprints[stale[i]], outputs, manifest_folder)
+            save_manifest(manifest, manifest_folder)
 
-        # Convert one-hot encoded bitmap to label array, flipping axes from (X, Y, Z) to (Z, Y, X)
-        labels = np.argmax(bitmap, axis=0).T
-
-        # if combine_PED is true, combine CNV and DRU labels into PED label
-        if FLAGS.combine_PED:
-            labels = replace_and_shift(labels)
-
-        # Save spacing information as JSON
-        spacing = [81.0, 1.0, 2.9]
-        save_json({"spacing": spacing}, os.path.join(imagesTr, f"{vol_name}.json"))
-        save_json({"spacing": spacing}, os.path.join(labelsTr, f"{seg_name}.json"))
+    if FLAGS.output_format == "blosc2":
+        convert = convert_case_preprocessed
+        tasks = [(cases[name]["image"], cases[name]["segmentation"], data_folder, gt_folder,
+                  preprocessing, FLAGS.combine_PED, tiff_options)
+                 for name in stale]
+    else:
+        convert = convert_case
+        tasks = [(cases[name]["image"], cases[name]["segmentation"], imagesTr, labelsTr,
+                  FLAGS.combine_PED, FLAGS.image_export, tiff_options)
+                 for name in stale]
+    _, failures = run_parallel(convert, tasks, workers=FLAGS.workers, callback=record)
+    print_failures(failures, len(tasks))
 
-        # Save volume and label images as TIFF files
-        output_tif = os.path.join(imagesTr, f"{vol_name}_0000.tif")
-        output_labels = os.path.join(labelsTr, f"{seg_name}.tif")
-        tif.imwrite(output_tif, vol, photometric='minisblack')
-        tif.imwrite(output_labels, labels, photometric='minisblack')
+    # The preprocessed folder already holds the dataset.json nnU-Net planned with, leave it untouched
+    if FLAGS.output_format == "blosc2":
+        return
 
     # Generate the dataset JSON file required by nnU-Net
     generate_dataset_json(output_path,
                           channel_names={"0": "OCT"},
                           labels=labels_dict,
                           file_ending=".tif",
-                          num_training_cases=len(vol_paths),
+                          num_training_cases=len(manifest["cases"]),
                           dataset_name=f"nnUNet_Dataset_v{FLAGS.version}")
 
 if __name__ == "__main__":
@@ -155,6 +250,48 @@ if __name__ == "__main__":
             action="store_true",
             help="Combines DRU and CNV into a PED (SRM) category",
     )
+    parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of worker processes used to convert cases in parallel",
+    )
+    parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Convert every case, even those that are up to date in the manifest",
+    )
+    parser.add_argument(
+            "--image_export",
+            type=str,
+            default="auto",
+            choices=EXPORT_MODES,
+            help="How OCT volumes are placed in imagesTr. Volumes that are already valid nnU-Net "
+                 "images are reflinked/hardlinked/copied as-is instead of re-encoded "
+                 "(auto = reflink, falling back to copy)",
+    )
+    parser.add_argument(
+            "--output_format",
+            type=str,
+            default="tif",
+            choices=OUTPUT_FORMATS,
+            help="tif: nnU-Net raw dataset (imagesTr/labelsTr). blosc2: nnU-Net preprocessed "
+                 "arrays written next to the --plans file, ready for training",
+    )
+    parser.add_argument(
+            "--plans",
+            type=str,
+            default=None,
+            help="nnU-Net plans file (e.g. nnUNet_preprocessed/Dataset001_OCTAVE/nnUNetPlans.json), "
+                 "required for --output_format blosc2",
+    )
+    parser.add_argument(
+            "--configuration",
+            type=str,
+            default="3d_fullres",
+            help="nnU-Net configuration to preprocess for with --output_format blosc2",
+    )
+    add_tiff_writer_args(parser)
     FLAGS, _ = parser.parse_known_args()
     segnrrd2nnUNet(FLAGS.path)
 
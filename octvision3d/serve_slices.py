@@ -0,0 +1,372 @@
+"""
+This script serves the slices of a folder of OCT volumes over HTTP, rendered on demand, so volumes
+can be reviewed in a browser without pre-rendering every slice to PNG with `convert_tif_to_png`.
+
+Functionality:
+- Renders a slice as PNG on request, optionally with its segmentation blended on top
+- Memory-maps uncompressed TIFF volumes and raw .seg.nrrd segmentations; compressed TIFFs are read
+  one page at a time and compressed segmentations are decoded once into a uint8 label map
+- Keeps bounded LRU caches of opened volumes and of rendered slices
+- Renders the neighbouring slices of each requested slice in the background, so scrolling through
+  a volume hits the cache
+
+Usage:
+    python serve_slices.py --path /path/to/volumes --port 8000
+    python serve_slices.py --path nnUNet_Dataset/imagesTr --label_dir nnUNet_Dataset/labelsTr --prefetch 4
+
+    GET /                                       -> {"cases": [...]}
+    GET /case/<id>                              -> {"shape": [Z, Y, X], "labels": true}
+    GET /case/<id>/slice/<z>?overlay=1&alpha=0.4 -> PNG of slice z
+
+Notes:
+- Cases are the .tif files of --path, with the segmentation of <case>.seg.nrrd next to them, or of
+  <label_dir>/<case>.tif for nnU-Net images named <case>_0000.tif (colored with `get_OCT_colors`)
+- Serves on 127.0.0.1 by default; there is no authentication, so only bind other hosts on trusted networks
+"""
+
+import os
+import json
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import cv2
+import nrrd
+import numpy as np
+import tifffile as tif
+from octvision3d.utils import (get_filenames,
+                               get_OCT_colors,
+                               label_palette,
+                               sorted_rgb_colors,
+                               render_labels,
+                               segment_layout,
+                               onehot_slab_to_label_map,
+                               layered_slab_to_label_map)
+from octvision3d.nrrd_io import read_nrrd_header, memmap_nrrd, read_label_map
+
+class CaseNotFound(KeyError):
+    """Raised for a case id that is not served."""
+
+class SliceNotFound(IndexError):
+    """Raised for a slice index outside of a case's volume."""
+
+class LRUCache:
+    """
+    Thread-safe mapping that keeps the `maxsize` most recently used entries.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value of `key` and mark it as most recently used, or None if it is not cached."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        """Cache a value, evicting the least recently used entries beyond `maxsize`."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+class PagedVolume:
+    """
+    (Z, Y, X) TIFF volume that can't be memory-mapped (e.g. compressed), read one page per slice.
+    """
+    def __init__(self, path):
+        self.path = path
+        with tif.TiffFile(path) as tif_file:
+            self.shape = tuple(tif_file.series[0].shape)
+
+    def __getitem__(self, z):
+        return tif.imread(self.path, key=z).reshape(self.shape[1:])
+
+class NrrdLabelVolume:
+    """
+    Memory-mapped raw .seg.nrrd segmentation, converted to a label map one slice at a time.
+    """
+    def __init__(self, path):
+        self.data, header = memmap_nrrd(path)
+        self.layered, self.layers, self.label_values = segment_layout(header)
+        self.shape = tuple(int(i) for i in header["sizes"][-3:][::-1])
+
+    def __getitem__(self, z):
+        slab = np.asarray(self.data[..., z:z + 1])
+        if self.layered:
+            return layered_slab_to_label_map(slab, self.layers, self.label_values)[0]
+        return onehot_slab_to_label_map(slab)[0]
+
+def open_volume(path):
+    """Memory-map a (Z, Y, X) TIFF volume, or read it page by page if it can't be memory-mapped."""
+    try:
+        return tif.memmap(path, mode="r")
+    except ValueError:
+        return PagedVolume(path)
+
+def open_labels(path):
+    """
+    Open the segmentation of a case.
+
+    Parameters:
+    - path: str, .seg.nrrd file or nnU-Net label map TIFF
+
+    Returns:
+    - labels: (Z, Y, X) label map volume, indexed by slice
+    - palette: np.ndarray of shape (L, 3), RGB color of each label value
+    """
+    if not path.endswith(".seg.nrrd"):
+        return open_volume(path), get_OCT_colors()
+    header, _ = read_nrrd_header(path)
+    palette = label_palette(sorted_rgb_colors(header))
+    try:
+        return NrrdLabelVolume(path), palette
+    except nrrd.NRRDError:
+        # Compressed payloads can't be mapped: decode once, slab by slab
+        return read_label_map(path), palette
+
+def find_cases(path, label_dir=None):
+    """
+    List the cases of a folder.
+
+    Returns:
+    - cases: dict, case id -> (tif path, segmentation path or None)
+    """
+    cases = {}
+    for tif_path in get_filenames(path, "tif"):
+        case_id = os.path.basename(tif_path).split(".")[0]
+        if label_dir:
+            label_path = os.path.join(label_dir, f"{case_id.rsplit('_', 1)[0]}.tif")
+        else:
+            label_path = os.path.join(path, f"{case_id}.seg.nrrd")
+        cases[case_id] = (tif_path, label_path if os.path.exists(label_path) else None)
+    return cases
+
+class SliceRenderer:
+    """
+    Renders slices of the cases of a folder as PNG, with LRU caches of volumes and rendered slices
+    and background prefetching of neighbouring slices.
+
+    Parameters:
+    - cases: dict, as returned by `find_cases`
+    - volume_cache: int, number of cases kept open
+    - tile_cache: int, number of rendered slices kept
+    - prefetch: int, number of slices rendered ahead on each side of a requested slice
+    - threads: int, number of background prefetch threads
+    - png_compression: int, PNG compression level (0-9)
+    """
+    def __init__(self, cases, volume_cache=8, tile_cache=512, prefetch=2, threads=2, png_compression=1):
+        self.cases = cases
+        self.volumes = LRUCache(volume_cache)
+        self.tiles = LRUCache(tile_cache)
+        self.prefetch = prefetch
+        self.png_params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        self._pool = ThreadPoolExecutor(max_workers=threads) if prefetch > 0 else None
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._open_lock = threading.Lock()
+
+    def volume(self, case_id):
+        """Return the (image, labels, palette) of a case, opening it if it isn't cached."""
+        if case_id not in self.cases:
+            raise CaseNotFound(f"Unknown case {case_id}")
+        entry = self.volumes.get(case_id)
+        if entry is None:
+            # Open each case once, even when several requests for it arrive together
+            with self._open_lock:
+                entry = self.volumes.get(case_id)
+                if entry is None:
+                    tif_path, label_path = self.cases[case_id]
+                    labels, palette = open_labels(label_path) if label_path else (None, None)
+                    entry = (open_volume(tif_path), labels, palette)
+                    self.volumes.put(case_id, entry)
+        return entry
+
+    def info(self, case_id):
+        image, labels, _ = self.volume(case_id)
+        return {"shape": [int(i) for i in image.shape], "labels": labels is not None}
+
+    def _render(self, case_id, z, overlay, alpha):
+        image, labels, palette = self.volume(case_id)
+        gray = np.asarray(image[z])
+        if not overlay:
+            return cv2.imencode(".png", gray, self.png_params)[1].tobytes()
+        if labels is None:
+            raise ValueError(f"Case {case_id} has no segmentation")
+        rgb = render_labels(np.asarray(labels[z]), palette, image=gray, alpha=alpha)
+        return cv2.imencode(".png", rgb[..., ::-1], self.png_params)[1].tobytes()
+
+    def render(self, case_id, z, overlay=False, alpha=0.4):
+        """
+        Render a slice as PNG, from the tile cache if possible, and prefetch its neighbours.
+
+        Parameters:
+        - case_id: str, case id
+        - z: int, slice index
+        - overlay: bool, whether to blend the segmentation onto the slice
+        - alpha: float, opacity of the segment colors (0-1)
+
+        Returns:
+        - png: bytes
+
+        Raises:
+        - CaseNotFound: if the case is unknown
+        - SliceNotFound: if the slice is out of range
+        - ValueError: if an overlay is requested for a case without segmentation
+        """
+        depth = self.volume(case_id)[0].shape[0]
+        if not 0 <= z < depth:
+            raise SliceNotFound(f"Slice {z} out of range for {depth} slices")
+        key = (case_id, z, bool(overlay), round(alpha, 3) if overlay else None)
+        png = self.tiles.get(key)
+        if png is None:
+            png = self._render(case_id, z, overlay, alpha)
+            self.tiles.put(key, png)
+        if self._pool is not None:
+            for neighbour in range(max(z - self.prefetch, 0), min(z + self.prefetch + 1, depth)):
+                self._prefetch(key[:1] + (neighbour,) + key[2:], alpha)
+        return png
+
+    def _prefetch(self, key, alpha):
+        with self._pending_lock:
+            if key in self.tiles or key in self._pending:
+                return
+            self._pending.add(key)
+
+        def render():
+            try:
+                self.tiles.put(key, self._render(key[0], key[1], key[2], alpha))
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(key)
+
+        self._pool.submit(render)
+
+class SliceRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes GET requests to the `SliceRenderer` of the server.
+    """
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, obj):
+        self._send(json.dumps(obj).encode(), "application/json")
+
+    def do_GET(self):
+        renderer = self.server.renderer
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = parse_qs(url.query)
+        try:
+            if not parts:
+                self._send_json({"cases": sorted(renderer.cases)})
+            elif len(parts) == 2 and parts[0] == "case":
+                self._send_json(renderer.info(parts[1]))
+            elif len(parts) == 4 and parts[0] == "case" and parts[2] == "slice":
+                overlay = query.get("overlay", ["0"])[0] not in ["0", "false", ""]
+                alpha = float(query.get("alpha", ["0.4"])[0])
+                self._send(renderer.render(parts[1], int(parts[3]), overlay, alpha), "image/png")
+            else:
+                self.send_error(404, "Unknown route")
+        except (CaseNotFound, SliceNotFound) as e:
+            self.send_error(404, str(e))
+        except ValueError as e:
+            self.send_error(400, str(e))
+        except Exception as e:
+            # Reading or rendering an existing slice failed, report it as a server error
+            self.send_error(500, "Rendering failed", f"{type(e).__name__}: {e}")
+
+def main():
+    cases = find_cases(FLAGS.path, FLAGS.label_dir)
+    if len(cases) == 0:
+        raise ValueError(f"No .tif files found at {FLAGS.path}")
+
+    server = ThreadingHTTPServer((FLAGS.host, FLAGS.port), SliceRequestHandler)
+    server.renderer = SliceRenderer(cases, FLAGS.volume_cache, FLAGS.tile_cache, FLAGS.prefetch,
+                                    FLAGS.threads, FLAGS.png_compression)
+    print(f"Serving {len(cases)} cases at http://{FLAGS.host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--path",
+        type=str,
+        required=True,
+        help="Folder of TIFF volumes (with .seg.nrrd segmentations of the same name)"
+    )
+    parser.add_argument(
+        "--label_dir",
+        type=str,
+        default=None,
+        help="nnU-Net labels folder to read the label maps of <case>.tif from, instead of .seg.nrrd files"
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Address to serve on"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Port to serve on"
+    )
+    parser.add_argument(
+        "--volume_cache",
+        type=int,
+        default=8,
+        help="Number of cases kept open"
+    )
+    parser.add_argument(
+        "--tile_cache",
+        type=int,
+        default=512,
+        help="Number of rendered slices kept in memory"
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=2,
+        help="Number of neighbouring slices rendered ahead on each side of a requested slice"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=2,
+        help="Number of prefetch threads"
+    )
+    parser.add_argument(
+        "--png_compression",
+        type=int,
+        default=1,
+        choices=range(10),
+        help="PNG compression level (0-9)"
+    )
+    FLAGS, _ = parser.parse_known_args()
+    main()
@@ -6,18 +6,57 @@
 # Used when only desiring to convert images to nnUNet format without corresponding
 # .seg.nrrd 3DSlicer segmentation files. If you do, use segnrrd2nnUNet.py instead.
 #
+# Rebuilds are incremental: a `manifest.json` in the output folder records each volume's size, mtime
+# and hash, so only new or changed volumes are converted and outputs of removed volumes are deleted.
+#
 # Usage:
 #   python tif2nnUNet.py --path /path/to/data
-#   python tif2nnUNet.py --path /path/to/data
+#   python tif2nnUNet.py --path /path/to/data --rebuild
 
 import os
 import argparse
-import tifffile as tif
-from tqdm import tqdm
 from octvision3d.utils import (get_filenames,
                                save_json,
                                create_directory,
-                               generate_dataset_json)
+                               generate_dataset_json,
+                               run_parallel,
+                               print_failures)
+from octvision3d.tiff_io import (EXPORT_MODES,
+                                 export_image,
+                                 add_tiff_writer_args,
+                                 tiff_writer_options)
+from octvision3d.label_schemas import get_label_schema
+from octvision3d.manifest import (load_manifest,
+                                  save_manifest,
+                                  prune_manifest,
+                                  plan_build,
+                                  record_case)
+
+def convert_image(vol_path, output_path, image_export="auto", tiff_options=None):
+    """
+    Convert a single TIFF volume into an nnU-Net image file and its spacing JSON.
+
+    Parameters:
+    - vol_path: str, path to the TIFF OCT volume
+    - output_path: str, output directory for images
+    - image_export: str, how the volume is placed in `output_path` (see `tiff_io.export_image`)
+    - tiff_options: dict, optional TIFF writer options (see `tiff_io.tiff_writer_options`)
+
+    Returns:
+    - outputs: list of str, paths of the files written for this volume
+    """
+    vol_name = os.path.splitext(os.path.basename(vol_path))[0]
+
+    # Save spacing information as JSON
+    spacing = [81.0, 1.0, 2.9]
+    output_json = os.path.join(output_path, f"{vol_name}.json")
+    save_json({"spacing": spacing}, output_json)
+
+    # Save volume as TIFF file. The volume is linked or copied as-is when it is already a
+    # valid nnU-Net image, and only re-encoded otherwise
+    output_tif = os.path.join(output_path, f"{vol_name}_0000.tif")
+    export_image(vol_path, output_tif, mode=image_export, options=tiff_options)
+    return [output_json, output_tif]
 
 def tif2nnUNet():
     """
@@ -32,46 +71,36 @@ def tif2nnUNet():
     
     create_directory(output_path)
 
-    labels_dict = {
-        "background": 0,
-        "SRM": 1,  # Subretinal Material
-        "HRM": 2,  # Hyperreflective Material
-        "FLU": 3,  # Fluid
-        "HTD": 4,  # Hypertransmission defect
-        "RPE": 5,  # Retinal Pigment Epithelium
-        "RET": 6,  # Retina
-        "CHO": 7,  # Choroid
-        "VIT": 8,  # Vitreous
-        "HYA": 9,  # Hyaloid
-        "SHS": 10, # Sub-Hyaloid Space
-        "ART": 11, # Artifacts
-        "ERM": 12, # Epiretinal Membrane
-        "SES": 13  # Sub-ERM Space
-    }
+    labels_dict = get_label_schema("octave_srm")
+
     # Retrieve paths for TIFF volumes and segmentation NRRD files, excluding those with "slo" in their names
     vol_paths = [i for i in get_filenames(FLAGS.path, ext="tif") if "slo" not in i]
 
-    for vol_path in tqdm(vol_paths, total=len(vol_paths)):
-
-        vol_name = os.path.splitext(os.path.basename(vol_path))[0]
+    # Only convert volumes that are new or changed since the last build
+    cases = {os.path.splitext(os.path.basename(vol_path))[0]: {"image": vol_path} for vol_path in vol_paths}
+    tiff_options = tiff_writer_options(FLAGS)
+    manifest = load_manifest(dataset_output_path, options={"tiff": tiff_options})
+    removed = prune_manifest(manifest, cases, dataset_output_path)
+    stale, fingerprints = plan_build(manifest, cases, dataset_output_path, rebuild=FLAGS.rebuild)
+    save_manifest(manifest, dataset_output_path)
+    print(f"{len(stale)} of {len(cases)} volumes to convert, {len(removed)} removed volumes pruned")
 
-        # Load TIFF volume and segmentation NRRD labels
-        vol = tif.imread(vol_path)
+    def record(i, outputs, error):
+        # Record each finished volume right away so that an interrupted build can be resumed
+        if error is None:
+            record_case(manifest, stale[i], fingerprints[stale[i]], outputs, dataset_output_path)
+            save_manifest(manifest, dataset_output_path)
 
-        # Save spacing information as JSON
-        spacing = [81.0, 1.0, 2.9]
-        save_json({"spacing": spacing}, os.path.join(output_path, f"{vol_name}.json"))
-
-        # Save volume and label images as TIFF files
-        output_tif = os.path.join(output_path, f"{vol_name}_0000.tif")
-        tif.imwrite(output_tif, vol, photometric='minisblack')
+    tasks = [(cases[name]["image"], output_path, FLAGS.image_export, tiff_options) for name in stale]
+    _, failures = run_parallel(convert_image, tasks, callback=record)
+    print_failures(failures, len(tasks))
 
     # Generate the dataset JSON file required by nnU-Net
     generate_dataset_json(dataset_output_path,
                           channel_names={"0": "OCT"},
                           labels=labels_dict,
                           file_ending=".tif",
-                          num_training_cases=len(vol_paths),
+                          num_training_cases=len(manifest["cases"]),
                           dataset_name=f"OCTAVE")
 
 if __name__ == "__main__":
@@ -82,6 +111,21 @@ if __name__ == "__main__":
             required=True,
             help="Path to tif volumes to convert",
     )
+    parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Convert every volume, even those that are up to date in the manifest",
+    )
+    parser.add_argument(
+            "--image_export",
+            type=str,
+            default="auto",
+            choices=EXPORT_MODES,
+            help="How OCT volumes are placed in imagesTs. Volumes that are already valid nnU-Net "
+                 "images are reflinked/hardlinked/copied as-is instead of re-encoded "
+                 "(auto = reflink, falling back to copy)",
+    )
+    add_tiff_writer_args(parser)
     FLAGS, _ = parser.parse_known_args()
     tif2nnUNet()
 
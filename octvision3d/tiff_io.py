@@ -0,0 +1,237 @@
+"""
+This module provides helpers for writing the TIFF files of nnU-Net datasets.
+
+`add_tiff_writer_args` adds shared command line options to choose the codec (zlib, zstd or LZW via
+imagecodecs), compression level, predictor, tile size and number of encoder threads of the TIFF
+files a script writes, and `write_tiff` writes an array with those options. By default files are
+written uncompressed in strips, as before. `write_tiff_pages` writes a volume from an iterator of
+pages, for sources that are streamed slice by slice instead of loaded whole.
+
+`export_image` places an OCT volume into an nnU-Net images folder. nnU-Net reads TIFF images with
+`tifffile.imread`, so when the source TIFF already holds a single 3D (Z, Y, X) single-channel
+series it can be used as-is: it is reflinked, hardlinked or copied byte-for-byte instead of being
+decoded and re-encoded. Re-encoding is only used when the layout or dtype needs to change.
+"""
+
+import os
+import shutil
+import tifffile as tif
+
+EXPORT_MODES = ["auto", "reflink", "hardlink", "copy", "encode"]
+TIFF_COMPRESSIONS = ["none", "zlib", "zstd", "lzw"]
+# Codecs that take a compression level (imagecodecs' LZW encoder has none)
+LEVEL_COMPRESSIONS = ["zlib", "zstd"]
+
+# Linux ioctl to share the data blocks of two files on copy-on-write filesystems (btrfs, XFS, ...)
+_FICLONE = 0x40049409
+
+def add_tiff_writer_args(parser):
+    """
+    Add the shared TIFF output options to an argparse parser.
+
+    Parameters:
+    - parser: argparse.ArgumentParser
+    """
+    parser.add_argument(
+        "--compression",
+        type=str,
+        default="none",
+        choices=TIFF_COMPRESSIONS,
+        help="Codec used for output TIFF files"
+    )
+    parser.add_argument(
+        "--compression_level",
+        type=int,
+        default=None,
+        help="Compression level of the zlib or zstd codec (codec default if not set)"
+    )
+    parser.add_argument(
+        "--predictor",
+        action="store_true",
+        help="Apply a horizontal differencing (or floating point) predictor before compression"
+    )
+    parser.add_argument(
+        "--tile",
+        type=int,
+        default=0,
+        help="Write square tiles of this size (multiple of 16) instead of strips (0, the default)"
+    )
+    parser.add_argument(
+        "--encoder_threads",
+        type=int,
+        default=1,
+        help="Number of threads used to compress the strips/tiles of each TIFF file"
+    )
+
+def tiff_writer_options(flags):
+    """
+    Collect the TIFF output options added by `add_tiff_writer_args` from parsed arguments.
+
+    Parameters:
+    - flags: argparse.Namespace, parsed command line arguments
+
+    Returns:
+    - options: dict, JSON-serialisable writer options for `write_tiff`
+    """
+    if flags.tile % 16 != 0 or flags.tile < 0:
+        raise ValueError(f"--tile must be 0 (strips) or a positive multiple of 16, got {flags.tile}")
+    if flags.compression_level is not None and flags.compression not in LEVEL_COMPRESSIONS:
+        raise ValueError(f"--compression_level is only supported with --compression "
+                         f"{' or '.join(LEVEL_COMPRESSIONS)}, got {flags.compression}")
+    return {
+        "compression": flags.compression,
+        "compression_level": flags.compression_level,
+        "predictor": flags.predictor,
+        "tile": flags.tile,
+        "encoder_threads": flags.encoder_threads,
+    }
+
+def _imwrite_kwargs(options):
+    """Translate writer options into `tifffile.imwrite` keyword arguments."""
+    kwargs = {"photometric": "minisblack"}
+    if not options:
+        return kwargs
+    if options.get("compression", "none") != "none":
+        kwargs["compression"] = options["compression"]
+        if options.get("compression_level") is not None and options["compression"] in LEVEL_COMPRESSIONS:
+            kwargs["compressionargs"] = {"level": options["compression_level"]}
+        if options.get("predictor"):
+            kwargs["predictor"] = True
+    if options.get("tile"):
+        kwargs["tile"] = (options["tile"], options["tile"])
+    if options.get("encoder_threads", 1) > 1:
+        kwargs["maxworkers"] = options["encoder_threads"]
+    return kwargs
+
+def is_default_layout(options):
+    """Check whether writer options produce plain uncompressed strips (the tifffile default)."""
+    return not options or (options.get("compression", "none") == "none" and not options.get("tile"))
+
+def write_tiff(path, data, options=None):
+    """
+    Write an array to a single-channel TIFF file with the given writer options.
+
+    Parameters:
+    - path: str, output TIFF path
+    - data: np.ndarray, 2D image or 3D (Z, Y, X) volume
+    - options: dict, optional writer options as returned by `tiff_writer_options`.
+      If None, the file is written uncompressed in strips.
+    """
+    tif.imwrite(path, data, **_imwrite_kwargs(options))
+
+def _iter_tiles(pages, tile):
+    """Split each 2D page into row-major tiles, the order tifffile expects for tiled iterators."""
+    for page in pages:
+        for y in range(0, page.shape[0], tile[0]):
+            for x in range(0, page.shape[1], tile[1]):
+                yield page[y:y + tile[0], x:x + tile[1]]
+
+def write_tiff_pages(path, pages, shape, dtype, options=None):
+    """
+    Write a (Z, Y, X) volume to a single-channel TIFF file page by page.
+
+    Parameters:
+    - path: str, output TIFF path
+    - pages: iterable of 2D np.ndarray, the Z pages of shape (Y, X), in order
+    - shape: tuple of int, (Z, Y, X) shape of the volume
+    - dtype: np.dtype, dtype of the pages
+    - options: dict, optional writer options as returned by `tiff_writer_options`
+
+    Notes:
+    - Only one page is held at a time, so the volume never needs to fit in memory
+    """
+    kwargs = _imwrite_kwargs(options)
+    if "tile" in kwargs:
+        pages = _iter_tiles(pages, kwargs["tile"])
+    tif.imwrite(path, pages, shape=tuple(shape), dtype=dtype, **kwargs)
+
+def is_nnunet_image(path):
+    """
+    Check whether a TIFF file can be used unchanged as a single-channel nnU-Net image.
+
+    Parameters:
+    - path: str, path to the TIFF file
+
+    Returns:
+    - valid: bool, True if the file holds exactly one numeric (Z, Y, X) series with one sample per pixel
+    """
+    with tif.TiffFile(path) as tif_file:
+        if len(tif_file.series) != 1:
+            return False
+        series = tif_file.series[0]
+        if series.ndim != 3 or series.dtype.kind not in "uif":
+            return False
+        return all(page.samplesperpixel == 1 for page in series.pages)
+
+def _reflink(src, dst):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("Reflinks are not supported on this platform")
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+
+_LINKERS = {
+    "reflink": _reflink,
+    "hardlink": os.link,
+    "copy": shutil.copyfile,
+}
+
+# Methods tried in order for each export mode. Byte-for-byte copy is the fallback for links that
+# are not supported (e.g. across filesystems or on filesystems without reflinks)
+_EXPORT_METHODS = {
+    "auto": ["reflink", "copy"],
+    "reflink": ["reflink", "copy"],
+    "hardlink": ["hardlink", "copy"],
+    "copy": ["copy"],
+    "encode": [],
+}
+
+def export_image(src, dst, mode="auto", options=None):
+    """
+    Export a TIFF OCT volume to an nnU-Net image file, avoiding a decode/re-encode where possible.
+
+    Parameters:
+    - src: str, path to the source TIFF volume
+    - dst: str, path of the nnU-Net image file to write (e.g. imagesTr/<case>_0000.tif)
+    - mode: str, one of
+        "auto": reflink, falling back to a byte-for-byte copy
+        "reflink" / "hardlink": the given link type, falling back to a byte-for-byte copy
+        "copy": byte-for-byte copy
+        "encode": always decode and re-encode the volume
+      In every mode the volume is re-encoded if it is not already a valid nnU-Net image.
+    - options: dict, optional writer options as returned by `tiff_writer_options`. Requesting
+      compression or tiles always re-encodes the volume with those options.
+
+    Returns:
+    - method: str, the method that was used ("reflink", "hardlink", "copy" or "encode")
+
+    Notes:
+    - `dst` is replaced atomically, so an existing output that is a hardlink to a source file is
+      never truncated in place.
+    - Hardlinked outputs share their data with the source, so they must never be modified in place.
+    """
+    if mode not in _EXPORT_METHODS:
+        raise ValueError(f"Unsupported export mode '{mode}'. Choose from {EXPORT_MODES}.")
+
+    tmp_dst = f"{dst}.tmp"
+    if os.path.exists(tmp_dst):
+        os.remove(tmp_dst)
+
+    methods = _EXPORT_METHODS[mode]
+    if methods and not (is_default_layout(options) and is_nnunet_image(src)):
+        methods = []
+    for method in methods:
+        try:
+            _LINKERS[method](src, tmp_dst)
+        except OSError:
+            if os.path.exists(tmp_dst):
+                os.remove(tmp_dst)
+            continue
+        os.replace(tmp_dst, dst)
+        return method
+
+    vol = tif.imread(src)
+    write_tiff(tmp_dst, vol, options)
+    os.replace(tmp_dst, dst)
+    return "encode"
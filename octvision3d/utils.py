@@ -2,8 +2,13 @@
 This module provides utility functions for working with the OCTAVE segmentation dataset 
 """
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from glob import glob
+from tqdm import tqdm
 import numpy as np
+import nrrd
 import json
 import cv2
 import re
@@ -14,8 +19,9 @@ def get_OCT_colors():
     Return the standard RGB colormap for OCT tissue segmentation labels.
 
     Returns:
-    - colors: np.ndarray of shape (15, 3), where each row is an RGB triplet (0–255)
+    - colors: np.ndarray of shape (16, 3), where each row is an RGB triplet (0–255)
       corresponding to a specific class label. The first entry (index 0) is background.
+      Covers every label value of the schemas in `label_schemas` (up to SES = 15).
     """
     colors = np.array([
         [0, 0, 0], # background
@@ -33,6 +39,7 @@ def get_OCT_colors():
         [252, 252, 84],
         [56, 125, 247],
         [100, 50, 0],
+        [255, 160, 200],
     ])
     return colors
 
@@ -75,24 +82,548 @@ def sorted_rgb_colors(header):
     rgb_colors = np.array([[round(255.*float(c)) for c in i.split(" ")] for i in sorted_colors], dtype=np.uint8)
     return rgb_colors
 
+def label_palette(colors, background=(0, 0, 0)):
+    """
+    Build a label palette from per-segment colors.
+
+    Parameters:
+    - colors: np.ndarray of shape (K, 3), RGB color of each segment, e.g. from `sorted_rgb_colors`
+    - background: tuple, RGB color of unlabeled pixels (default: black)
+
+    Returns:
+    - palette: np.ndarray of shape (K + 1, 3) and dtype uint8, where palette[0] is the background
+      and palette[k + 1] the color of segment k, matching the labels of `onehot_to_label_map`
+    """
+    return np.vstack([np.asarray(background, dtype=np.uint8)[None], np.asarray(colors, dtype=np.uint8)])
+
+def render_labels(labels, palette, image=None, alpha=1.0):
+    """
+    Color a label map through a palette, optionally alpha-blended onto a grayscale image.
+
+    Parameters:
+    - labels: np.ndarray, integer label map of any shape, e.g. (Z, Y, X) or (Y, X)
+    - palette: np.ndarray of shape (L, 3), RGB color of each label value, e.g. from `label_palette`
+      or `get_OCT_colors` for nnU-Net label maps
+    - image: np.ndarray, optional uint8 grayscale image of the same shape as `labels`. Labeled pixels
+      are blended onto it and background pixels (label 0) show the image unchanged
+    - alpha: float, opacity of the label colors when blending (0-1, default: 1)
+
+    Returns:
+    - rgb: np.ndarray of shape labels.shape + (3,) and dtype uint8
+    """
+    # A single gather colors every pixel
+    rgb = np.take(np.asarray(palette, dtype=np.uint8), labels, axis=0)
+    if image is None:
+        return rgb
+
+    if image.shape != labels.shape or image.dtype != np.uint8:
+        raise ValueError(f"Expected a uint8 image of shape {labels.shape}, got {image.dtype} {image.shape}")
+
+    # Integer blend: (color * w + gray * (255 - w)) / 255, rounded
+    w = np.uint16(round(255 * min(max(alpha, 0.0), 1.0)))
+    gray = image[..., None]
+    blended = rgb.astype(np.uint16) * w
+    blended += gray * (np.uint16(255) - w)
+    blended += 127
+    blended //= 255
+    return np.where(labels[..., None] > 0, blended.astype(np.uint8), gray)
+
+def render_overlay(bitmap, colors, image=None, alpha=1.0, chunk_size=4):
+    """
+    Render a one-hot segmentation bitmap as RGB overlays, one image per Z-slice.
+
+    The bitmap is reduced to a label map in one pass and colored with a single palette gather.
+    Where several segments overlap, the first segment wins.
+
+    Parameters:
+    - bitmap: np.ndarray, one-hot bitmap of shape (K, X, Y, Z) as read by `nrrd.read` (or a Z-slab of it)
+    - colors: np.ndarray of shape (K, 3), RGB color of each segment, e.g. from `sorted_rgb_colors`
+    - image: np.ndarray, optional uint8 grayscale volume of shape (Z, Y, X) to blend onto
+    - alpha: float, opacity of the segment colors when blending (default: 1)
+    - chunk_size: int, number of Z-slices converted to labels at once (default: 4)
+
+    Returns:
+    - overlay: np.ndarray of shape (Z, Y, X, 3) and dtype uint8, RGB
+    """
+    labels = onehot_to_label_map(bitmap, chunk_size=chunk_size)
+    return render_labels(labels, label_palette(colors), image=image, alpha=alpha)
+
 def overlay_segments(bitmap, colors):
     """
     Overlay binary masks onto a blank image with specified colors.
 
-    :param masks: List of binary masks (numpy arrays).
-    :param colors: List of colors corresponding to each mask.
-    :return: Image with masks overlaid.
+    Kept for existing callers, see `render_overlay`.
+
+    :param masks: One-hot bitmap of shape (K, X, Y, Z).
+    :param colors: RGB colors corresponding to each mask.
+    :return: (Z, Y, X, 3) image with masks overlaid.
+    """
+    return render_overlay(bitmap, colors)
+
+def _call_isolated(func, args):
+    """
+    Call `func(*args)` and capture any exception so that one failing case does not abort a batch.
+
+    Returns:
+    - (result, None) on success, or (None, error message) on failure
+    """
+    try:
+        return func(*args), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+def run_parallel(func, tasks, workers=1, desc=None, callback=None):
+    """
+    Apply a function to a list of argument tuples, optionally fanning them out to a process pool.
+
+    Parameters:
+    - func: callable, a module-level function (must be picklable when workers > 1)
+    - tasks: list of tuples, positional arguments for each call
+    - workers: int, number of worker processes. 1 (default) runs serially in the current process
+    - desc: str, optional tqdm progress bar description
+    - callback: callable, optional function called in the parent process as each task finishes,
+      with arguments (task index, result, error message or None)
+
+    Returns:
+    - results: list, the return value of each call in task order (None for failed tasks)
+    - failures: list of (task, error message) tuples in task order
+
+    Notes:
+    - Exceptions raised by `func` are captured per task, so one bad case doesn't kill the run.
+    """
+    tasks = list(tasks)
+    outcomes = [None] * len(tasks)
+
+    if workers is None or workers <= 1:
+        for i, args in enumerate(tqdm(tasks, desc=desc)):
+            outcomes[i] = _call_isolated(func, args)
+            if callback is not None:
+                callback(i, *outcomes[i])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_call_isolated, func, args): i for i, args in enumerate(tasks)}
+            for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                i = futures[future]
+                try:
+                    outcomes[i] = future.result()
+                except Exception as e:
+                    # The worker process itself died (e.g. killed by the OOM killer)
+                    outcomes[i] = (None, f"{type(e).__name__}: {e}")
+                if callback is not None:
+                    callback(i, *outcomes[i])
+
+    results = [result for result, _ in outcomes]
+    failures = [(args, error) for args, (_, error) in zip(tasks, outcomes) if error is not None]
+    return results, failures
+
+def print_failures(failures, total):
+    """
+    Print a summary of the tasks that failed in a `run_parallel` batch.
+
+    Parameters:
+    - failures: list of (task, error message) tuples as returned by `run_parallel`.
+      The first element of each task is used to identify the case (usually its input path).
+    - total: int, total number of tasks that were run
+    """
+    if not failures:
+        print(f"All {total} cases processed successfully")
+        return
+    print(f"{len(failures)} of {total} cases failed:")
+    for task, error in failures:
+        print(f"  {task[0]}: {error}")
+
+def onehot_slab_to_label_map(slab):
+    """
+    Convert a chunk of a one-hot segmentation bitmap into a uint8 label map.
+
+    Equivalent to `np.argmax(np.insert(slab, 0, 0, axis=0), axis=0).T`: voxels without any
+    segment are labelled 0 (background) and segment k is labelled k + 1. Where several
+    segments overlap, the first segment wins.
+
+    Parameters:
+    - slab: np.ndarray, one-hot bitmap of shape (num_segments, X, Y, Z)
+
+    Returns:
+    - labels: np.ndarray of dtype uint8 and shape (Z, Y, X)
+    """
+    if slab.shape[0] > 255:
+        raise ValueError(f"Cannot store {slab.shape[0]} segments in a uint8 label map")
+    labels = np.argmax(slab, axis=0).astype(np.uint8)
+    labels += 1
+    # Only the background channel can win where no segment is set (max <= 0)
+    labels[slab.max(axis=0) <= 0] = 0
+    return labels.T
+
+def onehot_to_label_map(bitmap, chunk_size=4):
+    """
+    Convert a one-hot segmentation bitmap into a uint8 label map, one Z-chunk at a time.
+
+    Produces the same labels as padding the bitmap with an empty background channel and taking
+    the argmax, without materialising the padded copy or a full-size int64 index array.
+
+    Parameters:
+    - bitmap: np.ndarray, one-hot bitmap of shape (num_segments, X, Y, Z) as read by `nrrd.read`
+    - chunk_size: int, number of Z-slices converted at once (default: 4)
+
+    Returns:
+    - labels: np.ndarray of dtype uint8 and shape (Z, Y, X)
+    """
+    z_dim = bitmap.shape[-1]
+    labels = np.empty(bitmap.shape[1:][::-1], dtype=np.uint8)
+    for z in range(0, z_dim, chunk_size):
+        labels[z:z + chunk_size] = onehot_slab_to_label_map(bitmap[..., z:z + chunk_size])
+    return labels
+
+def segment_layout(header):
+    """
+    Describe how the segments of a .seg.nrrd file are stored in its payload.
+
+    Files are either one-hot, with one (num_segments, X, Y, Z) channel per segment, or in Slicer 5's
+    layered labelmap format, where segments share labelmap layers and are told apart by the value
+    they have in their layer (`Segment<N>_Layer` and `Segment<N>_LabelValue`). A layered file with a
+    single layer has no layer axis (X, Y, Z).
+
+    Parameters:
+    - header: collections.OrderedDict, the NRRD header
+
+    Returns:
+    - layered: bool, True for the layered labelmap format, False for one-hot
+    - layers: list of int, the layer of each segment, in segment order
+    - label_values: list of int, the value of each segment in its layer
+    """
+    table = SegmentTable.from_header(header)
+    # Segments without Layer / LabelValue fields each have their own channel of 0s and 1s
+    layers = [k if s.layer is None else s.layer for k, s in enumerate(table)]
+    label_values = [1 if s.label_value is None else s.label_value for s in table]
+    onehot = int(header["dimension"]) == 4 and layers == list(range(len(table))) and set(label_values) <= {1}
+    return not onehot, layers, label_values
+
+def layered_slab_to_label_map(slab, layers, label_values, lut=None):
+    """
+    Convert a chunk of a layered labelmap segmentation into a uint8 label map.
+
+    Segment k is labelled k + 1 and voxels without any segment 0, as for `onehot_slab_to_label_map`.
+    Where segments on different layers overlap, the first segment wins. Single-layer uint8 files
+    are converted with one lookup table gather.
+
+    Parameters:
+    - slab: np.ndarray, labelmap of shape (num_layers, X, Y, Z), or (X, Y, Z) for a single layer
+    - layers, label_values: list of int, as returned by `segment_layout`
+    - lut: np.ndarray of shape (256,) and dtype uint8, optional remapping applied to the labels
+      (e.g. from `label_schemas.compile_lut`)
+
+    Returns:
+    - labels: np.ndarray of dtype uint8 and shape (Z, Y, X)
+    """
+    if len(label_values) > 255:
+        raise ValueError(f"Cannot store {len(label_values)} segments in a uint8 label map")
+    if slab.ndim == 3:
+        slab = slab[None]
+
+    if len(set(layers)) == 1 and slab.dtype == np.uint8:
+        segment_lut = np.zeros(256, dtype=np.uint8)
+        for k in reversed(range(len(label_values))):
+            segment_lut[label_values[k]] = k + 1
+        if lut is not None:
+            segment_lut = lut[segment_lut]
+        return np.take(segment_lut, slab[layers[0]].T, mode="clip")
+
+    labels = np.zeros(slab.shape[1:][::-1], dtype=np.uint8)
+    for k in reversed(range(len(label_values))):
+        labels[slab[layers[k]].T == label_values[k]] = k + 1
+    if lut is not None:
+        labels = np.take(lut, labels, mode="clip")
+    return labels
+
+def segment_masks(slab, layers, label_values, layered=True):
+    """
+    Boolean mask of each segment in a chunk of a one-hot or layered labelmap segmentation.
+
+    Parameters:
+    - slab: np.ndarray, one-hot (num_segments, X, Y, Z) or layered (num_layers, X, Y, Z) / (X, Y, Z) chunk
+    - layers, label_values, layered: as returned by `segment_layout`
+
+    Returns:
+    - masks: np.ndarray of dtype bool and shape (num_segments, X, Y, Z)
+    """
+    if not layered:
+        return slab != 0
+    if slab.ndim == 3:
+        slab = slab[None]
+    masks = np.empty((len(label_values),) + slab.shape[1:], dtype=bool)
+    for k, (layer, value) in enumerate(zip(layers, label_values)):
+        np.equal(slab[layer], value, out=masks[k])
+    return masks
+
+def segment_extents(slabs, header):
+    """
+    Compute the voxel extent of each segment from consecutive Z-slabs of a segmentation.
+
+    Parameters:
+    - slabs: iterable of (z, slab) tuples covering the whole Z-axis in order, e.g. from
+      `nrrd_io.iter_nrrd_slabs` or `[(0, data)]` for an array read with `nrrd.read`
+    - header: collections.OrderedDict, the .seg.nrrd header of the segmentation
+
+    Returns:
+    - extents: list of str, one "x_min x_max y_min y_max z_min z_max" string per segment (the format of
+      the Segment<N>_Extent fields), "0 -1 0 -1 0 -1" for empty segments
+    """
+    layered, layers, label_values = segment_layout(header)
+    x_any, y_any, z_any = None, None, []
+    for _, slab in slabs:
+        masks = segment_masks(slab, layers, label_values, layered)
+        if x_any is None:
+            x_any = np.zeros(masks.shape[:2], dtype=bool)
+            y_any = np.zeros((masks.shape[0], masks.shape[2]), dtype=bool)
+        x_any |= masks.any(axis=(2, 3))
+        y_any |= masks.any(axis=(1, 3))
+        z_any.append(masks.any(axis=(1, 2)))
+    z_any = np.concatenate(z_any, axis=1)
+
+    extents = []
+    for k in range(len(label_values)):
+        if not z_any[k].any():
+            extents.append("0 -1 0 -1 0 -1")
+            continue
+        bounds = []
+        for axis_any in (x_any[k], y_any[k], z_any[k]):
+            idx = np.flatnonzero(axis_any)
+            bounds += [int(idx[0]), int(idx[-1])]
+        extents.append(" ".join(str(b) for b in bounds))
+    return extents
+
+def _set_layer_axis(header, num_layers, spatial_shape):
+    """Update the geometry fields of a .seg.nrrd header for a payload with `num_layers` layers."""
+    directions = np.asarray(header["space directions"], dtype=float)
+    if len(directions) == 4:
+        directions = directions[1:]
+    if num_layers == 1:
+        header["dimension"] = 3
+        header["sizes"] = np.array(spatial_shape)
+        header["space directions"] = directions
+        header["kinds"] = ["domain"] * 3
+    else:
+        header["dimension"] = 4
+        header["sizes"] = np.array((num_layers,) + tuple(spatial_shape))
+        header["space directions"] = np.vstack([np.full((1, 3), np.nan), directions])
+        header["kinds"] = ["list"] + ["domain"] * 3
+
+def onehot_to_layered(data, header):
+    """
+    Convert a one-hot segmentation to Slicer's layered labelmap format.
+
+    Segments are packed into as few layers as possible: each segment goes to the first layer it does
+    not overlap with, so mutually exclusive segments all share a single (X, Y, Z) labelmap. Segment k
+    gets label value k + 1.
+
+    Parameters:
+    - data: np.ndarray, one-hot bitmap of shape (num_segments, X, Y, Z)
+    - header: collections.OrderedDict, its .seg.nrrd header (not modified)
+
+    Returns:
+    - layered: np.ndarray of dtype uint8, (X, Y, Z) for a single layer or (num_layers, X, Y, Z)
+    - new_header: OrderedDict with the `Segment<N>_Layer` / `_LabelValue` fields and geometry updated
+    """
+    table = SegmentTable.from_header(header)
+    if len(table) != data.shape[0]:
+        raise ValueError(f"Header has {len(table)} segments but the bitmap has {data.shape[0]} channels")
+    if len(table) > 255:
+        raise ValueError(f"Cannot store {len(table)} segments in a uint8 labelmap")
+
+    layers = []
+    for k, segment in enumerate(table):
+        mask = data[k] != 0
+        for i, layer in enumerate(layers):
+            if not layer[mask].any():
+                break
+        else:
+            layers.append(np.zeros(data.shape[1:], dtype=np.uint8, order="F"))
+            i = len(layers) - 1
+        layers[i][mask] = k + 1
+        segment.fields["LabelValue"] = str(k + 1)
+        segment.fields["Layer"] = str(i)
+
+    if not layers:
+        layers.append(np.zeros(data.shape[1:], dtype=np.uint8, order="F"))
+    layered = layers[0] if len(layers) == 1 else np.stack(layers)
+    new_header = table.to_header(header)
+    _set_layer_axis(new_header, max(len(layers), 1), data.shape[1:])
+    return layered, new_header
+
+def layered_to_onehot(data, header):
+    """
+    Convert a segmentation in Slicer's layered labelmap format to one-hot.
+
+    Parameters:
+    - data: np.ndarray, labelmap of shape (num_layers, X, Y, Z), or (X, Y, Z) for a single layer
+    - header: collections.OrderedDict, its .seg.nrrd header (not modified)
+
+    Returns:
+    - onehot: np.ndarray of dtype uint8 and shape (num_segments, X, Y, Z)
+    - new_header: OrderedDict with one layer per segment (label value 1) and geometry updated
+    """
+    table = SegmentTable.from_header(header)
+    _, layers, label_values = segment_layout(header)
+    layered = data[None] if data.ndim == 3 else data
+
+    onehot = np.zeros((len(table),) + layered.shape[1:], dtype=np.uint8, order="F")
+    for k, segment in enumerate(table):
+        onehot[k] = layered[layers[k]] == label_values[k]
+        segment.fields["LabelValue"] = "1"
+        segment.fields["Layer"] = str(k)
+
+    new_header = table.to_header(header)
+    _set_layer_axis(new_header, len(table), layered.shape[1:])
+    return onehot, new_header
+
+# Number of set bits of every byte value
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+class PackedSegmentation:
     """
-    # Create a blank image
+    A one-hot segmentation bitmap held as bits, 8 voxels per byte instead of one uint8 per voxel.
+
+    The (Y, X) plane of each segment and Z-slice is flattened and packed with `np.packbits`
+    (little bit order) into one row of `bits`, of shape (num_segments, Z, ceil(Y * X / 8)).
+    Unions, overlaps, voxel counts and empty-slice checks run on the packed bytes directly.
+
+    Usage:
+        packed = PackedSegmentation.from_slabs(iter_nrrd_slabs(path, slab_depth=8))
+        counts = packed.voxel_counts()
+        n_overlap = packed.overlap().voxel_counts()[0]
+        masks = packed.unpack(slices=[0, 10])
+    """
+
+    def __init__(self, bits, shape):
+        """
+        Parameters:
+        - bits: np.ndarray of dtype uint8 and shape (num_segments, Z, ceil(Y * X / 8)), packed planes
+        - shape: tuple, (num_segments, X, Y, Z) shape of the one-hot bitmap, as read by `nrrd.read`
+        """
+        self.bits = bits
+        self.shape = tuple(int(i) for i in shape)
+
+    @staticmethod
+    def _pack(slab):
+        """Pack a (K, X, Y, Z) one-hot slab into (K, Z, bytes) rows of (Y, X) planes."""
+        num_segments, x_dim, y_dim, z_dim = slab.shape
+        planes = (slab != 0).transpose(0, 3, 2, 1).reshape(num_segments, z_dim, y_dim * x_dim)
+        return np.packbits(planes, axis=-1, bitorder="little")
+
+    @classmethod
+    def from_bitmap(cls, bitmap, chunk_size=4):
+        """
+        Pack a one-hot bitmap, one Z-chunk at a time.
+
+        Parameters:
+        - bitmap: np.ndarray, one-hot bitmap of shape (num_segments, X, Y, Z); any nonzero value is set
+        - chunk_size: int, number of Z-slices packed at once (default: 4)
+
+        Returns:
+        - packed: PackedSegmentation
+        """
+        return cls.from_slabs(((z, bitmap[..., z:z + chunk_size]) for z in range(0, bitmap.shape[-1], chunk_size)))
+
+    @classmethod
+    def from_slabs(cls, slabs):
+        """
+        Pack a one-hot bitmap from consecutive Z-slabs, without holding the unpacked bitmap.
+
+        Parameters:
+        - slabs: iterable of (z, slab) tuples with slabs of shape (num_segments, X, Y, depth), as
+          yielded by `nrrd_io.iter_nrrd_slabs`
+
+        Returns:
+        - packed: PackedSegmentation
+        """
+        chunks = []
+        for _, slab in slabs:
+            chunks.append(cls._pack(slab))
+            plane_shape = slab.shape[:3]
+        if not chunks:
+            raise ValueError("Cannot pack a segmentation without slices")
+        bits = np.concatenate(chunks, axis=1)
+        return cls(bits, plane_shape + (bits.shape[1],))
+
+    @property
+    def num_segments(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def _from_planes(self, planes):
+        return PackedSegmentation(planes[None], (1,) + self.shape[1:])
+
+    def union(self, segments=None):
+        """
+        Voxels set in any of the given segments.
 
-    final_images = np.zeros(bitmap.T.shape[:-1] + (3,), dtype=np.uint8)
+        Parameters:
+        - segments: list of int, optional segment indices (default: all segments)
 
-    for segment2d, color in zip(bitmap, colors):
-        for i, slice in enumerate(segment2d.T):
-            bgr_image = cv2.cvtColor(slice, cv2.COLOR_GRAY2BGR)
-            final_images[i] += bgr_image * color
+        Returns:
+        - union: PackedSegmentation with a single segment
+        """
+        bits = self.bits if segments is None else self.bits[list(segments)]
+        return self._from_planes(np.bitwise_or.reduce(bits, axis=0))
 
-    return final_images
+    def overlap(self):
+        """
+        Voxels set in two or more segments.
+
+        Returns:
+        - overlap: PackedSegmentation with a single segment
+        """
+        covered = np.zeros(self.bits.shape[1:], dtype=np.uint8)
+        overlapping = np.zeros_like(covered)
+        for segment_bits in self.bits:
+            overlapping |= covered & segment_bits
+            covered |= segment_bits
+        return self._from_planes(overlapping)
+
+    def voxel_counts(self, per_slice=False):
+        """
+        Count the voxels set in each segment.
+
+        Parameters:
+        - per_slice: bool, if True count per Z-slice
+
+        Returns:
+        - counts: np.ndarray of dtype int64, shape (num_segments,) or (num_segments, Z) if per_slice
+        """
+        if per_slice:
+            return _POPCOUNT[self.bits].sum(axis=-1, dtype=np.int64)
+        # Histogram of byte values, weighted by their number of set bits
+        return np.array([np.bincount(b.ravel(), minlength=256) @ _POPCOUNT for b in self.bits], dtype=np.int64)
+
+    def empty_slices(self):
+        """
+        Find the Z-slices where each segment has no voxel.
+
+        Returns:
+        - empty: np.ndarray of dtype bool and shape (num_segments, Z)
+        """
+        return ~self.bits.any(axis=-1)
+
+    def unpack(self, slices=None, segments=None):
+        """
+        Unpack selected slices and segments to boolean masks.
+
+        Parameters:
+        - slices: list of int or slice, optional Z-slices to unpack (default: all)
+        - segments: list of int, optional segment indices to unpack (default: all)
+
+        Returns:
+        - masks: np.ndarray of dtype bool and shape (num_segments, num_slices, Y, X), in the
+          (Z, Y, X) orientation of label maps
+        """
+        bits = self.bits if segments is None else self.bits[list(segments)]
+        bits = bits[:, slice(None) if slices is None else slices]
+        x_dim, y_dim = self.shape[1:3]
+        planes = np.unpackbits(bits, axis=-1, count=y_dim * x_dim, bitorder="little")
+        return planes.reshape(bits.shape[:2] + (y_dim, x_dim)).view(bool)
 
 def create_dataset_dirs(path):
     for i in ["imagesTr", "imagesTs", "labelsTr", "labelsTs"]:
@@ -160,6 +691,227 @@ def generate_new_segment_data(next_segment_number, name, color):
     }
     return new_segment_data
 
+# Matches the 'Segment<number>_<field>' keys of a .seg.nrrd header
+_SEGMENT_KEY = re.compile(r"Segment(\d+)_(.+)")
+
+@dataclass
+class Segment:
+    """
+    One segment of a .seg.nrrd header.
+
+    Attributes:
+    - index: int, the <number> of its 'Segment<number>_' keys, i.e. its channel in the bitmap
+    - fields: OrderedDict, field name -> value of all its keys in header order (e.g. "Name" -> "CNV")
+    """
+    index: int
+    fields: OrderedDict = field(default_factory=OrderedDict)
+
+    @property
+    def id(self):
+        return self.fields.get("ID")
+
+    @property
+    def name(self):
+        # Read-only: the table indexes segments by name, rename through `SegmentTable.rename`
+        return self.fields.get("Name")
+
+    @property
+    def color(self):
+        return self.fields.get("Color")
+
+    @color.setter
+    def color(self, value):
+        self.fields["Color"] = value
+
+    @property
+    def extent(self):
+        return self.fields.get("Extent")
+
+    @property
+    def label_value(self):
+        value = self.fields.get("LabelValue")
+        return None if value is None else int(value)
+
+    @property
+    def layer(self):
+        value = self.fields.get("Layer")
+        return None if value is None else int(value)
+
+class SegmentTable:
+    """
+    The segments of a .seg.nrrd header, parsed once and indexed by name and by index.
+
+    Usage:
+        table = SegmentTable.from_header(header)
+        idx = table.index_of("RPE")
+        table.append("RET", "0.635 0.0 1.0")
+        header = table.to_header(header)
+    """
+
+    def __init__(self, segments=()):
+        self._segments = sorted(segments, key=lambda s: s.index)
+        self._reindex()
+
+    def _reindex(self):
+        self._by_index = {s.index: s for s in self._segments}
+        # First segment wins for duplicate names, as when scanning the header in order
+        self._by_name = {}
+        for s in self._segments:
+            self._by_name.setdefault(s.name, s)
+
+    @classmethod
+    def from_header(cls, header):
+        """
+        Parse the segments of a .seg.nrrd header.
+
+        Parameters:
+        - header: collections.OrderedDict, the NRRD header as returned by `nrrd.read`
+
+        Returns:
+        - table: SegmentTable
+        """
+        segments = {}
+        for key, value in header.items():
+            match = _SEGMENT_KEY.match(key)
+            if match:
+                index = int(match.group(1))
+                segments.setdefault(index, Segment(index)).fields[match.group(2)] = value
+        return cls(segments.values())
+
+    def __len__(self):
+        return len(self._segments)
+
+    def __iter__(self):
+        return iter(self._segments)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    @property
+    def names(self):
+        return [s.name for s in self._segments]
+
+    @property
+    def last_index(self):
+        """Highest segment index, or -1 if there are no segments."""
+        return self._segments[-1].index if self._segments else -1
+
+    def by_name(self, name):
+        """Return the segment with the given name, or None."""
+        return self._by_name.get(name)
+
+    def by_index(self, index):
+        """Return the segment with the given index, or None."""
+        return self._by_index.get(index)
+
+    def index_of(self, name):
+        """Return the index of the segment with the given name, or None."""
+        segment = self._by_name.get(name)
+        return None if segment is None else segment.index
+
+    def duplicate_names(self):
+        """Return the segment names that occur more than once."""
+        names = self.names
+        return sorted({n for n in names if names.count(n) > 1}, key=names.index)
+
+    def append(self, name, color):
+        """
+        Add a new segment after the last one, with the default fields of `generate_new_segment_data`.
+
+        Parameters:
+        - name: str, the segment name
+        - color: str, the RGB color string (e.g., "0.635 0.0 1.0")
+
+        Returns:
+        - segment: Segment, the new segment
+        """
+        index = self.last_index + 1
+        prefix = f"Segment{index}_"
+        fields = OrderedDict((k[len(prefix):], v)
+                             for k, v in generate_new_segment_data(index, name, color).items())
+        segment = Segment(index, fields)
+        self._segments.append(segment)
+        self._by_index[index] = segment
+        self._by_name.setdefault(name, segment)
+        return segment
+
+    def rename(self, old, new):
+        """
+        Rename a segment and update the name index.
+
+        Parameters:
+        - old: str, the current segment name
+        - new: str, the new segment name
+
+        Returns:
+        - segment: Segment, the renamed segment
+
+        Raises:
+        - KeyError: if no segment is named `old`
+        - ValueError: if `new` is empty or already the name of another segment
+        """
+        segment = self._by_name.get(old)
+        if segment is None:
+            raise KeyError(f"Segment {old} not found")
+        if not isinstance(new, str) or not new:
+            raise ValueError(f"Invalid segment name {new!r}")
+        if new != old and new in self._by_name:
+            raise ValueError(f"Cannot rename {old} to {new}: {new} already exists")
+        segment.fields["Name"] = new
+        self._reindex()
+        return segment
+
+    def remove(self, name):
+        """
+        Remove a segment by name. Following segments are renumbered so that segment indices keep
+        matching the channels of the bitmap once the segment's channel is deleted.
+
+        Parameters:
+        - name: str, the segment name
+
+        Returns:
+        - segment: Segment, the removed segment
+
+        Raises:
+        - KeyError: if no segment has this name
+        """
+        segment = self._by_name.get(name)
+        if segment is None:
+            raise KeyError(f"Segment {name} not found")
+        self._segments.remove(segment)
+        for s in self._segments:
+            if s.index > segment.index:
+                s.index -= 1
+        self._reindex()
+        return segment
+
+    def to_header(self, header):
+        """
+        Build a header with these segments in place of the segments of `header`.
+
+        Non-segment keys keep their order. The segment keys are written where the first segment key
+        of `header` was (or at the end if it had none). `sizes` is not changed.
+
+        Parameters:
+        - header: collections.OrderedDict, the NRRD header to take the non-segment keys from
+
+        Returns:
+        - new_header: OrderedDict
+        """
+        segment_items = [(f"Segment{s.index}_{k}", v) for s in self._segments for k, v in s.fields.items()]
+        new_header = OrderedDict()
+        inserted = False
+        for key, value in header.items():
+            if _SEGMENT_KEY.match(key):
+                if not inserted:
+                    new_header.update(segment_items)
+                    inserted = True
+            else:
+                new_header[key] = value
+        if not inserted:
+            new_header.update(segment_items)
+        return new_header
+
 def get_num_segments(odict):
     """
     Count the number of unique segments defined in the NRRD header.
@@ -170,11 +922,7 @@ def get_num_segments(odict):
     Returns:
     - num_segments: int, the number of unique segments based on 'Segment<number>_' key prefixes
     """
-    return len(set([
-        key.split("_")[0]                      # Extract the 'Segment<number>' prefix
-        for key in odict.keys()
-        if re.match(r"Segment(\d+)_", key)     # Only consider keys starting with 'Segment<number>_'
-    ]))
+    return len(SegmentTable.from_header(odict))
 
 def find_last_segment_position(odict):
     """
@@ -189,16 +937,11 @@ def find_last_segment_position(odict):
     - last_segment_key: str or None, the key associated with the last segment number
                         (e.g., 'Segment3_Color') — None if no segment keys are found
     """
-    last_segment_number = -1
-    last_segment_key = None
-    for key in odict.keys():
-        match = re.match(r"Segment(\d+)_", key)
-        if match:
-            segment_number = int(match.group(1))
-            if segment_number > last_segment_number:
-                last_segment_number = segment_number
-                last_segment_key = key
-    return last_segment_number, last_segment_key
+    table = SegmentTable.from_header(odict)
+    if len(table) == 0:
+        return -1, None
+    last = table.by_index(table.last_index)
+    return last.index, f"Segment{last.index}_{next(iter(last.fields))}"
 
 def segment_name_already_exists(odict, new_segment_name):
     """
@@ -212,15 +955,91 @@ def segment_name_already_exists(odict, new_segment_name):
     Returns:
     - exists: bool, True if a segment with the given name already exists, False otherwise
     """
-    for key, value in odict.items():
-        if key.endswith("_Name") and value == new_segment_name:
-            return True
-    return False
+    return new_segment_name in SegmentTable.from_header(odict)
+
+def add_segments(data, header, new_segments, nrrd_file_path=None, started=False):
+    """
+    Append several new, empty segments to a segmentation bitmap and its NRRD header in one operation.
+
+    The output bitmap is allocated once, the existing segments copied into it and the new channels
+    left empty. Names that already exist are skipped as long as no segment has been added yet
+    (resuming a partially extended file); a name that exists after segments were added raises.
+
+    Parameters:
+    - data: np.ndarray, the existing segmentation bitmap of shape (num_segments, X, Y, Z)
+    - header: collections.OrderedDict, the metadata from the NRRD file
+    - new_segments: dict, segment name -> RGB color string (e.g., {"RET": "0.635 0.0 1.0"}), in order
+    - nrrd_file_path: str, optional path of the file, used in messages
+    - started: bool, if True, segments are treated as already being appended, so any existing name raises
+
+    Returns:
+    - new_data: np.ndarray, bitmap of shape (num_segments + len(added), X, Y, Z), or `data` if nothing was added
+    - new_header: OrderedDict, header with the new segments after the last existing one and updated sizes
+    - added: list of str, names of the segments that were added
+
+    Raises:
+    - ValueError: if a segment name already exists but is being inserted mid-header (not at the end),
+      or if the result fails `verify_segments`
+    """
+    table = SegmentTable.from_header(header)
+    added = []
+    for name, color in new_segments.items():
+        if name in table:
+            if not (started or added):
+                print(f"WARNING: {name} already exists in {nrrd_file_path}. Skipping...")
+                continue
+            raise ValueError(f"ERROR: {name} exists out of position. Check manually in 3DSlicer")
+        table.append(name, color)
+        added.append(name)
+
+    if not added:
+        return data, header, added
+
+    # Allocate the extended bitmap once; NRRD data is written in Fortran order
+    new_data = np.zeros((data.shape[0] + len(added),) + data.shape[1:], dtype=data.dtype, order="F")
+    new_data[:data.shape[0]] = data
+
+    new_header = table.to_header(header)
+    new_header["sizes"] = np.array(new_data.shape)
+    verify_segments(new_data, new_header)
+    return new_data, new_header, added
+
+def verify_segments(data, header, expected_names=None):
+    """
+    Check that a segmentation bitmap and its NRRD header describe the same, consistent set of segments.
+
+    Parameters:
+    - data: np.ndarray, segmentation bitmap of shape (num_segments, X, Y, Z)
+    - header: collections.OrderedDict, NRRD metadata
+    - expected_names: list of str, optional segment names that must all be present
+
+    Returns:
+    - table: SegmentTable, the parsed segments
+
+    Raises:
+    - ValueError: if the segment count, sizes and bitmap disagree, indices are not 0..K-1,
+      names are duplicated or expected names are missing
+    """
+    table = SegmentTable.from_header(header)
+    if not (len(table) == int(header["sizes"][0]) == data.shape[0]):
+        raise ValueError(f"Header has {len(table)} segments and sizes {list(header['sizes'])}, "
+                         f"but the bitmap has shape {data.shape}")
+    if [s.index for s in table] != list(range(len(table))):
+        raise ValueError(f"Segment indices are not consecutive: {[s.index for s in table]}")
+    if table.duplicate_names():
+        raise ValueError(f"Duplicate labels found: {table.names}")
+    if expected_names is not None:
+        missing = [name for name in expected_names if name not in table]
+        if missing:
+            raise ValueError(f"ERROR: Labels {', '.join(missing)} not in final header")
+    return table
 
 def add_segmentation_to_header(data, header, nrrd_file_path, new_segment_name, new_segment_color, startedAddingSegments):
     """
     Add a new segmentation layer to an existing NRRD header and data volume.
 
+    To add several segments, use `add_segments` and write the file once.
+
     Parameters:
     - data: np.ndarray, the existing segmentation bitmap data (3D volume: [segments, height, width])
     - header: collections.OrderedDict, the metadata from the NRRD file
@@ -236,49 +1055,13 @@ def add_segmentation_to_header(data, header, nrrd_file_path, new_segment_name, n
     Raises:
     - ValueError: if the segment name already exists but is being inserted mid-header (not at the end)
     """
-	# Check if the new segment name already exists
-    if segment_name_already_exists(header, new_segment_name):
-        if not startedAddingSegments:
-            print(f"WARNING: {new_segment_name} already exists in {nrrd_file_path}. Skipping...")
-            return False
-        else:
-            raise ValueError(f"ERROR: {new_segment_name} exists out of position. Check manually in 3DSlicer")
-
-	# Get the next segment number by finding the current highest
-    last_segment_number, last_segment_key = find_last_segment_position(header)
-    next_segment_number = last_segment_number + 1
-
-    # Generate new header fields for the new segment
-    new_segment_data = generate_new_segment_data(next_segment_number, new_segment_name, new_segment_color)
-
-	# Append an empty segmentation mask to the data array (shape: [new_segment, H, W])
-    new_bitmap_data = np.append(data, np.zeros([1] + list(data.shape[1:]), dtype=data.dtype), axis=0)
-
-	# Regex pattern to match any 'Segment<number>'-style keys
-    pattern = re.compile(r"Segment(\d+)")
-
-    onLastSegment = False
-    newSegmentAdded = False
-    copied_odict = OrderedDict()
-
-	# Reconstruct the header with the new segment injected after the last existing one
-    for key, value in header.items():
-        if key == "sizes":
-            copied_odict[key] = new_bitmap_data.shape # Update size to reflect new segment count
-        elif re.match(pattern, key):
-            current_segment_num = int(re.match(pattern, key).group(1))
-            if current_segment_num == last_segment_number and not newSegmentAdded:
-                onLastSegment = True # We're at the end of existing segments
-            copied_odict[key] = value
-        else:
-            if onLastSegment and not newSegmentAdded:
-				# Inject new segment metadata here
-                copied_odict.update(new_segment_data)
-                newSegmentAdded = True
-            copied_odict[key] = value
+    new_bitmap_data, new_header, added = add_segments(data, header, {new_segment_name: new_segment_color},
+                                                      nrrd_file_path, started=startedAddingSegments)
+    if not added:
+        return False
 
     # Save the NRRD file with the updated header
-    nrrd.write(nrrd_file_path, new_bitmap_data, copied_odict)
+    nrrd.write(nrrd_file_path, new_bitmap_data, new_header)
     return True
 
 def check_duplicate_labels(header):
@@ -294,15 +1077,11 @@ def check_duplicate_labels(header):
     Raises:
     - ValueError: if duplicate segment names are detected
     """
-    # Collect all values from keys that define segment names
-    labels = [
-        val for key, val in header.items()
-        if re.match(r"Segment(\d+)_", key) and key.endswith("_Name")
-    ]
+    table = SegmentTable.from_header(header)
 
     # Raise an error if duplicates exist
-    if len(labels) != len(set(labels)):
-        raise ValueError(f"Duplicate labels found after processing: {labels}")
+    if table.duplicate_names():
+        raise ValueError(f"Duplicate labels found after processing: {table.names}")
 
     return False  # Explicit return for clarity
 
@@ -318,12 +1097,7 @@ def get_idx_of_label(header, name):
     - segment_number: int, the index of the segment (e.g., 0, 1, 2, ...)
       Returns None if the name is not found.
     """
-    for key, val in header.items():
-        match = re.match(r"Segment(\d+)_", key)
-        if match:
-            if key.endswith("_Name") and val == name:
-                segment_number = int(match.group(1))
-                return segment_number
+    return SegmentTable.from_header(header).index_of(name)
 
 def delete_by_name(data, header, name, original_labels):
     """
@@ -345,17 +1119,17 @@ def delete_by_name(data, header, name, original_labels):
     - If the label is not found, returns a warning string.
     """
     assert name not in original_labels
-    segment_idx = get_idx_of_label(header, name)
+    table = SegmentTable.from_header(header)
+    segment_idx = table.index_of(name)
     if segment_idx == None:
         return f"WARNING! label {name} not found in header"
     # number <7 should be reserved for original labels and not deleted
     assert segment_idx >= 7
 
-    # Remove entries within the header OrderedDict
-    new_header = header.copy()
-    for key in header:
-        if key.startswith(f"Segment{segment_idx}_"):
-            new_header.pop(key)
+    # Remove entries within the header OrderedDict, renumbering any following segments
+    table.remove(name)
+    new_header = table.to_header(header)
+    new_header["sizes"] = np.array(header["sizes"])
     new_header["sizes"][0] -= 1
 
     # Remove corresponding segment channel
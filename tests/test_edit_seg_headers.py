@@ -0,0 +1,55 @@
+from collections import OrderedDict
+
+import nrrd
+import numpy as np
+import pytest
+
+from octvision3d.edit_seg_headers import edit_header
+from octvision3d.utils import SegmentTable
+
+
+def _write_seg(path):
+    header = OrderedDict([
+        ("space", "right-anterior-superior"),
+        ("space directions", np.array([[np.nan] * 3, [1.0, 0, 0], [0, 1.0, 0], [0, 0, 2.0]])),
+        ("kinds", ["list", "domain", "domain", "domain"]),
+        ("encoding", "gzip"),
+        ("space origin", np.zeros(3)),
+        ("Segment0_ID", "Segment_1"),
+        ("Segment0_Name", "HEM"),
+        ("Segment0_Color", "0.250 0.5 0.25"),
+        ("Segment1_ID", "Segment_2"),
+        ("Segment1_Name", "VIT"),
+        ("Segment1_Color", "0.1 0.1 0.1"),
+    ])
+    nrrd.write(str(path), np.zeros((2, 4, 3, 2), dtype=np.uint8), header)
+    return str(path)
+
+
+def test_rename_then_recolor_same_segment(tmp_path):
+    path = _write_seg(tmp_path / "case.seg.nrrd")
+    assert edit_header(path, {"HEM": "SRM"}, {"SRM": "0.9 0.1 0.1"}, {})
+
+    table = SegmentTable.from_header(nrrd.read_header(path))
+    assert "HEM" not in table
+    assert table.by_name("SRM").index == 0
+    assert table.by_name("SRM").color == "0.9 0.1 0.1"
+
+
+def test_chained_renames_apply_in_order(tmp_path):
+    path = _write_seg(tmp_path / "case.seg.nrrd")
+    assert edit_header(path, {"HEM": "SRM", "SRM": "PED"}, {}, {})
+    assert SegmentTable.from_header(nrrd.read_header(path)).names == ["PED", "VIT"]
+
+
+def test_rename_to_existing_name_fails(tmp_path):
+    path = _write_seg(tmp_path / "case.seg.nrrd")
+    with pytest.raises(ValueError):
+        edit_header(path, {"HEM": "VIT"}, {}, {})
+
+
+def test_set_array_field(tmp_path):
+    path = _write_seg(tmp_path / "case.seg.nrrd")
+    assert not edit_header(path, {}, {}, {"space origin": "(0,0,0)"})
+    assert edit_header(path, {}, {}, {"space origin": "(1,2,3)"})
+    np.testing.assert_array_equal(nrrd.read_header(path)["space origin"], [1, 2, 3])
@@ -0,0 +1,50 @@
+import os
+
+from octvision3d.manifest import load_manifest, plan_build, prune_manifest, record_case
+
+
+def _build(manifest, cases, output_folder, convert):
+    stale, fingerprints = plan_build(manifest, cases, output_folder)
+    for name in stale:
+        outputs = convert(name)
+        if outputs is not None:
+            record_case(manifest, name, fingerprints[name], outputs, output_folder)
+    return stale
+
+
+def _write_output(output_folder, name):
+    path = os.path.join(output_folder, f"{name}.tif")
+    with open(path, "w") as f:
+        f.write(name)
+    return [path]
+
+
+def test_failed_rebuild_removes_previous_outputs(tmp_path):
+    output_folder = str(tmp_path / "dataset")
+    os.makedirs(output_folder)
+    source = tmp_path / "case.txt"
+    source.write_text("v1")
+    cases = {"case": {"image": str(source)}}
+
+    manifest = load_manifest(output_folder, options={})
+    _build(manifest, cases, output_folder, lambda name: _write_output(output_folder, name))
+    assert os.listdir(output_folder) == ["case.tif"]
+
+    source.write_text("v2, changed")
+    stale = _build(manifest, cases, output_folder, lambda name: None)
+    assert stale == ["case"]
+    assert manifest["cases"] == {}
+    assert os.listdir(output_folder) == []
+
+
+def test_prune_removes_outputs(tmp_path):
+    output_folder = str(tmp_path / "dataset")
+    os.makedirs(output_folder)
+    source = tmp_path / "case.txt"
+    source.write_text("v1")
+
+    manifest = load_manifest(output_folder, options={})
+    _build(manifest, {"case": {"image": str(source)}}, output_folder,
+           lambda name: _write_output(output_folder, name))
+    assert prune_manifest(manifest, [], output_folder) == ["case"]
+    assert os.listdir(output_folder) == []
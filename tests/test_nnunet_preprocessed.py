@@ -0,0 +1,26 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from octvision3d.nnunet_preprocessed import save_blosc2_case
+
+nnunet_dataset = pytest.importorskip("nnunetv2.training.dataloading.nnunet_dataset")
+
+
+def test_save_blosc2_case(tmp_path):
+    data = np.random.default_rng(0).random((1, 8, 16, 12), dtype=np.float32)
+    seg = np.zeros((1, 8, 16, 12), dtype=np.int16)
+    seg[0, 2:5, 4:9, 3:7] = 1
+    properties = {"spacing": [81.0, 1.0, 2.9]}
+    configuration_manager = SimpleNamespace(patch_size=[8, 16, 12])
+
+    save_blosc2_case(data, seg, properties, str(tmp_path / "case"), configuration_manager)
+    assert sorted(os.listdir(tmp_path)) == ["case.b2nd", "case.pkl", "case_seg.b2nd"]
+
+    loaded_data, loaded_seg, _, loaded_properties = nnunet_dataset.nnUNetDatasetBlosc2(
+        str(tmp_path), ["case"]).load_case("case")
+    np.testing.assert_array_equal(loaded_data[:], data)
+    np.testing.assert_array_equal(loaded_seg[:], seg)
+    assert loaded_properties == properties
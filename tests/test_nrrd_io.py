@@ -0,0 +1,31 @@
+from collections import OrderedDict
+
+import nrrd
+import numpy as np
+import pytest
+
+from octvision3d.nrrd_io import read_label_map, read_label_slices
+
+
+def _write_onehot(path, encoding):
+    rng = np.random.default_rng(0)
+    bitmap = (rng.random((3, 10, 8, 7)) > 0.6).astype(np.uint8)
+    header = OrderedDict([("encoding", encoding)])
+    for k in range(bitmap.shape[0]):
+        header[f"Segment{k}_ID"] = f"Segment_{k + 1}"
+        header[f"Segment{k}_Name"] = f"S{k + 1}"
+    nrrd.write(str(path), bitmap, header)
+    return str(path)
+
+
+@pytest.mark.parametrize("encoding", ["raw", "gzip"])
+def test_read_label_slices_matches_full_read(tmp_path, encoding):
+    path = _write_onehot(tmp_path / "case.seg.nrrd", encoding)
+    indices = [5, 0, 3, 5]
+    np.testing.assert_array_equal(read_label_slices(path, indices), read_label_map(path)[indices])
+
+
+def test_read_label_slices_out_of_range(tmp_path):
+    path = _write_onehot(tmp_path / "case.seg.nrrd", "gzip")
+    with pytest.raises(IndexError):
+        read_label_slices(path, [7])
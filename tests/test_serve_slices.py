@@ -0,0 +1,55 @@
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import pytest
+import tifffile as tif
+
+from octvision3d.serve_slices import SliceRenderer, SliceRequestHandler, find_cases
+
+
+@pytest.fixture
+def server(tmp_path):
+    images, labels = tmp_path / "imagesTr", tmp_path / "labelsTr"
+    images.mkdir()
+    labels.mkdir()
+    tif.imwrite(images / "case_0000.tif", np.full((3, 8, 10), 100, dtype=np.uint8), photometric="minisblack")
+    label_map = np.zeros((3, 8, 10), dtype=np.uint8)
+    label_map[1, 2:4, 2:4] = 15  # SES, the highest label of the octave schema
+    tif.imwrite(labels / "case.tif", label_map, photometric="minisblack")
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), SliceRequestHandler)
+    httpd.renderer = SliceRenderer(find_cases(str(images), str(labels)), prefetch=0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", httpd.renderer
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _status(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_overlay_with_highest_schema_label(server):
+    url, _ = server
+    assert _status(f"{url}/case/case_0000/slice/1?overlay=1") == 200
+
+
+def test_missing_slice_and_case_are_404(server):
+    url, _ = server
+    assert _status(f"{url}/case/case_0000/slice/3") == 404
+    assert _status(f"{url}/case/other/slice/0") == 404
+
+
+def test_render_error_is_not_404(server):
+    url, renderer = server
+    image, labels, _ = renderer.volume("case_0000")
+    renderer.volumes.put("case_0000", (image, labels, np.zeros((2, 3), dtype=np.uint8)))
+    assert _status(f"{url}/case/case_0000/slice/1?overlay=1") == 500
@@ -0,0 +1,41 @@
+import argparse
+
+import numpy as np
+import pytest
+import tifffile as tif
+
+from octvision3d.tiff_io import add_tiff_writer_args, tiff_writer_options, write_tiff
+
+
+def _options(*args):
+    parser = argparse.ArgumentParser()
+    add_tiff_writer_args(parser)
+    return tiff_writer_options(parser.parse_args(list(args)))
+
+
+def test_compression_level_rejected_for_lzw():
+    with pytest.raises(ValueError, match="compression_level"):
+        _options("--compression", "lzw", "--compression_level", "5")
+
+
+def test_tile_must_be_a_multiple_of_16():
+    assert _options("--tile", "0")["tile"] == 0
+    for tile in ["-16", "24"]:
+        with pytest.raises(ValueError, match="--tile"):
+            _options("--tile", tile)
+
+
+@pytest.mark.parametrize("args", [("--compression", "lzw"),
+                                  ("--compression", "zlib", "--compression_level", "3", "--tile", "16")])
+def test_write_tiff_round_trip(tmp_path, args):
+    data = np.arange(2 * 32 * 48, dtype=np.uint16).reshape(2, 32, 48)
+    path = str(tmp_path / "volume.tif")
+    write_tiff(path, data, _options(*args))
+    np.testing.assert_array_equal(tif.imread(path), data)
+
+
+def test_lzw_ignores_compression_level_in_options(tmp_path):
+    data = np.zeros((2, 16, 16), dtype=np.uint8)
+    path = str(tmp_path / "volume.tif")
+    write_tiff(path, data, {"compression": "lzw", "compression_level": 5})
+    np.testing.assert_array_equal(tif.imread(path), data)
@@ -0,0 +1,18 @@
+import numpy as np
+
+from octvision3d.label_schemas import LABEL_SCHEMAS
+from octvision3d.utils import get_OCT_colors, render_labels
+
+
+def test_OCT_colors_cover_label_schemas():
+    colors = get_OCT_colors()
+    for name, labels in LABEL_SCHEMAS.items():
+        assert max(labels.values()) < len(colors), name
+
+
+def test_render_labels_highest_octave_label():
+    labels = np.array([[0, LABEL_SCHEMAS["octave"]["SES"]]], dtype=np.uint8)
+    image = np.full(labels.shape, 100, dtype=np.uint8)
+    rgb = render_labels(labels, get_OCT_colors(), image=image, alpha=1.0)
+    np.testing.assert_array_equal(rgb[0, 0], [100, 100, 100])
+    np.testing.assert_array_equal(rgb[0, 1], get_OCT_colors()[15])